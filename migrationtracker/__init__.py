@@ -0,0 +1,66 @@
+'''
+MigrationTracker estimates the stock of migrants by destination and origin from the reach estimates
+of the Facebook Marketing Api.
+
+The public functions and classes are importable from the package itself, e.g.
+
+    from migrationtracker import gen_mig_table, ReachEngine
+
+but every module is imported only when one of its names is first used, and pandas, numpy and
+facebook_business are imported only by the functions that need them, so that importing the package
+(or running a short command such as python -m migrationtracker plan) takes a few milliseconds.
+'''
+
+import importlib
+
+# The module of every public name
+_EXPORTS = {
+    'analysis_utils': ['get_panel', 'at_floor', 'reach_intervals', 'migrant_shares', 'share_intervals',
+                       'adjusted_stocks', 'stock_intervals', 'penetration', 'monthly_changes',
+                       'significant_changes'],
+    'age_str_utils': ['GENDERS', 'get_age_str_spec', 'get_age_str_specs', 'get_age_str_sweep', 'build_age_str_dict',
+                      'get_age_structure_table_mig', 'get_age_structure_table_countries',
+                      'get_all_age_structure_tables'],
+    'backend_utils': ['round_reach', 'reach_bounds', 'FacebookBackend', 'SimulatorBackend', 'get_backend'],
+    'cache_utils': ['normalize_spec', 'spec_key', 'ReachCache'],
+    'catalog_utils': ['CountryCatalog', 'get_catalog'],
+    'dem_utils': ['get_age_groups'],
+    'engine_utils': ['ReachEngine', 'get_engine'],
+    'export_utils': ['export_age_str_dict', 'export_age_str_tables', 'load_age_str_tables'],
+    'instrument_utils': ['Instrumentation'],
+    'journal_utils': ['JobJournal'],
+    'migration_utils': ['gen_mig_table', 'get_mig_sweep', 'get_mig_specs', 'get_mig_table_timeout', 'get_mig_table', 'resume',
+                        'get_destinations', 'get_origins', 'check_countries'],
+    'plan_utils': ['SweepPlan', 'plan_sweep'],
+    'pool_utils': ['EnginePool'],
+    'query_utils': ['QueryGraph', 'get_tables', 'aggregate_age_groups'],
+    'rate_utils': ['TokenBucket', 'ThrottleController'],
+    'refresh_utils': ['RefreshPolicy'],
+    'region_utils': ['gen_region_table', 'reconcile_regions'],
+    'store_utils': ['SnapshotStore'],
+    'sweep_utils': ['Axis', 'Sweep', 'run_sweep', 'destination_axis', 'subdivision_axis', 'origin_axis', 'gender_axis',
+                    'age_axis'],
+    'stream_utils': ['ReachRecord', 'stream_requests', 'stream_mig_table', 'stream_age_structure', 'astream'],
+    'table_utils': ['ResultBuffer'],
+}
+
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+def __getattr__(name):
+
+    if name in _MODULES:
+        value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+        # cached, so that __getattr__ is called only the first time
+        globals()[name] = value
+        return value
+
+    if name in _EXPORTS or name == 'benchmark_utils':
+        return importlib.import_module('.' + name, __name__)
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,211 @@
+'''
+Command line interface of MigrationTracker, e.g.
+
+    python -m migrationtracker plan --destinations Italy,Spain --origins all
+    python -m migrationtracker validate --destinations Itlay
+    python -m migrationtracker sweep --job-id 2024-05 --store mig_store --snapshot 2024-05-01
+    python -m migrationtracker resume 2024-05 --output mig_table.csv
+
+The access token and the user id are read from the FB_ACCESS_TOKEN and FB_USER_ID environment
+variables unless they are passed as options; --simulator N runs everything against a
+SimulatorBackend with N countries instead. Only the modules each command needs are imported, so
+plan and validate start without loading pandas or numpy.
+'''
+
+import argparse
+import datetime
+import difflib
+import json
+import os
+import sys
+
+def parse_countries(value):
+
+    '''
+    Turns a comma separated list of countries into a list, 'all' is kept as it is.
+    '''
+
+    if value == 'all':
+        return value
+
+    return [country.strip() for country in value.split(',') if country.strip()]
+
+def get_backend(arguments):
+
+    from .backend_utils import SimulatorBackend, get_backend
+
+    if arguments.simulator:
+        return SimulatorBackend(n_countries=arguments.simulator, calls_per_hour=arguments.calls_per_hour)
+
+    return get_backend(arguments.access_token, arguments.user_id)
+
+def get_engine(arguments, backend):
+
+    from .cache_utils import ReachCache
+    from .engine_utils import ReachEngine
+    from .rate_utils import TokenBucket
+
+    cache = ReachCache(arguments.cache) if arguments.cache else None
+    limiter = TokenBucket(rate=arguments.rate) if arguments.rate else None
+
+    return ReachEngine(arguments.user_id, limiter=limiter, cache=cache, max_workers=arguments.workers,
+                       batch_size=arguments.batch_size, backend=backend)
+
+def write_table(arguments, mig_table, age_min, age_max):
+
+    if arguments.output:
+        mig_table.to_csv(arguments.output)
+
+    if arguments.store:
+        from .store_utils import SnapshotStore
+        SnapshotStore(arguments.store).append_mig_table(mig_table, arguments.snapshot, age_min, age_max)
+
+    if not arguments.output and not arguments.store:
+        mig_table.to_csv(sys.stdout)
+
+def plan(arguments):
+
+    from .plan_utils import plan_sweep
+
+    backend = get_backend(arguments)
+    cache = None
+
+    if arguments.cache:
+        from .cache_utils import ReachCache
+        cache = ReachCache(arguments.cache)
+
+    sweep_plan = plan_sweep(arguments.access_token, arguments.user_id, arguments.destinations, arguments.origins,
+                            arguments.age_min, arguments.age_max, tables=arguments.tables, backend=backend,
+                            cache=cache, rate=arguments.rate, shard_calls=arguments.shard_calls)
+
+    print(json.dumps(sweep_plan.summary(), indent=4))
+
+    return 0
+
+def validate(arguments):
+
+    from .catalog_utils import get_catalog
+
+    catalog = get_catalog(arguments.access_token, backend=get_backend(arguments))
+    unknown = 0
+
+    for kind, countries, lookup, names in [('destination', arguments.destinations, catalog.destination, catalog.destinations),
+                                           ('origin', arguments.origins, catalog.origin, catalog.origins)]:
+
+        if countries == 'all':
+            continue
+
+        for country in countries:
+
+            if lookup(country) is not None:
+                continue
+
+            unknown += 1
+            suggestions = difflib.get_close_matches(country, list(names), n=3)
+            print('Unknown {} {!r}{}'.format(kind, country,
+                  ', did you mean {}?'.format(' or '.join(map(repr, suggestions))) if suggestions else ''))
+
+    if not unknown:
+        print('All countries are available')
+
+    return 1 if unknown else 0
+
+def sweep(arguments):
+
+    from .migration_utils import gen_mig_table
+
+    age_min = 18 if arguments.age_min is None else arguments.age_min
+    age_max = 65 if arguments.age_max is None else arguments.age_max
+
+    backend = get_backend(arguments)
+    mig_table, _, _, _ = gen_mig_table(arguments.access_token, arguments.user_id, arguments.destinations, arguments.origins,
+                                       age_min, age_max, engine=get_engine(arguments, backend),
+                                       job_id=arguments.job_id, journal_dir=arguments.journal_dir)
+
+    write_table(arguments, mig_table, age_min, age_max)
+
+    return 0
+
+def resume(arguments):
+
+    from .journal_utils import JobJournal
+    from .migration_utils import resume
+
+    job, _ = JobJournal(arguments.job_id, arguments.journal_dir).read()
+
+    backend = get_backend(arguments)
+    mig_table, _, _, _ = resume(arguments.job_id, arguments.access_token, arguments.user_id, arguments.journal_dir,
+                                engine=get_engine(arguments, backend))
+
+    write_table(arguments, mig_table, job['age_min'], job['age_max'])
+
+    return 0
+
+def get_parser():
+
+    parser = argparse.ArgumentParser(prog='migrationtracker',
+                                     description='Estimates the stock of migrants from the Facebook Marketing Api.')
+
+    credentials = argparse.ArgumentParser(add_help=False)
+    credentials.add_argument('--access-token', default=os.environ.get('FB_ACCESS_TOKEN'),
+                             help='facebook user access token (default: $FB_ACCESS_TOKEN)')
+    credentials.add_argument('--user-id', default=os.environ.get('FB_USER_ID'),
+                             help='facebook user id (default: $FB_USER_ID)')
+    credentials.add_argument('--simulator', type=int, default=None, metavar='N',
+                             help='use a SimulatorBackend with N countries instead of the api')
+    credentials.add_argument('--calls-per-hour', type=int, default=None,
+                             help='hourly call limit of the simulator')
+
+    countries = argparse.ArgumentParser(add_help=False)
+    countries.add_argument('--destinations', type=parse_countries, default='all',
+                           help='comma separated destinations or all (default)')
+    countries.add_argument('--origins', type=parse_countries, default='all',
+                           help='comma separated origins or all (default)')
+    countries.add_argument('--age-min', type=int, default=None)
+    countries.add_argument('--age-max', type=int, default=None)
+
+    running = argparse.ArgumentParser(add_help=False)
+    running.add_argument('--cache', default=None, help='SQLite file of the ReachCache')
+    running.add_argument('--rate', type=float, default=None, help='maximum calls per second')
+    running.add_argument('--workers', type=int, default=4)
+    running.add_argument('--batch-size', type=int, default=None)
+    running.add_argument('--journal-dir', default='journals')
+    running.add_argument('--output', default=None, help='csv file the table is written to')
+    running.add_argument('--store', default=None, help='SnapshotStore directory the table is added to')
+    running.add_argument('--snapshot', default=datetime.date.today().isoformat(),
+                         help='date of the snapshot in the store (default: today)')
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('plan', parents=[credentials, countries],
+                                  help='count the calls a sweep would make, without making them')
+    command.add_argument('--tables', type=lambda value: value.split(','), default=['mig_table'],
+                         help='comma separated tables among mig_table, age_structure_mig and age_structure_countries')
+    command.add_argument('--cache', default=None, help='SQLite file of the ReachCache')
+    command.add_argument('--rate', type=float, default=None, help='calls per second assumed')
+    command.add_argument('--shard-calls', type=int, default=None, help='maximum number of calls per shard')
+    command.set_defaults(function=plan)
+
+    command = commands.add_parser('validate', parents=[credentials, countries],
+                                  help='check that the countries are available')
+    command.set_defaults(function=validate)
+
+    command = commands.add_parser('sweep', parents=[credentials, countries, running], help='build the mig_table')
+    command.add_argument('--job-id', default=None, help='journal the sweep so that it can be resumed')
+    command.set_defaults(function=sweep)
+
+    command = commands.add_parser('resume', parents=[credentials, running], help='complete an interrupted sweep')
+    command.add_argument('job_id')
+    command.set_defaults(function=resume)
+
+    return parser
+
+def main(argv=None):
+
+    arguments = get_parser().parse_args(argv)
+
+    return arguments.function(arguments)
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,203 @@
+from .engine_utils import get_engine
+from .catalog_utils import get_catalog
+from .migration_utils import check_countries
+from .sweep_utils import Sweep, destination_axis, origin_axis, gender_axis, age_axis
+from .table_utils import ResultBuffer
+
+GENDERS = {1:{'name' : 'male'}, 2:{'name' : 'female'}}
+
+def get_age_str_spec(country_code, gender, age_group, origin = None):
+    
+    '''
+    Returns the targeting spec of the people of a given gender and age group living in the country
+    with code country_code. If origin is passed (a value of the origins of the CountryCatalog)
+    only the ex-pats of that origin are targeted.
+    '''
+    
+    spec = {'geo_locations':{'countries':[country_code]},
+            'genders': [gender],
+            'age_min': age_group[0],
+            }
+    
+    if len(age_group) > 1:
+        spec['age_max'] = age_group[1]
+    
+    if origin is not None:
+        spec['behaviors'] = [{'id': origin['id'], 'name': origin['name']}]
+    
+    return spec
+
+def get_age_str_sweep(destinations, origins, dest_dict, origin_dict, age_min = 13, age_max = 65, age_groups = None):
+    
+    '''
+    Returns the Sweep of the age-sex structure tables of the destination-origin pairs, whose cells
+    are (destination, origin, gender, age_group) tuples, or (destination, gender, age_group) tuples
+    targeting the whole population of each destination if origins is None. The age groups are the
+    ones of get_age_groups(age_min, age_max) unless a dictionary with the same structure is passed
+    through age_groups.
+    '''
+    
+    axes = [destination_axis(destinations, dest_dict)]
+    
+    if origins is not None:
+        axes.append(origin_axis(origins, origin_dict))
+    
+    return Sweep(axes + [gender_axis(GENDERS), age_axis(age_min, age_max, age_groups)])
+
+def get_age_str_specs(destinations, origins, dest_dict, origin_dict, age_min = 13, age_max = 65, age_groups = None):
+    
+    '''
+    Returns a dictionary whose keys are (destination, origin, gender, age_group) tuples and whose
+    values are the targeting specs needed to build the age-sex structure tables of the
+    destination-origin pairs. If origins is None the keys are (destination, gender, age_group)
+    tuples and the specs target the whole population of each destination (see get_age_str_sweep).
+    '''
+    
+    return dict(get_age_str_sweep(destinations, origins, dest_dict, origin_dict, age_min, age_max, age_groups).specs())
+
+def build_age_str_dict(results, destinations, origins, age_groups):
+    
+    '''
+    Builds the output of the age structure functions from a dictionary of results keyed like the
+    specs of get_age_str_specs. Pairs (or destinations, if origins is None) with a missing result
+    are left out.
+    '''
+    
+    axes = {'destination': destinations}
+    
+    if origins is not None:
+        axes['origin'] = origins
+    
+    axes['gender'] = list(GENDERS)
+    axes['age_group'] = list(age_groups)
+    
+    buffer = ResultBuffer(axes, {'gender': [GENDERS[gender]['name'] for gender in GENDERS],
+                                 'age_group': [age_groups[age_group]['name'] for age_group in age_groups]})
+    buffer.fill(results)
+    
+    return buffer_to_age_str_dict(buffer)
+
+def buffer_to_age_str_dict(buffer):
+    
+    '''
+    Builds the output of the age structure functions from the ResultBuffer of a sweep of
+    get_age_str_sweep. Pairs (or destinations) with a missing result are left out.
+    '''
+
+    import numpy as np
+    import pandas as pd
+    
+    destinations = buffer.axes['destination']
+    origins = buffer.axes.get('origin')
+    age_groups_names = buffer.coords['age_group']
+    genders_names = buffer.coords['gender']
+    
+    age_str_dict = {}
+    
+    for i, destination in enumerate(destinations):
+        for j, origin in enumerate([None] if origins is None else origins):
+            
+            values = buffer.values[i] if origins is None else buffer.values[i, j]
+            
+            if np.isnan(values).any():
+                continue
+            
+            age_str_table = pd.DataFrame(values.T, index=age_groups_names, columns=genders_names)
+            
+            if origins is None:
+                age_str_dict[destination] = {'age_structure_table' : age_str_table}
+            else:
+                age_str_dict.setdefault(destination, {})[origin] = {'age_structure_table' : age_str_table}
+    
+    return age_str_dict
+
+def get_age_structure_table_mig(access_token, user_id, destinations, origins, age_min=13, age_max=65, delay=0,
+                                engine=None, max_workers=4, backend=None):
+    
+    '''
+    This function creates a table for each destination-origin pair with the sex-age structure of
+    the corresponding population. Age groups contain five years each and are constructed so that
+    the lower age limit is always a multiple of five with the exception of the first and the last
+    group. The output of the function is a dictionary with destinations as the keys, origins as the
+    primary features, and an age-sex structure table for every pair. The requests are run
+    concurrently by engine (or by a new ReachEngine allowing one call every delay seconds and
+    sending them to backend).
+    '''
+    
+    engine = get_engine(user_id, engine, delay=delay, max_workers=max_workers, 
+                        backend=backend, access_token=access_token)
+    
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+    
+    check_countries(destinations,dest_dict)
+    check_countries(origins,origin_dict)
+    
+    sweep = get_age_str_sweep(destinations, origins, dest_dict, origin_dict, age_min, age_max)
+    buffer, errors = sweep.run(engine, desc='age_structure_mig')
+    
+    for error in set(map(str, errors.values())):
+        print(error)
+    
+    return buffer_to_age_str_dict(buffer)
+
+def get_age_structure_table_countries(access_token, user_id, destinations, age_min=13, age_max=65, delay=0,
+                                      engine=None, max_workers=4, backend=None):
+    
+    '''
+    This function creates a table for each destination  with the sex-age structure of
+    the corresponding population. Age groups contain five years each and are constructed so that
+    the lower age limit is always a multiple of five with the exception of the first and the last
+    group. The output of the function is a dictionary with destinations as the keys and an age-sex
+    structure table for each one of them. The requests are run concurrently by engine (or by a new
+    ReachEngine allowing one call every delay seconds and sending them to backend).
+    '''
+    
+    engine = get_engine(user_id, engine, delay=delay, max_workers=max_workers, 
+                        backend=backend, access_token=access_token)
+    
+    dest_dict = get_catalog(access_token, backend=engine.backend).destinations
+    check_countries(destinations,dest_dict)
+    
+    sweep = get_age_str_sweep(destinations, None, dest_dict, None, age_min, age_max)
+    buffer, errors = sweep.run(engine, desc='age_structure_countries')
+    
+    for error in set(map(str, errors.values())):
+        print(error)
+    
+    return buffer_to_age_str_dict(buffer)
+        
+def get_all_age_structure_tables(access_token, user_id, destinations, origins, age_min=13, age_max=65, delay=0,
+                                 engine=None, max_workers=4, backend=None):
+    
+    '''
+    Returns the output of get_age_structure_table_mig where, for every destination, the age-sex
+    structure table of the whole country is added under the destination itself. The migrant and
+    country tables are requested together through get_tables, so that every distinct targeting spec
+    is fetched only once.
+    '''
+    
+    # imported here since query_utils builds on the functions of this module
+    from .query_utils import get_tables
+    
+    engine = get_engine(user_id, engine, delay=delay, max_workers=max_workers, 
+                        backend=backend, access_token=access_token)
+    
+    tables = get_tables(access_token, 
+                        user_id, 
+                        destinations, 
+                        origins, 
+                        tables=('age_structure_mig', 'age_structure_countries'),
+                        age_min=age_min, 
+                        age_max=age_max,
+                        engine=engine)
+    
+    age_str_dict_mig = tables['age_structure_mig']
+    age_str_dict_countries = tables['age_structure_countries']
+    
+    for country in age_str_dict_countries:
+        
+        age_str_dict_mig.setdefault(country, {})[country] = age_str_dict_countries[country]
+    
+    return age_str_dict_mig
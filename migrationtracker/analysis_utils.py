@@ -0,0 +1,203 @@
+from .backend_utils import reach_bounds
+
+TOTAL = 'Total Population'
+
+def get_panel(data, age_group=None):
+
+    '''
+    Returns a panel of migration tables: a DataFrame whose index is a (snapshot, destination)
+    MultiIndex, with the snapshots as dates, and whose columns are the origins followed by
+    'Total Population'. All the other functions of this module take such a panel (the ones that do
+    not compare snapshots also take a single table returned by gen_mig_table). data can be:
+
+        - a dictionary whose keys are the snapshots (dates or strings like '2019-07-01' or
+          '07_2019') and whose values are tables returned by gen_mig_table;
+        - a SnapshotStore, or a long DataFrame read from one: the cells of gender 'all' of
+          age_group are used, by default the only age group stored for them;
+        - a panel, which is returned as it is.
+    '''
+
+    import pandas as pd
+
+    from .store_utils import SnapshotStore, to_snapshot_date
+
+    if isinstance(data, SnapshotStore):
+        data = data.read(genders='all', age_groups=age_group, columns=['snapshot', 'destination', 'origin',
+                                                                         'age_group', 'gender', 'reach'])
+
+    if isinstance(data, dict):
+
+        panel = pd.concat({to_snapshot_date(snapshot): table for snapshot, table in data.items()},
+                          names=['snapshot', 'destination'])
+        panel.index = panel.index.set_levels(pd.to_datetime(panel.index.levels[0]), level=0)
+
+    elif 'reach' in data.columns:
+
+        cells = data[data['gender'] == 'all']
+
+        if age_group is not None:
+            cells = cells[cells['age_group'] == age_group]
+        elif cells['age_group'].nunique() > 1:
+            raise ValueError('Several age groups are stored for gender all, pass one through age_group')
+
+        panel = cells.set_index(['snapshot', 'destination', 'origin'])['reach'].unstack('origin')
+        panel.columns.name = None
+
+        origins = [origin for origin in panel.columns if origin != TOTAL]
+        panel = panel[origins + ([TOTAL] if TOTAL in panel.columns else [])]
+
+    else:
+        panel = data
+
+    return panel.sort_index(level=0, sort_remaining=False) if panel.index.nlevels > 1 else panel
+
+def _split(panel):
+
+    origins = [origin for origin in panel.columns if origin != TOTAL]
+
+    return panel[origins], panel[TOTAL]
+
+def at_floor(panel, floor=1000):
+
+    '''
+    Returns a boolean frame telling which cells of the panel are at Facebook's floor (the cells
+    whose true reach is anywhere between 0 and 1050).
+    '''
+
+    return panel <= floor
+
+def reach_intervals(panel):
+
+    '''
+    Returns two frames like the panel with the lower and upper bounds of the true numbers of users
+    that Facebook rounds to every cell (see reach_bounds).
+    '''
+
+    import pandas as pd
+
+    lower, upper = reach_bounds(panel.to_numpy(dtype=float))
+
+    return (pd.DataFrame(lower, index=panel.index, columns=panel.columns),
+            pd.DataFrame(upper, index=panel.index, columns=panel.columns))
+
+def migrant_shares(panel, floor_value=None):
+
+    '''
+    Returns the share of the users of every destination who are migrants from every origin, i.e. the
+    origin columns divided by 'Total Population'. The cells at the 1000 floor are divided as they are
+    unless floor_value is passed, e.g. 0, 525 (the middle of their interval) or np.nan to drop them.
+    '''
+
+    import numpy as np
+
+    origins, total = _split(panel)
+
+    if floor_value is not None:
+        origins = origins.mask(at_floor(origins), floor_value)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return origins.div(total, axis=0)
+
+def share_intervals(panel):
+
+    '''
+    Returns the lower and upper bounds of the migrant shares that are consistent with the rounding
+    of both the migrants and the total population: the smallest number of migrants over the largest
+    population and the other way round.
+    '''
+
+    import numpy as np
+
+    lower, upper = reach_intervals(panel)
+    lower_origins, lower_total = _split(lower)
+    upper_origins, upper_total = _split(upper)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return lower_origins.div(upper_total, axis=0), upper_origins.div(lower_total, axis=0)
+
+def _population(panel, population):
+
+    '''
+    Aligns external population figures with the rows of the panel.
+    '''
+
+    import pandas as pd
+
+    population = pd.Series(population)
+
+    if population.index.nlevels > 1:
+        values = population.reindex(panel.index)
+    else:
+        values = population.reindex(panel.index.get_level_values(-1))
+
+    return pd.Series(values.to_numpy(dtype=float), index=panel.index)
+
+def adjusted_stocks(panel, population, floor_value=None):
+
+    '''
+    Returns the penetration-adjusted stocks of migrants. Facebook reaches a different fraction of the
+    population of every destination (its penetration, 'Total Population' over the official
+    population), so the migrants it reports are divided by the penetration of their destination,
+    which is the same as multiplying their share by the population. population holds the external
+    population figures of the destinations for the same age range as the panel, as a Series (or a
+    dictionary) indexed by destination, or by (snapshot, destination) for figures that change over
+    time. floor_value is passed to migrant_shares.
+    '''
+
+    return migrant_shares(panel, floor_value).mul(_population(panel, population), axis=0)
+
+def stock_intervals(panel, population):
+
+    '''
+    Returns the lower and upper bounds of the penetration-adjusted stocks of adjusted_stocks that are
+    consistent with the rounding of Facebook's estimates.
+    '''
+
+    population = _population(panel, population)
+    lower, upper = share_intervals(panel)
+
+    return lower.mul(population, axis=0), upper.mul(population, axis=0)
+
+def penetration(panel, population):
+
+    '''
+    Returns the share of the population of every destination that Facebook reaches, for every
+    snapshot.
+    '''
+
+    return _split(panel)[1] / _population(panel, population)
+
+def monthly_changes(panel, relative=False):
+
+    '''
+    Returns the change of every cell from the previous snapshot of the same destination (NaN for the
+    first one), as a difference or, if relative is True, as a fraction of the previous value. The
+    snapshots are the ones of the panel, so a missing month makes the change span two months.
+    '''
+
+    if relative:
+        return panel.groupby(level='destination', sort=False).pct_change(fill_method=None)
+
+    return panel.groupby(level='destination', sort=False).diff()
+
+def significant_changes(panel):
+
+    '''
+    Returns a frame with 1 where a cell rose from the previous snapshot of its destination by more
+    than the rounding can explain (the intervals of the two estimates, see reach_intervals, do not
+    overlap), -1 where it fell and 0 otherwise (NaN for the first snapshot). A cell staying at the
+    1000 floor, or moving within the rounding, never counts as a change.
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    lower, upper = reach_intervals(panel)
+
+    previous_lower = lower.groupby(level='destination', sort=False).shift()
+    previous_upper = upper.groupby(level='destination', sort=False).shift()
+
+    changes = np.where(lower > previous_upper, 1.0, np.where(upper < previous_lower, -1.0, 0.0))
+    changes[np.isnan(previous_lower.to_numpy()) | np.isnan(lower.to_numpy())] = np.nan
+
+    return pd.DataFrame(changes, index=panel.index, columns=panel.columns)
@@ -0,0 +1,511 @@
+import collections
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+
+from .cache_utils import normalize_spec
+
+# Error codes the Marketing Api uses to signal that a rate limit has been hit
+RATE_LIMIT_CODES = {4, 17, 32, 613, 80004}
+
+# Error codes the Marketing Api uses for expired or revoked tokens and missing permissions
+AUTH_ERROR_CODES = {10, 102, 190, 200, 272}
+
+def round_reach(users):
+
+    '''
+    Rounds a number of users the way Facebook does in its reach estimates: estimates are given with
+    two significant digits and are never lower than 1000.
+    '''
+
+    if users <= 1000:
+        return 1000.0
+
+    digits = int(math.floor(math.log10(users))) - 1
+
+    return float(round(users / 10 ** digits) * 10 ** digits)
+
+def reach_bounds(users):
+
+    '''
+    Returns the lower and upper bounds of the true numbers of users that Facebook rounds to the
+    estimates in users (a number or an array): half a unit of the second significant digit around
+    the estimate, and from 0 to 1050 for the estimates at the 1000 floor.
+    '''
+
+    import numpy as np
+
+    users = np.asarray(users, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_unit = 10 ** (np.floor(np.log10(np.maximum(users, 1))) - 1) / 2
+
+    floor = users <= 1000
+
+    lower = np.where(floor, 0.0, users - half_unit)
+    upper = np.where(floor, 1050.0, users + half_unit)
+
+    return lower, upper
+
+class FacebookBackend:
+
+    '''
+    The estimate backend that calls the Facebook Marketing Api through the facebook_business package.
+    Every backend has its own api session and does not change the default api of facebook_business,
+    so that several backends with different credentials can be used in the same process.
+
+    Arguments:
+
+        - user_id: your facebook user id (the ad account used for the reach estimates);
+        - access_token: your facebook user access token, find out more at
+                        https://developers.facebook.com/docs/marketing-api/access.
+    '''
+
+    catalog_path = 'country_catalog.json'
+
+    def __init__(self, user_id=None, access_token=None):
+
+        self.user_id = user_id
+        self.access_token = access_token
+
+        self._api = None
+        self._lock = threading.Lock()
+
+    @property
+    def api(self):
+
+        '''
+        The api session of the backend. It is only created (and facebook_business imported) at the
+        first call, so that a backend whose country catalog is already on disk costs nothing.
+        '''
+
+        with self._lock:
+
+            if self._api is None:
+
+                from facebook_business.api import FacebookAdsApi
+                from facebook_business.session import FacebookSession
+
+                if self.access_token is None:
+                    self._api = FacebookAdsApi.get_default_api()
+                else:
+                    self._api = FacebookAdsApi(FacebookSession(access_token=self.access_token))
+
+            return self._api
+
+    def set_access_token(self, access_token):
+
+        '''
+        Makes the backend call the api with access_token from now on.
+        '''
+
+        with self._lock:
+            self.access_token = access_token
+            self._api = None
+
+    def reach_estimate(self, targeting_spec):
+
+        '''
+        Makes a single reach estimate call and returns the number of users together with the
+        headers of the response.
+        '''
+
+        from facebook_business.adobjects.adaccount import AdAccount
+
+        params = {'targeting_spec': targeting_spec}
+
+        cursor = AdAccount(self.user_id, api=self.api).get_reach_estimate(fields=[], params=params)
+
+        return cursor[0]['users'], cursor.headers()
+
+    def reach_estimate_batch(self, targeting_specs):
+
+        '''
+        Sends the reach estimate calls of all the targeting specs in a single Graph Api batch
+        request and returns, for each spec, either a (users, headers) tuple or the error raised
+        for that item.
+        '''
+
+        from facebook_business.adobjects.adaccount import AdAccount
+
+        batch = self.api.new_batch()
+        outcomes = [None] * len(targeting_specs)
+
+        def success(position, response):
+            data = response.json()['data']
+            data = data[0] if isinstance(data, list) else data
+            outcomes[position] = (data['users'], response.headers())
+
+        def failure(position, response):
+            outcomes[position] = response.error()
+
+        for position, spec in enumerate(targeting_specs):
+            AdAccount(self.user_id, api=self.api).get_reach_estimate(fields=[],
+                                                                     params={'targeting_spec': spec},
+                                                                     batch=batch,
+                                                                     success=lambda response, position=position:
+                                                                         success(position, response),
+                                                                     failure=lambda response, position=position:
+                                                                         failure(position, response))
+
+        # execute returns a new batch with the requests that got no answer, if any
+        unanswered = batch.execute()
+        if unanswered is not None:
+            unanswered.execute()
+
+        return [RuntimeError('The batch request returned no answer') if outcome is None else outcome
+                for outcome in outcomes]
+
+    def is_rate_limit_error(self, error):
+
+        '''
+        Returns True if the error raised by the Facebook Marketing Api means that we hit a call limit.
+        '''
+
+        from facebook_business.exceptions import FacebookRequestError
+
+        return isinstance(error, FacebookRequestError) and error.api_error_code() in RATE_LIMIT_CODES
+
+    def is_auth_error(self, error):
+
+        '''
+        Returns True if the error means that the access token has expired or was revoked, or that it
+        cannot use the ad account.
+        '''
+
+        from facebook_business.exceptions import FacebookRequestError
+
+        return isinstance(error, FacebookRequestError) and error.api_error_code() in AUTH_ERROR_CODES
+
+    def destinations(self):
+
+        '''
+        Downloads the dictionary of available destinations names and corresponding codes.
+        '''
+
+        from facebook_business.adobjects.targetingsearch import TargetingSearch
+
+        params = {
+        'type': 'adgeolocation',
+        'location_types': ['country'],
+        'limit': 1000,
+        }
+
+        resp = TargetingSearch.search(params=params, api=self.api)
+
+        country_dict = {}
+
+        for item in resp:
+            country_dict[item['name']] = {'code': item['country_code']}
+
+        return country_dict
+
+    def subdivisions(self, country_code, location_type='region', query=''):
+
+        '''
+        Downloads the dictionary of the regions (or, with location_type='city', the cities) of the
+        country with code country_code, whose names are the keys and whose values hold the key of
+        the location. Facebook only returns the cities matching query, and at most 1000 locations.
+        '''
+
+        from facebook_business.adobjects.targetingsearch import TargetingSearch
+
+        params = {
+        'type': 'adgeolocation',
+        'location_types': [location_type],
+        'country_code': country_code,
+        'q': query,
+        'limit': 1000,
+        }
+
+        resp = TargetingSearch.search(params=params, api=self.api)
+
+        subdivision_dict = {}
+
+        for item in resp:
+
+            if item.get('country_code') != country_code:
+                continue
+
+            name = item['name']
+
+            # cities with the same name are told apart by their region
+            if name in subdivision_dict and item.get('region'):
+                name = '{}, {}'.format(name, item['region'])
+
+            subdivision_dict[name] = {'key': str(item['key']), 'type': location_type}
+
+        return subdivision_dict
+
+    def origins(self):
+
+        '''
+        Downloads the dictionary of available origins names (taken from the 'Lived in' ex-pats
+        behaviors) and corresponding behavior ids.
+        '''
+
+        from facebook_business.adobjects.targetingsearch import TargetingSearch
+
+        params = {
+        'type': 'adTargetingCategory',
+        'class': 'behaviors',
+        'limit': 1000,
+        }
+
+        resp = TargetingSearch.search(params=params, api=self.api)
+
+        country_dict = {}
+
+        for item in resp:
+
+            if item['path'][0]=='Ex-pats' and item['path'][1].find('Lived in')==0:
+
+                char_name_starts = 9
+                char_name_ends = item['name'].find('(formerly') -1
+                country = item['name'][char_name_starts:char_name_ends]
+
+                country_dict[country] =  {'id': item['id'], 'name': item['name']}
+
+        return country_dict
+
+class SimulatedRateLimitError(Exception):
+
+    '''
+    The error raised by the SimulatorBackend when the simulated call limit is hit. Like the errors of
+    facebook_business it exposes the headers of the (simulated) response.
+    '''
+
+    def __init__(self, message, headers):
+
+        super().__init__(message)
+        self.headers = headers
+
+    def http_headers(self):
+
+        return self.headers
+
+class SimulatedAuthError(Exception):
+
+    '''
+    The error raised by the SimulatorBackend after its token has been revoked with revoke().
+    '''
+
+class SimulatorBackend:
+
+    '''
+    A deterministic local backend that mimics the reach estimates of the Facebook Marketing Api
+    without spending any quota, to benchmark and test sweeps offline. The same targeting spec always
+    gets the same estimate, rounded like Facebook's (two significant digits, never below 1000),
+    every call waits latency seconds, and calls beyond calls_per_hour within the last hour raise a
+    SimulatedRateLimitError carrying usage headers like the real api. After revoke() every call
+    raises a SimulatedAuthError, like a revoked token.
+
+    Arguments:
+
+        - n_countries: the number of synthetic countries ('Country 1', 'Country 2', ...) offered as
+                       destinations and origins, ignored if countries is passed;
+        - countries: an optional list of country names to use instead of the synthetic ones;
+        - n_regions and n_cities: the number of regions and cities of every country. The regions
+                                  split the users of their country (with shares that depend on the
+                                  rest of the spec, e.g. on the origin) and the cities half of them,
+                                  so that the estimates of the parts are consistent with the one of
+                                  the country before rounding;
+        - latency: the number of seconds every call (or batch) takes;
+        - calls_per_hour: the simulated quota, None for no limit;
+        - window: the number of seconds over which the quota is counted;
+        - seed: the seed that determines the estimates.
+    '''
+
+    catalog_path = None
+
+    def __init__(self, n_countries=200, countries=None, latency=0.0, calls_per_hour=None, window=3600, seed=0,
+                 n_regions=8, n_cities=5):
+
+        if countries is None:
+            countries = ['Country {}'.format(i) for i in range(1, n_countries + 1)]
+
+        self.countries = list(countries)
+        self.n_regions = n_regions
+        self.n_cities = n_cities
+        self.latency = latency
+        self.calls_per_hour = calls_per_hour
+        self.window = window
+        self.seed = seed
+
+        self.call_counter = 0
+        self.revoked = False
+        self._calls = collections.deque()
+        self._lock = threading.Lock()
+
+    def _random(self, targeting_spec, prefix=''):
+
+        canonical = json.dumps(normalize_spec(targeting_spec), sort_keys=True)
+        digest = hashlib.sha256('{}:{}{}'.format(self.seed, prefix, canonical).encode('utf-8')).hexdigest()
+
+        return random.Random(int(digest[:16], 16))
+
+    def _shares(self, country_code, location_type, targeting_spec):
+
+        rest = {key: value for key, value in targeting_spec.items() if key != 'geo_locations'}
+        rng = self._random(rest, '{}:{}:'.format(country_code, location_type))
+
+        number = self.n_regions if location_type == 'region' else self.n_cities
+        weights = [math.exp(rng.gauss(0, 1)) for _ in range(number)]
+        coverage = 1.0 if location_type == 'region' else 0.5
+
+        return [coverage * weight / sum(weights) for weight in weights]
+
+    def _users(self, targeting_spec):
+
+        return round_reach(self._raw_users(targeting_spec))
+
+    def _raw_users(self, targeting_spec):
+
+        geo_locations = targeting_spec.get('geo_locations', {})
+
+        for field in ('regions', 'cities'):
+
+            if field in geo_locations:
+
+                country_code, location_type, number = geo_locations[field][0]['key'].split(':')
+                country_spec = dict(targeting_spec, geo_locations={'countries': [country_code]})
+
+                return (self._raw_users(country_spec) *
+                        self._shares(country_code, location_type, targeting_spec)[int(number) - 1])
+
+        rng = self._random(targeting_spec)
+
+        if 'behaviors' in targeting_spec:
+            # most destination-origin pairs are tiny and end up at the 1000 floor
+            users = math.exp(rng.gauss(6.5, 2.5))
+        else:
+            users = math.exp(rng.uniform(13, 18))
+
+        if 'genders' in targeting_spec:
+            users /= 2
+
+        if 'age_max' in targeting_spec:
+            users *= (targeting_spec['age_max'] - targeting_spec.get('age_min', 13) + 1) / 53
+
+        return users
+
+    def _usage_headers(self, usage, regain_minutes=0):
+
+        return {'x-business-use-case-usage': json.dumps({'simulator': [{'type': 'ads_management',
+                                                                        'call_count': usage,
+                                                                        'total_cputime': usage,
+                                                                        'total_time': usage,
+                                                                        'estimated_time_to_regain_access':
+                                                                            regain_minutes}]})}
+
+    def revoke(self):
+
+        self.revoked = True
+
+    def _register_call(self):
+
+        if self.revoked:
+            raise SimulatedAuthError('Simulated token revoked')
+
+        with self._lock:
+
+            now = time.monotonic()
+            self.call_counter += 1
+
+            while self._calls and self._calls[0] <= now - self.window:
+                self._calls.popleft()
+
+            if self.calls_per_hour is None:
+                return {}
+
+            quota = self.calls_per_hour * self.window / 3600
+
+            if len(self._calls) >= quota:
+                regain_minutes = math.ceil((self._calls[0] + self.window - now) / 60)
+                raise SimulatedRateLimitError('Simulated call limit reached',
+                                              self._usage_headers(100, regain_minutes))
+
+            self._calls.append(now)
+
+            return self._usage_headers(int(100 * len(self._calls) / quota))
+
+    def reach_estimate(self, targeting_spec):
+
+        '''
+        Returns the simulated number of users of targeting_spec together with the usage headers.
+        '''
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        headers = self._register_call()
+
+        return self._users(targeting_spec), headers
+
+    def reach_estimate_batch(self, targeting_specs):
+
+        '''
+        Returns, for each spec, either a (users, headers) tuple or the simulated rate limit error.
+        The whole batch takes a single latency.
+        '''
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        outcomes = []
+
+        for spec in targeting_specs:
+
+            try:
+                headers = self._register_call()
+            except (SimulatedRateLimitError, SimulatedAuthError) as error:
+                outcomes.append(error)
+                continue
+
+            outcomes.append((self._users(spec), headers))
+
+        return outcomes
+
+    def is_rate_limit_error(self, error):
+
+        return isinstance(error, SimulatedRateLimitError)
+
+    def is_auth_error(self, error):
+
+        return isinstance(error, SimulatedAuthError)
+
+    def destinations(self):
+
+        return {country: {'code': 'X{:03d}'.format(i)} for i, country in enumerate(self.countries)}
+
+    def subdivisions(self, country_code, location_type='region', query=''):
+
+        if location_type not in ('region', 'city'):
+            raise ValueError('The simulator only has regions and cities, not {}'.format(location_type))
+
+        country = self.countries[int(country_code[1:])]
+        number = self.n_regions if location_type == 'region' else self.n_cities
+        names = ['{} {} {}'.format(country, location_type.capitalize(), i) for i in range(1, number + 1)]
+
+        return {name: {'key': '{}:{}:{}'.format(country_code, location_type, i), 'type': location_type}
+                for i, name in enumerate(names, 1) if query.lower() in name.lower()}
+
+    def origins(self):
+
+        return {country: {'id': str(6015559470583 + i),
+                          'name': 'Lived in {} (formerly Expats ({}))'.format(country, country)}
+                for i, country in enumerate(self.countries)}
+
+def get_backend(access_token=None, user_id=None, backend=None):
+
+    '''
+    Returns backend if one is passed, otherwise a FacebookBackend for the given credentials.
+    '''
+
+    if backend is not None:
+        return backend
+
+    return FacebookBackend(user_id, access_token)
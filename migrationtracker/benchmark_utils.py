@@ -0,0 +1,376 @@
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from .age_str_utils import get_age_structure_table_mig
+from .backend_utils import SimulatorBackend
+from .cache_utils import ReachCache
+from .catalog_utils import get_catalog
+from .dem_utils import get_age_groups
+from .engine_utils import ReachEngine
+from .export_utils import export_age_str_dict, export_age_str_tables, load_age_str_tables
+from .instrument_utils import Instrumentation
+from .migration_utils import gen_mig_table, get_mig_specs
+from .rate_utils import TokenBucket
+from .store_utils import SnapshotStore
+from .table_utils import ResultBuffer
+
+# The sizes of the benchmarks of each suite: 'quick' runs in well under a minute, 'full' measures the
+# 250x250 sweeps the request sizes are quoted for
+SUITES = {'quick': {'countries': 40, 'latency': 0.02, 'memory_countries': 100, 'age_countries': 10,
+                    'quota_calls': 200, 'max_workers': 16},
+          'full': {'countries': 250, 'latency': 0.05, 'memory_countries': 250, 'age_countries': 30,
+                   'quota_calls': 1000, 'max_workers': 32}}
+
+def get_commit():
+
+    '''
+    Returns the short hash of the current git commit (with a '+' if the working tree has changes),
+    or None outside a git repository.
+    '''
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=directory).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True, cwd=directory).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + '+' if dirty else commit
+
+def _engine(backend, max_workers=16, rate=1e6, cache=None):
+
+    # the limiter is not the bottleneck unless a rate is given
+    return ReachEngine(limiter=TokenBucket(rate=rate, burst=max(1, min(rate, 1000))), backend=backend,
+                       max_workers=max_workers, cache=cache, instrumentation=Instrumentation(progress=False))
+
+def _countries(backend, n):
+
+    catalog = get_catalog(backend=backend)
+
+    return list(catalog.destinations)[:n], list(catalog.origins)[:n]
+
+def bench_sweep(countries=40, latency=0.02, max_workers=16, batch_size=None):
+
+    '''
+    Times a full gen_mig_table sweep of countries destinations and origins against a SimulatorBackend
+    answering every call in latency seconds, without rate limit.
+    '''
+
+    backend = SimulatorBackend(n_countries=countries, latency=latency)
+    engine = _engine(backend, max_workers)
+    engine.batch_size = batch_size
+    destinations, origins = _countries(backend, countries)
+
+    start = time.perf_counter()
+    gen_mig_table(None, None, destinations, origins, engine=engine)
+    seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'calls': backend.call_counter, 'calls_per_second': backend.call_counter / seconds,
+            'latency_mean_seconds': engine.instrumentation.snapshot()['latency_mean_seconds']}
+
+def bench_quota(calls=200, calls_per_hour=72000, max_workers=16):
+
+    '''
+    Measures the calls per second a sweep achieves with a TokenBucket built from a fixed hourly
+    quota, as a fraction of the quota (efficiency).
+    '''
+
+    backend = SimulatorBackend(n_countries=calls, calls_per_hour=calls_per_hour)
+    engine = ReachEngine(limiter=TokenBucket.from_quota(calls_per_hour), backend=backend, max_workers=max_workers,
+                         instrumentation=Instrumentation(progress=False))
+    destinations, origins = _countries(backend, calls)
+
+    specs = get_mig_specs(destinations[:1], origins[:calls - 1], get_catalog(backend=backend).destinations,
+                          get_catalog(backend=backend).origins)
+
+    start = time.perf_counter()
+    engine.run(specs)
+    seconds = time.perf_counter() - start
+
+    calls_per_second = backend.call_counter / seconds
+
+    return {'seconds': seconds, 'calls_per_second': calls_per_second,
+            'efficiency': calls_per_second / (calls_per_hour / 3600),
+            'throttle_wait_seconds': engine.instrumentation.snapshot()['throttle_wait_seconds']}
+
+def bench_memory(countries=100, age_countries=10, max_workers=16):
+
+    '''
+    Measures the peak memory allocated (with tracemalloc) by a gen_mig_table sweep of countries
+    destinations and origins and by an age-sex sweep of age_countries destinations and origins,
+    with a SimulatorBackend without latency.
+    '''
+
+    results = {}
+
+    for name, size in (('mig_table', countries), ('age_structure_mig', age_countries)):
+
+        backend = SimulatorBackend(n_countries=size)
+        engine = _engine(backend, max_workers)
+        destinations, origins = _countries(backend, size)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        if name == 'mig_table':
+            gen_mig_table(None, None, destinations, origins, engine=engine)
+        else:
+            get_age_structure_table_mig(None, None, destinations, origins, engine=engine)
+
+        results[name + '_seconds'] = time.perf_counter() - start
+        results[name + '_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        results[name + '_calls'] = backend.call_counter
+
+        tracemalloc.stop()
+
+    return results
+
+def bench_cache(countries=40, max_workers=16):
+
+    '''
+    Times a sweep writing every answer to a new ReachCache and the same sweep answered entirely by
+    the cache.
+    '''
+
+    backend = SimulatorBackend(n_countries=countries)
+    destinations, origins = _countries(backend, countries)
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        cache = ReachCache(os.path.join(directory, 'cache.sqlite'))
+        results = {}
+
+        for name in ('cold', 'warm'):
+            engine = _engine(backend, max_workers, cache=cache)
+            start = time.perf_counter()
+            gen_mig_table(None, None, destinations, origins, engine=engine)
+            results[name + '_seconds'] = time.perf_counter() - start
+
+        cache.close()
+
+    return results
+
+def bench_assembly(countries=250, repeat=5):
+
+    '''
+    Times the building of the targeting specs and the assembly of a countries x countries table from
+    a dictionary of results, and get_age_groups.
+    '''
+
+    backend = SimulatorBackend(n_countries=countries)
+    catalog = get_catalog(backend=backend)
+    destinations, origins = _countries(backend, countries)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        specs = get_mig_specs(destinations, origins, catalog.destinations, catalog.origins)
+    specs_seconds = (time.perf_counter() - start) / repeat
+
+    results = {key: 1000.0 for key in specs}
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        buffer = ResultBuffer({'destination': destinations, 'origin': origins + ['Total Population']})
+        buffer.fill(results)
+        buffer.to_frame()
+    assembly_seconds = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        get_age_groups(13, 65)
+    age_groups_seconds = (time.perf_counter() - start) / 1000
+
+    return {'specs_seconds': specs_seconds, 'assembly_seconds': assembly_seconds,
+            'age_groups_seconds': age_groups_seconds}
+
+def bench_export(countries=250, age_countries=30):
+
+    '''
+    Times the export and the load of a countries x countries table and of the age-sex tables of
+    age_countries x age_countries destination-origin pairs, as csv (one file per pair and a single
+    gzip file) and, if pyarrow is installed, in a SnapshotStore and a single Parquet file.
+    '''
+
+    import pandas as pd
+
+    backend = SimulatorBackend(n_countries=countries)
+    destinations, origins = _countries(backend, countries)
+
+    table = pd.DataFrame([[backend._users({'behaviors': [{'id': str(i * countries + j)}]}) for j in range(countries)]
+                          for i in range(countries)], index=destinations, columns=origins)
+
+    age_groups = [age_groups['name'] for age_groups in get_age_groups(13, 65).values()]
+    age_str_dict = {destination: {origin: {'age_structure_table': pd.DataFrame(1000.0, index=age_groups,
+                                                                               columns=['male', 'female'])}
+                                  for origin in origins[:age_countries]}
+                    for destination in destinations[:age_countries]}
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        path = os.path.join(directory, 'mig_table.csv')
+
+        start = time.perf_counter()
+        table.to_csv(path)
+        results['csv_write_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pd.read_csv(path, index_col=0)
+        results['csv_read_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        export_age_str_dict(age_str_dict, os.path.join(directory, 'age_str_tables'))
+        results['age_str_files_write_seconds'] = time.perf_counter() - start
+
+        path = os.path.join(directory, 'age_str_tables.csv.gz')
+
+        start = time.perf_counter()
+        export_age_str_tables(age_str_dict, path)
+        results['age_str_csv_gz_write_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_age_str_tables(path)
+        results['age_str_csv_gz_read_seconds'] = time.perf_counter() - start
+
+        if importlib.util.find_spec('pyarrow') is None:
+            # the store needs pyarrow, only the csv figures are measured
+            return results
+
+        store = SnapshotStore(os.path.join(directory, 'store'))
+
+        start = time.perf_counter()
+        store.append_mig_table(table, '2019-07-01')
+        store.append_age_str_dict(age_str_dict, '2019-07-01')
+        results['store_write_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.read()
+        results['store_read_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.read(destinations[0], origins[0])
+        results['store_read_pair_seconds'] = time.perf_counter() - start
+
+        path = os.path.join(directory, 'age_str_tables.parquet')
+
+        start = time.perf_counter()
+        export_age_str_tables(age_str_dict, path)
+        results['age_str_parquet_write_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_age_str_tables(path)
+        results['age_str_parquet_read_seconds'] = time.perf_counter() - start
+
+    return results
+
+def run_benchmarks(suite='quick', names=None, path='benchmarks/results.jsonl'):
+
+    '''
+    Runs the benchmarks of a suite ('quick' or 'full', see SUITES), or only the ones in names, and
+    appends one json record per benchmark to path (None not to save them) together with the commit,
+    the date and the platform, so that the results of different commits can be compared with
+    compare_benchmarks. Returns the list of records.
+    '''
+
+    sizes = SUITES[suite]
+
+    benchmarks = {'sweep': lambda: bench_sweep(sizes['countries'], sizes['latency'], sizes['max_workers']),
+                  'sweep_batch': lambda: bench_sweep(sizes['countries'], sizes['latency'], sizes['max_workers'], 50),
+                  'quota': lambda: bench_quota(sizes['quota_calls'], max_workers=sizes['max_workers']),
+                  'memory': lambda: bench_memory(sizes['memory_countries'], sizes['age_countries'],
+                                                 sizes['max_workers']),
+                  'cache': lambda: bench_cache(sizes['countries'], sizes['max_workers']),
+                  'assembly': lambda: bench_assembly(),
+                  'export': lambda: bench_export(age_countries=sizes['age_countries'])}
+
+    commit = get_commit()
+    records = []
+
+    for name, benchmark in benchmarks.items():
+
+        if names is not None and name not in names:
+            continue
+
+        record = {'benchmark': name, 'suite': suite, 'commit': commit,
+                  'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'python': platform.python_version(), 'machine': platform.node()}
+        record.update(benchmark())
+
+        print(json.dumps(record))
+        records.append(record)
+
+    if path is not None:
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'a') as file:
+            for record in records:
+                file.write(json.dumps(record) + '\n')
+
+    return records
+
+def load_benchmarks(path='benchmarks/results.jsonl'):
+
+    '''
+    Returns the saved results as a long DataFrame with the columns commit, date, suite, benchmark,
+    metric and value.
+    '''
+
+    import pandas as pd
+
+    with open(path) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+
+    frame = pd.DataFrame(records)
+    metadata = ['benchmark', 'suite', 'commit', 'date', 'python', 'machine']
+
+    return frame.melt(id_vars=metadata, var_name='metric', value_name='value').dropna(subset=['value'])
+
+def compare_benchmarks(base, head=None, suite='quick', path='benchmarks/results.jsonl'):
+
+    '''
+    Compares the latest results of two commits (head defaults to the latest commit saved): returns
+    a DataFrame with the value of every metric for each commit and their ratio (head / base).
+    '''
+
+    import pandas as pd
+
+    results = load_benchmarks(path)
+    results = results[results['suite'] == suite].sort_values('date')
+
+    if head is None:
+        head = results['commit'].iloc[-1]
+
+    latest = results.groupby(['commit', 'benchmark', 'metric'])['value'].last()
+
+    comparison = pd.DataFrame({base: latest.loc[base], head: latest.loc[head]})
+    comparison['ratio'] = comparison[head] / comparison[base]
+
+    return comparison
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Runs the benchmarks against the SimulatorBackend.')
+    parser.add_argument('--suite', default='quick', choices=sorted(SUITES))
+    parser.add_argument('--only', nargs='*', help='the names of the benchmarks to run')
+    parser.add_argument('--output', default='benchmarks/results.jsonl', help='the file the results are appended to')
+    parser.add_argument('--compare', help='a commit whose results are compared with the new ones')
+    arguments = parser.parse_args()
+
+    run_benchmarks(arguments.suite, arguments.only, arguments.output)
+
+    if arguments.compare:
+        print(compare_benchmarks(arguments.compare, suite=arguments.suite, path=arguments.output).to_string())
@@ -0,0 +1,234 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+def normalize_spec(targeting_spec):
+
+    '''
+    Returns a canonical version of a targeting spec: keys are sorted, lists are sorted, and the
+    names attached to behaviors (or any other object with an id) are dropped since Facebook only
+    uses the id. Two specs that target the same people have the same normalized version.
+    '''
+
+    if isinstance(targeting_spec, dict):
+
+        if 'id' in targeting_spec:
+            return {'id': str(targeting_spec['id'])}
+
+        return {key: normalize_spec(value) for key, value in sorted(targeting_spec.items())}
+
+    if isinstance(targeting_spec, (list, tuple)):
+
+        values = [normalize_spec(value) for value in targeting_spec]
+
+        return sorted(values, key=lambda value: json.dumps(value, sort_keys=True))
+
+    return targeting_spec
+
+def spec_key(targeting_spec):
+
+    '''
+    Returns the hash of the normalized targeting spec used as key of the cache.
+    '''
+
+    canonical = json.dumps(normalize_spec(targeting_spec), sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def dedupe_requests(requests):
+
+    '''
+    Groups the requests (a dictionary of targeting specs) that target the same people. Returns a
+    dictionary of the distinct specs keyed by their spec_key and a dictionary mapping every
+    spec_key to the keys of the requests sharing it.
+    '''
+
+    unique = {}
+    groups = {}
+
+    for key, spec in requests.items():
+
+        shared_key = spec_key(spec)
+        unique.setdefault(shared_key, spec)
+        groups.setdefault(shared_key, []).append(key)
+
+    return unique, groups
+
+def expand_results(results, groups):
+
+    '''
+    The inverse of dedupe_requests: maps the results keyed by spec_key back to the keys of all the
+    requests sharing each spec.
+    '''
+
+    return {key: value for shared_key, value in results.items() for key in groups[shared_key]}
+
+def expand_callback(callback, requests, groups):
+
+    '''
+    Wraps a callback(key, targeting_spec, users) of the requests into one of the distinct specs
+    returned by dedupe_requests, which calls callback for every request sharing the spec. Returns
+    None if callback is None.
+    '''
+
+    if callback is None:
+        return None
+
+    def shared_callback(shared_key, spec, users):
+        for key in groups[shared_key]:
+            callback(key, requests[key], users)
+
+    return shared_callback
+
+class ReachCache:
+
+    '''
+    A persistent cache of reach estimates stored in a SQLite file. Every entry is keyed by the hash
+    of the normalized targeting spec and remembers when it was fetched, so that a crashed job or a
+    sweep overlapping a previous one can skip the calls already answered.
+
+    Arguments:
+
+        - path: the SQLite file, created if it does not exist (':memory:' for a throwaway cache);
+        - ttl: the number of seconds an entry stays valid; by default (None) an entry is valid
+               until the end of the calendar month in which it was fetched, since Facebook
+               estimates are usually collected monthly;
+        - max_entries: the maximum number of entries kept, the ones fetched first are evicted
+                       when the cache grows beyond it (None for no limit).
+    '''
+
+    def __init__(self, path='reach_cache.sqlite', ttl=None, max_entries=1000000):
+
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS reach_estimates ('
+                                 'key TEXT PRIMARY KEY, '
+                                 'spec TEXT NOT NULL, '
+                                 'users REAL NOT NULL, '
+                                 'fetched_at REAL NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS fetched_at_index ON reach_estimates (fetched_at)')
+        self._connection.commit()
+
+    def _valid_since(self):
+
+        if self.ttl is not None:
+            return time.time() - self.ttl
+
+        month_start = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        return month_start.timestamp()
+
+    def get(self, targeting_spec):
+
+        '''
+        Returns the cached number of users for targeting_spec, or None if there is no valid entry.
+        '''
+
+        with self._lock:
+
+            row = self._connection.execute('SELECT users FROM reach_estimates WHERE key = ? AND fetched_at >= ?',
+                                           (spec_key(targeting_spec), self._valid_since())).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+            return row[0]
+
+    def set(self, targeting_spec, users, fetched_at=None):
+
+        '''
+        Stores the number of users returned for targeting_spec.
+        '''
+
+        fetched_at = time.time() if fetched_at is None else fetched_at
+
+        with self._lock:
+
+            self._connection.execute('INSERT OR REPLACE INTO reach_estimates VALUES (?, ?, ?, ?)',
+                                     (spec_key(targeting_spec),
+                                      json.dumps(normalize_spec(targeting_spec), sort_keys=True),
+                                      float(users),
+                                      fetched_at))
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+
+        if self.max_entries is None:
+            return
+
+        count = self._connection.execute('SELECT COUNT(*) FROM reach_estimates').fetchone()[0]
+
+        if count > self.max_entries:
+            self._connection.execute('DELETE FROM reach_estimates WHERE key IN '
+                                     '(SELECT key FROM reach_estimates ORDER BY fetched_at LIMIT ?)',
+                                     (count - self.max_entries,))
+
+    def purge(self):
+
+        '''
+        Deletes the entries that are no longer valid.
+        '''
+
+        with self._lock:
+            self._connection.execute('DELETE FROM reach_estimates WHERE fetched_at < ?', (self._valid_since(),))
+            self._connection.commit()
+
+    def __contains__(self, targeting_spec):
+
+        with self._lock:
+            row = self._connection.execute('SELECT 1 FROM reach_estimates WHERE key = ? AND fetched_at >= ?',
+                                           (spec_key(targeting_spec), self._valid_since())).fetchone()
+
+        return row is not None
+
+    def cached_keys(self, keys):
+
+        '''
+        Returns the subset of keys (as returned by spec_key) that have a valid entry in the cache.
+        '''
+
+        keys = list(keys)
+        found = set()
+
+        with self._lock:
+
+            for start in range(0, len(keys), 500):
+
+                chunk = keys[start:start + 500]
+                query = ('SELECT key FROM reach_estimates WHERE fetched_at >= ? AND key IN ({})'
+                         .format(','.join('?' * len(chunk))))
+
+                found.update(row[0] for row in self._connection.execute(query, [self._valid_since()] + chunk))
+
+        return found
+
+    def __len__(self):
+
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM reach_estimates').fetchone()[0]
+
+    def stats(self):
+
+        '''
+        Returns a dictionary with the number of hits, misses and entries of the cache.
+        '''
+
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
+
+    def close(self):
+
+        self._connection.close()
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+
+from .backend_utils import FacebookBackend
+
+class CountryCatalog:
+
+    '''
+    The list of destinations (countries that can be targeted) and origins (ex-pats behaviors) offered
+    by Facebook. The catalog is downloaded once, saved to a local JSON file and read from it until it
+    is older than refresh_interval, so that jobs do not have to call the api at startup.
+    Destinations can be looked up by name or ISO code and origins by name or behavior id in
+    constant time. The regions and cities of a destination are downloaded the first time they are
+    requested through subdivisions and saved with the catalog.
+
+    Arguments:
+
+        - access_token: your facebook user access token, needed only when the catalog is downloaded;
+        - path: the JSON file where the catalog is saved, None to keep it only in memory;
+        - refresh_interval: the number of seconds after which the catalog is downloaded again;
+        - backend: the estimate backend the catalog is downloaded from, by default a
+                   FacebookBackend using access_token.
+    '''
+
+    def __init__(self, access_token=None, path='country_catalog.json', refresh_interval=30*24*3600, backend=None):
+
+        self.access_token = access_token
+        self.backend = backend
+        self.path = path
+        self.refresh_interval = refresh_interval
+
+        self.destinations = {}
+        self.origins = {}
+        self.subdivision_dicts = {}
+        self.fetched_at = None
+        self.calls = 0
+
+    def load(self):
+
+        '''
+        Fills the catalog from the local file if it is recent enough, otherwise from the api.
+        '''
+
+        if self.path is not None and os.path.exists(self.path):
+
+            with open(self.path) as catalog_file:
+                saved = json.load(catalog_file)
+
+            can_refresh = self.access_token is not None or self.backend is not None
+
+            if time.time() - saved['fetched_at'] < self.refresh_interval or not can_refresh:
+                self._set(saved['destinations'], saved['origins'], saved['fetched_at'])
+                self.subdivision_dicts = saved.get('subdivisions', {})
+                return self
+
+        return self.refresh()
+
+    def refresh(self):
+
+        '''
+        Downloads the catalog from the backend and saves it to the local file.
+        '''
+
+        backend = self._backend()
+
+        destinations = backend.destinations()
+        origins = backend.origins()
+        self.calls += 2
+
+        self._set(destinations, origins, time.time())
+        self.subdivision_dicts = {}
+        self._save()
+
+        return self
+
+    def _backend(self):
+
+        if self.backend is None:
+
+            if self.access_token is None:
+                raise ValueError('An access token is needed to download the catalog of countries')
+
+            self.backend = FacebookBackend(access_token=self.access_token)
+
+        return self.backend
+
+    def _save(self):
+
+        if self.path is None:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with open(self.path + '.tmp', 'w') as catalog_file:
+            json.dump({'fetched_at': self.fetched_at,
+                       'destinations': self.destinations,
+                       'origins': self.origins,
+                       'subdivisions': self.subdivision_dicts}, catalog_file)
+
+        os.replace(self.path + '.tmp', self.path)
+
+    def subdivisions(self, destination, location_type='region'):
+
+        '''
+        Returns the dictionary of the regions (or, with location_type='city', the cities) of a
+        destination (a name or an ISO code), whose keys are their names and whose values hold their
+        Facebook key. They are downloaded only the first time they are requested.
+        '''
+
+        code = self.destinations[self.destination(destination)]['code']
+        subdivision_dicts = self.subdivision_dicts.setdefault(location_type, {})
+
+        if code not in subdivision_dicts:
+            subdivision_dicts[code] = self._backend().subdivisions(code, location_type)
+            self.calls += 1
+            self._save()
+
+        return subdivision_dicts[code]
+
+    def search_subdivisions(self, destination, query, location_type='city'):
+
+        '''
+        Downloads the cities (or regions) of a destination whose name matches query and adds them to
+        the ones returned by subdivisions, since Facebook only lists the cities matching a search.
+        Returns the dictionary of the locations found.
+        '''
+
+        code = self.destinations[self.destination(destination)]['code']
+
+        found = self._backend().subdivisions(code, location_type, query)
+        self.calls += 1
+
+        self.subdivision_dicts.setdefault(location_type, {}).setdefault(code, {}).update(found)
+        self._save()
+
+        return found
+
+    def _set(self, destinations, origins, fetched_at):
+
+        self.destinations = destinations
+        self.origins = origins
+        self.fetched_at = fetched_at
+
+        self._destinations_by_key = {}
+        for name, value in destinations.items():
+            self._destinations_by_key[name.lower()] = name
+            self._destinations_by_key[value['code'].lower()] = name
+
+        self._origins_by_key = {}
+        for name, value in origins.items():
+            self._origins_by_key[name.lower()] = name
+            self._origins_by_key[str(value['id'])] = name
+
+    def destination(self, key):
+
+        '''
+        Returns the name of the destination with the given name or ISO code (case insensitive),
+        or None if there is none.
+        '''
+
+        return self._destinations_by_key.get(str(key).lower())
+
+    def origin(self, key):
+
+        '''
+        Returns the name of the origin with the given name or behavior id (case insensitive),
+        or None if there is none.
+        '''
+
+        return self._origins_by_key.get(str(key).lower())
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(access_token=None, path=None, refresh_interval=30*24*3600, backend=None):
+
+    '''
+    Returns the CountryCatalog saved in path, loading it only the first time it is requested by the
+    process (and downloading it only if the file is missing or too old). If path is not passed the
+    catalog path of the backend is used (country_catalog.json for the FacebookBackend).
+    '''
+
+    if path is None:
+        path = FacebookBackend.catalog_path if backend is None else backend.catalog_path
+
+    # catalogs kept only in memory are specific to their backend
+    memo_key = path if path is not None else id(backend)
+
+    with _catalogs_lock:
+
+        catalog = _catalogs.get(memo_key)
+
+        if catalog is None or time.time() - catalog.fetched_at >= refresh_interval:
+            catalog = CountryCatalog(access_token, path, refresh_interval, backend).load()
+            _catalogs[memo_key] = catalog
+
+        elif catalog.access_token is None:
+            catalog.access_token = access_token
+
+    return catalog
@@ -0,0 +1,362 @@
+import itertools
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .backend_utils import FacebookBackend
+from .cache_utils import dedupe_requests, expand_callback, expand_results
+from .instrument_utils import Instrumentation
+from .rate_utils import TokenBucket, ThrottleController
+
+class ReachEngine:
+
+    '''
+    Runs many reach estimate requests concurrently through a pool of threads. All the threads
+    share the same token bucket so that the total number of calls per second stays under the
+    limit imposed by the Facebook Marketing Api whatever the number of workers.
+
+    Arguments:
+
+        - user_id: your facebook user id (the ad account used for the reach estimates), used only
+                   when no backend is passed;
+        - limiter: the TokenBucket shared by the workers, by default one sized for
+                   DEFAULT_CALLS_PER_HOUR (see rate_utils);
+        - throttle: the ThrottleController that adapts the rate of the limiter to the usage
+                    headers returned by the api, by default one controlling limiter;
+        - cache: an optional ReachCache; requests whose targeting spec is in the cache are not
+                 sent to the api and every new answer is stored in it;
+        - max_workers: the number of requests (or batches) that can be waiting for an answer at
+                       the same time;
+        - max_retries: how many times a request that hit the rate limit is tried again before
+                       being given up;
+        - batch_size: if passed, the requests are packed into Graph Api batch calls of at most
+                      batch_size items (Facebook accepts up to 50) instead of being sent one by
+                      one. Every item still counts as a call for the rate limit, but the network
+                      round trips are divided by batch_size, and only the items of a batch that
+                      hit the rate limit are sent again;
+        - access_token: your facebook user access token, used only when no backend is passed;
+        - backend: the estimate backend the requests are sent to, by default a FacebookBackend
+                   for user_id and access_token (see backend_utils for the offline SimulatorBackend);
+        - instrumentation: the Instrumentation that records the calls and shows the progress of
+                           the sweeps, by default one showing a progress bar only in a terminal or
+                           in a notebook.
+    '''
+
+    def __init__(self, user_id=None, limiter=None, throttle=None, cache=None, max_workers=4, max_retries=5,
+                 batch_size=None, backend=None, instrumentation=None, access_token=None):
+
+        self.user_id = user_id
+        self.backend = FacebookBackend(user_id, access_token) if backend is None else backend
+        self.limiter = TokenBucket() if limiter is None else limiter
+        self.throttle = ThrottleController(self.limiter) if throttle is None else throttle
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+
+        self.call_counter = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def max_rate(self):
+
+        '''
+        The maximum number of calls per second the engine can make.
+        '''
+
+        return self.limiter.max_rate
+
+    def paused_for(self):
+
+        '''
+        Returns the number of seconds before the engine can call the api again.
+        '''
+
+        return self.limiter.paused_for()
+
+    def stop(self):
+
+        '''
+        Stops the sweep that is running, e.g. from another thread: the requests that are still
+        waiting for a token are given up and run returns as soon as the ones in flight are answered.
+        '''
+
+        self._stop.set()
+
+    def fetch(self, targeting_spec):
+
+        '''
+        Makes a single reach estimate call through the backend and returns the number of users
+        together with the headers of the response.
+        '''
+
+        return self.backend.reach_estimate(targeting_spec)
+
+    def fetch_batch(self, targeting_specs):
+
+        '''
+        Sends the reach estimate calls of all the targeting specs in a single batch request and
+        returns, for each spec, either a (users, headers) tuple or the error raised for that item.
+        '''
+
+        return self.backend.reach_estimate_batch(targeting_specs)
+
+    def _acquire(self):
+
+        start = time.monotonic()
+        acquired = self.limiter.acquire(self._stop)
+        self.instrumentation.record_wait(time.monotonic() - start)
+
+        if not acquired:
+            raise InterruptedError('The sweep was stopped')
+
+        with self._lock:
+            self.call_counter += 1
+
+    def _on_success(self, targeting_spec, users, headers):
+
+        self.throttle.update(headers)
+
+        if self.cache is not None:
+            self.cache.set(targeting_spec, users)
+
+    def _on_rate_limit(self, error):
+
+        self.throttle.penalize(error.http_headers())
+
+    def _fetch_with_retry(self, targeting_spec):
+
+        attempt = 0
+
+        while True:
+
+            self._acquire()
+            start = time.monotonic()
+
+            try:
+                users, headers = self.fetch(targeting_spec)
+
+            except Exception as error:
+
+                if self.backend.is_rate_limit_error(error):
+
+                    self.instrumentation.record_call(time.monotonic() - start, 'rate_limit')
+                    self._on_rate_limit(error)
+
+                    if attempt < self.max_retries:
+                        self.instrumentation.record_retry()
+                        attempt += 1
+                        continue
+
+                    raise
+
+                self.instrumentation.record_call(time.monotonic() - start, 'error')
+
+                raise
+
+            self.instrumentation.record_call(time.monotonic() - start)
+            self._on_success(targeting_spec, users, headers)
+
+            return users
+
+    def _fetch_batch_with_retry(self, items):
+
+        results = {}
+        errors = {}
+        attempt = 0
+
+        while items:
+
+            try:
+                for _ in items:
+                    self._acquire()
+            except InterruptedError:
+                break
+
+            start = time.monotonic()
+            outcomes = self.fetch_batch([spec for _, spec in items])
+            latency = time.monotonic() - start
+            retry = []
+
+            for (key, spec), outcome in zip(items, outcomes):
+
+                if not isinstance(outcome, Exception):
+                    self._on_success(spec, *outcome)
+                    results[key] = outcome[0]
+                    continue
+
+                errors[key] = outcome
+
+                if self.backend.is_rate_limit_error(outcome):
+                    self._on_rate_limit(outcome)
+                    retry.append((key, spec))
+
+            succeeded = sum(1 for key, _ in items if key in results)
+            self.instrumentation.record_batch(latency, {'ok': succeeded,
+                                                        'rate_limit': len(retry),
+                                                        'error': len(items) - succeeded - len(retry)})
+
+            if attempt >= self.max_retries:
+                break
+
+            # only the items that hit the rate limit are sent again
+            for key, _ in retry:
+                del errors[key]
+                self.instrumentation.record_retry()
+
+            items = retry
+            attempt += 1
+
+        return results, errors
+
+    def _fetch_chunk(self, items):
+
+        try:
+
+            if self.batch_size is None:
+                key, spec = items[0]
+                return {key: self._fetch_with_retry(spec)}, {}
+
+            return self._fetch_batch_with_retry(items)
+
+        except InterruptedError:
+            return {}, {}
+
+        except Exception as error:
+            return {}, {key: error for key, _ in items}
+
+    def run(self, requests, desc='requests', callback=None, max_in_flight=None):
+
+        '''
+        Runs every request and returns two dictionaries: the first maps each key of requests
+        to the number of users returned by the api (or found in the cache), the second maps the
+        keys of the requests that failed to the corresponding error. If the sweep is stopped (see
+        stop) the requests that were still pending appear in neither of the two; a KeyboardInterrupt
+        is raised again once the workers are stopped, the answers already passed to callback being
+        the only ones kept. Requests sharing the same targeting spec are sent only once.
+
+        Arguments:
+
+            - requests: a dictionary whose keys identify the requests (e.g. destination-origin
+                        pairs) and whose values are targeting specs;
+            - desc: the name of the sweep shown next to the progress bar and in the instrumentation;
+            - callback: an optional function called as callback(key, targeting_spec, users) as
+                        soon as each request is answered (e.g. to write it to a JobJournal);
+            - max_in_flight: the maximum number of requests (or batches) handed to the workers
+                             whose answers have not been passed to callback yet, by default twice
+                             max_workers and never less than max_workers. New requests are only
+                             sent as the answers are consumed, so a slow callback slows the sweep
+                             down instead of piling up answers.
+        '''
+
+        unique, groups = dedupe_requests(requests)
+
+        if len(unique) < len(requests):
+
+            # every distinct targeting spec is sent only once and its answer shared by all its keys
+            results, errors = self.run(unique, desc, expand_callback(callback, requests, groups), max_in_flight)
+
+            return expand_results(results, groups), expand_results(errors, groups)
+
+        results = {}
+        errors = {}
+
+        if self.cache is not None:
+
+            pending = {}
+
+            for key, spec in requests.items():
+
+                users = self.cache.get(spec)
+
+                if users is None:
+                    pending[key] = spec
+                else:
+                    results[key] = users
+
+                    if callback is not None:
+                        callback(key, spec, users)
+
+            self.instrumentation.record_cache_hits(len(requests) - len(pending))
+            requests = pending
+
+        items = list(requests.items())
+        chunk_size = self.batch_size or 1
+        chunks = (items[i:i + chunk_size] for i in range(0, len(items), chunk_size))
+        max_in_flight = max(self.max_workers, 2 * self.max_workers if max_in_flight is None else max_in_flight)
+
+        self._stop.clear()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.instrumentation.start_sweep(desc, len(items))
+
+        futures = {}
+
+        try:
+
+            for chunk in itertools.islice(chunks, max_in_flight):
+                futures[executor.submit(self._fetch_chunk, chunk)] = chunk
+
+            while futures:
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+
+                    chunk_results, chunk_errors = future.result()
+
+                    results.update(chunk_results)
+                    errors.update(chunk_errors)
+
+                    if callback is not None:
+                        for key, users in chunk_results.items():
+                            callback(key, requests[key], users)
+
+                    self.instrumentation.advance(len(futures.pop(future)))
+
+                    # a new chunk is sent only once the answers of an old one are consumed
+                    for chunk in itertools.islice(chunks, 1):
+                        futures[executor.submit(self._fetch_chunk, chunk)] = chunk
+
+        finally:
+
+            self._stop.set()
+            # cancel_futures needs python 3.9, so the requests not started yet are cancelled by hand
+            for future in futures:
+                future.cancel()
+
+            executor.shutdown(wait=True)
+            self.instrumentation.end_sweep()
+
+        return results, errors
+
+def get_engine(user_id, engine=None, delay=None, max_workers=4, backend=None, access_token=None):
+
+    '''
+    Returns engine if one is passed, otherwise a new ReachEngine whose token bucket allows one
+    call every delay seconds (or a default TokenBucket, sized for DEFAULT_CALLS_PER_HOUR, if no delay
+    is given). The requests are sent to backend or, if no backend is passed, to a FacebookBackend
+    using the given credentials. A passed engine whose FacebookBackend has no access token gets
+    access_token, so that the token given to the sweep functions is not lost.
+    '''
+
+    if engine is not None:
+
+        engine_backend = getattr(engine, 'backend', None)
+
+        if access_token is not None and isinstance(engine_backend, FacebookBackend) and \
+           engine_backend.access_token is None:
+            engine_backend.set_access_token(access_token)
+
+        return engine
+
+    if backend is None:
+        backend = FacebookBackend(user_id, access_token)
+
+    if delay:
+        limiter = TokenBucket(rate=1 / delay)
+    else:
+        limiter = TokenBucket()
+
+    return ReachEngine(user_id, limiter=limiter, max_workers=max_workers, backend=backend)
@@ -0,0 +1,211 @@
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# The formats of export_age_str_tables, by file extension
+FORMATS = {'.parquet': 'parquet', '.csv': 'csv', '.csv.gz': 'csv.gz', '.csv.zst': 'csv.zst'}
+
+def export_age_str_dict(age_str_dict, path=None):
+
+    '''
+    Writes every age-sex structure table of age_str_dict to a csv file named
+    <destination>_<origin>_str_table.csv in path, by default the age_str_tables directory of the
+    current working directory (created if it does not exist). For large sweeps export_age_str_tables
+    writes all the tables to a single file much faster.
+    '''
+
+    age_str_tables_path = os.path.join(os.getcwd(), 'age_str_tables') if path is None else path
+    if not os.path.exists(age_str_tables_path):
+        os.makedirs(age_str_tables_path)
+
+    for key_country in age_str_dict:
+        for feature_country in age_str_dict[key_country]:
+            df_to_export = age_str_dict[key_country][feature_country]['age_structure_table']
+            df_name = '{}_{}_str_table.csv'.format(key_country.lower(),feature_country.lower())
+            df_to_export.to_csv(os.path.join(age_str_tables_path, df_name))
+
+def get_format(path):
+
+    '''
+    Returns the format of an export from the extension of its path, see FORMATS.
+    '''
+
+    for extension in sorted(FORMATS, key=len, reverse=True):
+        if path.endswith(extension):
+            return FORMATS[extension]
+
+    raise ValueError('Unknown export format of {}, the extension should be one of {}'.format(path, ', '.join(FORMATS)))
+
+def _map_ordered(function, chunks, workers):
+
+    '''
+    Yields function(chunk) for every chunk, in order, computing up to 2 * workers of them at once in a
+    thread pool so that the chunks are converted and compressed while the previous ones are written.
+    '''
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield function(chunk)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        pending = []
+
+        for chunk in chunks:
+
+            pending.append(executor.submit(function, chunk))
+
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+
+        for future in pending:
+            yield future.result()
+
+def export_age_str_tables(age_str_dict, path='age_str_tables.parquet', workers=4, chunk_pairs=2000):
+
+    '''
+    Writes all the age-sex structure tables of age_str_dict (the output of one of the age structure
+    functions) to a single long format file with the columns destination, origin, age_group, gender
+    and reach, instead of one csv per pair as export_age_str_dict does. The tables of whole countries
+    get 'Total Population' as origin, like in the SnapshotStore. load_age_str_tables reads it back.
+
+    Arguments:
+
+        - path: the file to write, whose extension sets the format: .parquet (zstd compressed, one
+                row group per chunk), .csv.gz, .csv.zst or .csv. Parquet and zstd need pyarrow;
+        - workers: the number of threads converting and compressing the chunks of pairs while the
+                   previous ones are written;
+        - chunk_pairs: the number of pairs of every chunk.
+    '''
+
+    from .store_utils import tables_to_long
+
+    export_format = get_format(path)
+
+    pairs = []
+    tables = []
+
+    for destination, features in age_str_dict.items():
+
+        if 'age_structure_table' in features:
+            features = {'Total Population': features}
+
+        for origin, value in features.items():
+            pairs.append((destination, origin))
+            tables.append(value['age_structure_table'])
+
+    chunks = [(start, pairs[start:start + chunk_pairs], tables[start:start + chunk_pairs])
+              for start in range(0, max(len(pairs), 1), chunk_pairs)]
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    if export_format == 'parquet':
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([('destination', pa.string()),
+                            ('origin', pa.string()),
+                            ('age_group', pa.string()),
+                            ('gender', pa.string()),
+                            ('reach', pa.float64())])
+
+        def convert(chunk):
+            return pa.Table.from_pandas(tables_to_long(chunk[1], chunk[2]), schema=schema, preserve_index=False)
+
+        with pq.ParquetWriter(path + '.tmp', schema, compression='zstd') as writer:
+            for table in _map_ordered(convert, chunks, workers):
+                writer.write_table(table)
+
+    else:
+
+        if export_format == 'csv.zst':
+            import pyarrow as pa
+            codec = pa.Codec('zstd')
+
+        def convert(chunk):
+
+            data = tables_to_long(chunk[1], chunk[2]).to_csv(index=False, header=chunk[0] == 0).encode()
+
+            # gzip members and zstd frames can be concatenated, so every chunk is compressed on its own
+            if export_format == 'csv.gz':
+                return gzip.compress(data, compresslevel=6)
+
+            if export_format == 'csv.zst':
+                return codec.compress(data, asbytes=True)
+
+            return data
+
+        with open(path + '.tmp', 'wb') as export_file:
+            for data in _map_ordered(convert, chunks, workers):
+                export_file.write(data)
+
+    os.replace(path + '.tmp', path)
+
+def load_age_str_tables(path, as_frame=False):
+
+    '''
+    Reads a file written by export_age_str_tables. By default it rebuilds the nested dictionary of the
+    age structure functions, {destination: {origin: {'age_structure_table': table}}} (or
+    {destination: {'age_structure_table': table}} for tables of whole countries). If as_frame is True
+    it returns a single DataFrame with a (destination, origin, age_group) MultiIndex and the genders on
+    the columns, which is much faster to build for large exports.
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    export_format = get_format(path)
+
+    if export_format == 'parquet':
+        import pyarrow.parquet as pq
+        long = pq.read_table(path).to_pandas()
+    elif export_format == 'csv.zst':
+        import pyarrow.csv as pc
+        long = pc.read_csv(path).to_pandas()
+    else:
+        long = pd.read_csv(path, dtype={'destination': str, 'origin': str, 'age_group': str, 'gender': str})
+
+    # the codes keep the order of the file, i.e. the one of the exported tables
+    pair_codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([long['destination'], long['origin']]))
+    age_codes, age_groups = pd.factorize(long['age_group'])
+    gender_codes, genders = pd.factorize(long['gender'])
+
+    values = np.full((len(pairs), len(age_groups), len(genders)), np.nan)
+    values[pair_codes, age_codes, gender_codes] = long['reach'].to_numpy(dtype=float)
+
+    if as_frame:
+
+        index = pd.MultiIndex.from_arrays([np.repeat(pairs.get_level_values(0), len(age_groups)),
+                                           np.repeat(pairs.get_level_values(1), len(age_groups)),
+                                           np.tile(age_groups, len(pairs))],
+                                          names=['destination', 'origin', 'age_group'])
+
+        frame = pd.DataFrame(values.reshape(len(pairs) * len(age_groups), len(genders)),
+                             index=index,
+                             columns=pd.Index(genders, name='gender'))
+
+        return frame[~np.isnan(values).all(axis=2).ravel()]
+
+    age_str_dict = {}
+    present = ~np.isnan(values)
+
+    for i, (destination, origin) in enumerate(pairs):
+
+        if present[i].all():
+            table = pd.DataFrame(values[i], index=age_groups, columns=genders)
+        else:
+            # a pair exported with fewer age groups or genders than the others
+            rows = present[i].any(axis=1)
+            columns = present[i].any(axis=0)
+            table = pd.DataFrame(values[i][rows][:, columns], index=age_groups[rows], columns=genders[columns])
+
+        if origin == 'Total Population':
+            age_str_dict[destination] = {'age_structure_table': table}
+        else:
+            age_str_dict.setdefault(destination, {})[origin] = {'age_structure_table': table}
+
+    return age_str_dict
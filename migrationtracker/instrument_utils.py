@@ -0,0 +1,290 @@
+import bisect
+import collections
+import json
+import logging
+import threading
+import time
+
+# The upper bounds, in seconds, of the buckets of the latency histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Instrumentation:
+
+    '''
+    Records what happens during the sweeps of a ReachEngine or of an EnginePool and shows their
+    progress. Every reach estimate call (or batch) goes through record_call, so that the
+    instrumentation keeps a latency histogram, the number of calls by outcome, the calls per second
+    over the last window seconds, the seconds spent waiting for the rate limiter, the cache hits and
+    the retries, and estimates the time left to the end of the current sweep. The figures can be
+    read with snapshot(), written as structured (json) log records, exported in the Prometheus text
+    format with prometheus() or served on a local http endpoint with serve(). To send them anywhere
+    else, subclass it and extend the record_* methods.
+
+    Arguments:
+
+        - progress: True to show a progress bar, through tqdm.auto so that it is a widget in a
+                    notebook and a text bar in a terminal; the default 'auto' shows it only when the
+                    output is a terminal or a notebook (not, e.g., in a cron job), False never shows it;
+        - logger: an optional logging.Logger (or the name of one) that receives a json record with the
+                  snapshot every log_interval seconds during a sweep and at its end;
+        - log_interval: the number of seconds between two progress records of the logger;
+        - window: the number of seconds over which the calls per second and the ETA are computed.
+    '''
+
+    def __init__(self, progress='auto', logger=None, log_interval=60, window=60):
+
+        self.progress = progress
+        self.logger = logging.getLogger(logger) if isinstance(logger, str) else logger
+        self.log_interval = log_interval
+        self.window = window
+
+        self.calls = collections.Counter()
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.throttle_wait = 0.0
+        self.cache_hits = 0
+        self.retries = 0
+
+        self.desc = None
+        self.total = 0
+        self.done = 0
+        self.started_at = None
+
+        self._call_times = collections.deque()
+        self._done_times = collections.deque()
+        self._bar = None
+        self._logged_at = 0.0
+        self._lock = threading.Lock()
+
+    def _trim(self, times, now):
+
+        while times and times[0][0] < now - self.window:
+            times.popleft()
+
+    def record_call(self, latency, outcome='ok'):
+
+        '''
+        Records a reach estimate call that took latency seconds. outcome is 'ok', 'rate_limit' or
+        'error'.
+        '''
+
+        self.record_batch(latency, {outcome: 1})
+
+    def record_batch(self, latency, outcomes):
+
+        '''
+        Records a batch request that took latency seconds, outcomes is a dictionary with the number
+        of its items by outcome. The latency goes to the histogram once.
+        '''
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            self.calls.update({outcome: calls for outcome, calls in outcomes.items() if calls})
+            self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self.latency_sum += latency
+
+            self._call_times.append((now, sum(outcomes.values())))
+            self._trim(self._call_times, now)
+
+    def record_wait(self, seconds):
+
+        '''
+        Records the seconds a worker waited for a token of the rate limiter.
+        '''
+
+        with self._lock:
+            self.throttle_wait += seconds
+
+    def record_cache_hits(self, hits=1):
+
+        with self._lock:
+            self.cache_hits += hits
+
+    def record_retry(self):
+
+        with self._lock:
+            self.retries += 1
+
+    def start_sweep(self, desc, total):
+
+        '''
+        Called at the start of a sweep of total requests.
+        '''
+
+        with self._lock:
+
+            self.desc = desc
+            self.total = total
+            self.done = 0
+            self.started_at = time.monotonic()
+            self._done_times.clear()
+            self._logged_at = self.started_at
+
+        if self.progress:
+
+            from tqdm.auto import tqdm
+            from tqdm.asyncio import tqdm as console_tqdm
+
+            # in a notebook the bar is always shown, in a console only if the output is a terminal
+            disable = None if self.progress == 'auto' and tqdm is console_tqdm else False
+
+            self._bar = tqdm(total=total, desc=desc, disable=disable)
+
+    def advance(self, n=1):
+
+        '''
+        Called every time n requests of the current sweep are completed.
+        '''
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            self.done += n
+            self._done_times.append((now, n))
+            self._trim(self._done_times, now)
+
+            log = self.logger is not None and now - self._logged_at >= self.log_interval
+
+            if log:
+                self._logged_at = now
+
+        if self._bar is not None:
+            self._bar.update(n)
+
+        if log:
+            self.log('sweep_progress')
+
+    def end_sweep(self):
+
+        '''
+        Called at the end of a sweep, even if it was interrupted.
+        '''
+
+        if self._bar is not None:
+            self._bar.close()
+            self._bar = None
+
+        if self.logger is not None:
+            self.log('sweep_finished')
+
+    def _rate(self, times, now):
+
+        self._trim(times, now)
+
+        if not times:
+            return 0.0
+
+        elapsed = min(self.window, now - self.started_at) if self.started_at is not None else self.window
+
+        return sum(n for _, n in times) / max(elapsed, 1e-9)
+
+    def snapshot(self):
+
+        '''
+        Returns a dictionary with all the figures recorded so far.
+        '''
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            done_rate = self._rate(self._done_times, now)
+            remaining = max(self.total - self.done, 0)
+
+            return {'sweep': self.desc,
+                    'total': self.total,
+                    'done': self.done,
+                    'remaining': remaining,
+                    'elapsed_seconds': now - self.started_at if self.started_at is not None else 0.0,
+                    'eta_seconds': remaining / done_rate if done_rate > 0 else None,
+                    'calls': dict(self.calls),
+                    'calls_per_second': self._rate(self._call_times, now),
+                    'latency_mean_seconds': self.latency_sum / max(sum(self.latency_buckets), 1),
+                    'latency_buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                                self.latency_buckets)),
+                    'throttle_wait_seconds': self.throttle_wait,
+                    'cache_hits': self.cache_hits,
+                    'retries': self.retries}
+
+    def log(self, event='sweep_progress'):
+
+        '''
+        Writes the snapshot to the logger as a json record.
+        '''
+
+        self.logger.info(json.dumps(dict(self.snapshot(), event=event)))
+
+    def prometheus(self):
+
+        '''
+        Returns the figures in the Prometheus text exposition format.
+        '''
+
+        snapshot = self.snapshot()
+        lines = ['# HELP reach_calls_total Reach estimate calls made, by outcome.',
+                 '# TYPE reach_calls_total counter']
+
+        for outcome, calls in sorted(snapshot['calls'].items()):
+            lines.append('reach_calls_total{{outcome="{}"}} {}'.format(outcome, calls))
+
+        lines += ['# HELP reach_call_latency_seconds Latency of the reach estimate calls and batches.',
+                  '# TYPE reach_call_latency_seconds histogram']
+
+        cumulative = 0
+        for bound, count in snapshot['latency_buckets'].items():
+            cumulative += count
+            lines.append('reach_call_latency_seconds_bucket{{le="{}"}} {}'.format(bound, cumulative))
+
+        lines += ['reach_call_latency_seconds_sum {}'.format(self.latency_sum),
+                  'reach_call_latency_seconds_count {}'.format(cumulative)]
+
+        for name, kind, help_text, value in (
+                ('reach_throttle_wait_seconds_total', 'counter', 'Seconds spent waiting for the rate limiter.',
+                 snapshot['throttle_wait_seconds']),
+                ('reach_cache_hits_total', 'counter', 'Requests answered by the cache.', snapshot['cache_hits']),
+                ('reach_retries_total', 'counter', 'Requests sent again after a rate limit error.', snapshot['retries']),
+                ('reach_calls_per_second', 'gauge', 'Calls per second over the last window.',
+                 snapshot['calls_per_second']),
+                ('reach_sweep_remaining', 'gauge', 'Requests left in the current sweep.', snapshot['remaining']),
+                ('reach_sweep_eta_seconds', 'gauge', 'Estimated seconds to the end of the current sweep.',
+                 snapshot['eta_seconds'] if snapshot['eta_seconds'] is not None else 'NaN')):
+
+            lines += ['# HELP {} {}'.format(name, help_text),
+                      '# TYPE {} {}'.format(name, kind),
+                      '{} {}'.format(name, value)]
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+
+        '''
+        Serves prometheus() on http://host:port/metrics from a background thread and returns the
+        server (call its shutdown method to stop it).
+        '''
+
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        instrumentation = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                body = instrumentation.prometheus().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return server
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+class JobJournal:
+
+    '''
+    An append-only log of the cells completed by a sweep. The first line of the log describes the
+    job (the function called and its arguments), every following line records a cell as soon as
+    the api answers it, so that nothing is lost if the process crashes or the machine reboots in
+    the middle of a sweep that lasts several days. The log is a text file with one JSON object per
+    line stored in journal_dir/job_id.jsonl.
+
+    Arguments:
+
+        - job_id: the name of the job, a random one is generated if None;
+        - journal_dir: the directory where the logs are kept.
+    '''
+
+    def __init__(self, job_id=None, journal_dir='journals'):
+
+        self.job_id = uuid.uuid4().hex[:12] if job_id is None else job_id
+        self.journal_dir = journal_dir
+        self.path = os.path.join(journal_dir, '{}.jsonl'.format(self.job_id))
+
+        self._lock = threading.Lock()
+        self._checked = False
+
+    def exists(self):
+
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def _append(self, *records):
+
+        with self._lock:
+
+            if not os.path.exists(self.journal_dir):
+                os.makedirs(self.journal_dir)
+
+            line = ''.join(json.dumps(record) + '\n' for record in records)
+
+            if not self._checked and self.exists():
+
+                # a crash may have left the last line incomplete, start a new one
+                with open(self.path, 'rb') as log:
+                    log.seek(-1, os.SEEK_END)
+                    if log.read(1) != b'\n':
+                        line = '\n' + line
+
+            self._checked = True
+
+            with open(self.path, 'a') as log:
+                log.write(line)
+                log.flush()
+                os.fsync(log.fileno())
+
+    def start(self, function, **arguments):
+
+        '''
+        Writes the description of the job, unless the log already has one. In that case the job
+        must be the same: a ValueError is raised if the function or any of the arguments differ from
+        the ones stored, since the cells of the log would not belong to the new sweep.
+        '''
+
+        if not self.exists():
+            self._append(dict(type='job', job_id=self.job_id, function=function,
+                              created_at=time.time(), **arguments))
+            return
+
+        job, _ = self.read()
+        requested = json.loads(json.dumps(dict(arguments, function=function)))
+        different = sorted(key for key, value in requested.items() if job is None or job.get(key) != value)
+
+        if different:
+            raise ValueError('The journal of the job {} in {} belongs to a different sweep (its {} differ), '
+                             'use another job_id or resume the job'.format(self.job_id, self.journal_dir,
+                                                                           ', '.join(different)))
+
+    def record(self, destination, origin, targeting_spec, users):
+
+        '''
+        Appends a completed cell to the log.
+        '''
+
+        self._append({'type': 'cell',
+                      'destination': destination,
+                      'origin': origin,
+                      'spec': targeting_spec,
+                      'users': users,
+                      'fetched_at': time.time()})
+
+    def record_carried(self, cells):
+
+        '''
+        Appends, with a single write, the cells an incremental sweep carries forward from the
+        previous table instead of fetching them. cells is a list of (destination, origin, users,
+        staleness) tuples, where staleness is the number of runs the cell has been carried forward for.
+        '''
+
+        if not cells:
+            return
+
+        now = time.time()
+
+        self._append(*[{'type': 'cell',
+                        'destination': destination,
+                        'origin': origin,
+                        'users': users,
+                        'staleness': staleness,
+                        'fetched_at': now} for destination, origin, users, staleness in cells])
+
+    def read(self):
+
+        '''
+        Returns a tuple whose first element is the description of the job and whose second element
+        is the list of the cells recorded so far. A last line left incomplete by a crash is ignored.
+        '''
+
+        if not self.exists():
+            raise FileNotFoundError('There is no journal for the job {} in {}'.format(self.job_id,
+                                                                                      self.journal_dir))
+
+        job = None
+        cells = []
+
+        with open(self.path) as log:
+
+            for line in log:
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                if record['type'] == 'job':
+                    job = record
+                else:
+                    cells.append(record)
+
+        return job, cells
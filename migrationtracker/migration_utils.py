@@ -0,0 +1,391 @@
+import time
+
+from .catalog_utils import get_catalog
+from .engine_utils import get_engine
+from .journal_utils import JobJournal
+from .refresh_utils import RefreshPolicy
+from .sweep_utils import Sweep, destination_axis, origin_axis
+from .table_utils import ResultBuffer
+
+def gen_mig_table(access_token, user_id, destinations = 'all', origins = 'all', age_min = 18, age_max = 65,
+                  engine = None, max_workers = 4, backend = None, job_id = None, journal_dir = 'journals', mig_table = None,
+                  previous = None, history = (), refresh_policy = None):
+    
+    '''
+    This function calls the Facebook Marketing Api and returns a table whose index is a list of receiving
+    countries passed through the destinations variable and whose columns are the sending countries
+    passed through the origins list. Notice that the number returned refer to the stock of 
+    migrants from a given sending country to a given receving country (as estimated by Facebook) and
+    are updated to the moment when the function is called. In order for the function to work the
+    Facebook Api needs to be set.
+    
+    Arguments:
+        
+        - destinations and origins: this are lists of countries like [Country 1, Country 2, etc.] where 
+                                     all elements of the lists are strings and represent country names;
+        - access_token: your facebook user access token, find out more at 
+                         https://developers.facebook.com/docs/marketing-api/access;
+        - user_id: your facebook user id;
+        - age_min and age_max: the minimum and maximum age users should have to be included in your
+                               estimates;
+        - engine: the ReachEngine used to run the requests, by default one with max_workers threads
+                  sharing a token bucket that adapts to the api call limit;
+        - backend: the estimate backend used when no engine is passed, by default a FacebookBackend
+                   (a SimulatorBackend allows to run the sweep offline);
+        - job_id: if passed, every completed cell is written to the journal of the job as soon as
+                  it is fetched (see JobJournal) so that the sweep can be completed with resume(job_id)
+                  after a crash;
+        - journal_dir: the directory where the journals are kept;
+        - mig_table: a partially filled table (a DataFrame or a ResultBuffer), only its empty (NaN)
+                     cells are fetched;
+        - previous: the table of the previous sweep, if passed the sweep is incremental: only the
+                    cells selected by refresh_policy (by default a RefreshPolicy()) are fetched and
+                    the other ones are carried forward from previous;
+        - history: an optional list of older tables, oldest first, that refresh_policy uses to find
+                   the cells that change a lot.
+                   
+    In an incremental sweep the returned table has a staleness table in table.attrs['staleness'],
+    with the number of runs every cell has been carried forward for (0 for the cells fetched now).
+    It is read from previous.attrs, if present, to chain the monthly runs.
+    '''
+
+    import numpy as np
+
+    start_time = time.time()
+
+    engine = get_engine(user_id, engine, max_workers=max_workers, backend=backend, access_token=access_token)
+    call_counter = 0
+    
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+    
+    if destinations == 'all':
+        destinations = list(dest_dict.keys())
+    
+    if origins == 'all':
+        origins = list(origin_dict.keys())
+    
+    check_countries(destinations,dest_dict)
+    check_countries(origins,origin_dict)
+    
+    buffer = ResultBuffer({'destination': destinations, 'origin': origins + ['Total Population']})
+    
+    if isinstance(mig_table, ResultBuffer):
+        buffer = mig_table
+    elif mig_table is not None:
+        buffer.values[:] = mig_table.reindex(index=destinations, 
+                                             columns=origins + ['Total Population']).to_numpy(dtype=float)
+    
+    staleness = None
+    
+    if previous is not None:
+        
+        previous_staleness = previous.attrs.get('staleness')
+        previous = previous.reindex(index=destinations, columns=origins + ['Total Population'])
+        
+        policy = RefreshPolicy() if refresh_policy is None else refresh_policy
+        carried, staleness = policy.carry_forward(previous, previous_staleness, history)
+        
+        # the cells already filled through mig_table count as fresh
+        missing = np.isnan(buffer.values)
+        buffer.values[missing] = carried.to_numpy(dtype=float)[missing]
+        staleness = staleness.where(missing, 0)
+        
+        print('{} of {} cells are carried forward from the previous table'.format(int((staleness.values > 0).sum()), 
+                                                                                  staleness.size))
+    
+    journal = None
+    
+    if job_id is not None:
+        journal = JobJournal(job_id, journal_dir)
+        journal.start('gen_mig_table', destinations=destinations, origins=origins, age_min=age_min, age_max=age_max)
+        
+        if staleness is not None:
+            
+            # the carried cells are journaled too, so that resume does not fetch them again
+            carried = np.argwhere((staleness.values > 0) & ~np.isnan(buffer.values))
+            journal.record_carried([(staleness.index[i], staleness.columns[j], float(buffer.values[i, j]), 
+                                     int(staleness.values[i, j])) for i, j in carried])
+    
+    try:
+    
+        while len(destinations)>0:
+            
+            filled = int((~np.isnan(buffer.values)).sum())
+            errors = {}
+
+            buffer, origins, destinations, call_counter = get_mig_table_timeout(access_token, 
+                                                                                user_id, 
+                                                                                buffer, 
+                                                                                destinations, 
+                                                                                origins,
+                                                                                dest_dict,
+                                                                                origin_dict,
+                                                                                age_min, 
+                                                                                age_max,
+                                                                                call_counter,
+                                                                                engine=engine,
+                                                                                journal=journal,
+                                                                                errors=errors)
+            
+            print('{} seconds have passed'.format(time.time() - start_time))
+            
+            if len(destinations)==0:
+                break
+            
+            # only the cells that hit the rate limit can be filled by trying again, and only if the
+            # last pass made progress or Facebook paused the calls for a while
+            rate_limited = any(engine.backend.is_rate_limit_error(error) for error in errors.values())
+            progress = int((~np.isnan(buffer.values)).sum()) > filled
+            
+            if not rate_limited or not (progress or engine.paused_for() > 0):
+                
+                print('{} cells could not be fetched, the sweep is stopped'.format(int(np.isnan(buffer.values).sum())))
+                break
+                
+            print('You hit the api call limit, the execution of the code will be resumed \n' +
+                  'in {:.0f} seconds, when Facebook allows it'.format(engine.paused_for()))
+            
+    except KeyboardInterrupt as interrupt:
+        
+        print(interrupt)
+        
+    finally: 
+        
+        table = buffer.to_frame()
+        
+        if staleness is not None:
+            table.attrs['staleness'] = staleness
+        
+        return table, origins, destinations, call_counter      
+
+def get_mig_sweep(destinations, origins, dest_dict, origin_dict, age_min = 18, age_max = 65):
+    
+    '''
+    Returns the Sweep of the migration table: its cells are (destination, origin) pairs, where
+    origin is either one of origins or 'Total Population', whose spec targets the whole population
+    of the destination.
+    '''
+    
+    return Sweep([destination_axis(destinations, dest_dict), origin_axis(origins, origin_dict, total=True)],
+                 base={'age_min': age_min, 'age_max': age_max})
+
+def get_mig_specs(destinations, origins, dest_dict, origin_dict, age_min = 18, age_max = 65):
+    
+    '''
+    Returns a dictionary whose keys are (destination, origin) pairs and whose values are the targeting
+    specs needed to estimate the stock of migrants from origin living in destination. For every
+    destination the dictionary also contains the (destination, 'Total Population') key whose spec
+    targets the whole population of the country.
+    '''
+    
+    return dict(get_mig_sweep(destinations, origins, dest_dict, origin_dict, age_min, age_max).specs())
+
+def get_mig_table_timeout(access_token, user_id, mig_table, destinations, origins, dest_dict, origin_dict,
+                          age_min = 18, age_max = 65, call_counter = 0, delay = 2, engine = None, journal = None, backend = None,
+                          errors = None):
+    
+    '''
+    This function calls the Facebook Marketing Api and returns a table whose index is a list of receiving
+    countries passed through the destinations list and whose columns are the sending countries
+    passed through the origins list. Notice that the number returned refer to the stock of 
+    migrants from a given sending country to a given receving country (as estimated by Facebook) and
+    are updated to the moment when the function is called. In order for the function to work the
+    Facebook Api needs to be set.
+    
+    Arguments:
+        
+        - destinations and origins: this are lists of countries like [Country 1, Country 2, etc.] where 
+                                     all elements of the lists are strings and represent country names;
+        - access_token: your facebook user access token, find out more at 
+                         https://developers.facebook.com/docs/marketing-api/access;
+        - user_id: your facebook user id;
+        - age_min and age_max: the minimum and maximum age users should have to be included in your
+                               estimates;
+        - delay: the minimum number of seconds between two calls, used only when no engine is passed;
+        - engine: the ReachEngine used to run the requests concurrently;
+        - backend: the estimate backend used when no engine is passed;
+        - journal: an optional JobJournal where every completed cell is recorded;
+        - errors: an optional dictionary that is updated with the errors of the cells that could
+                  not be fetched, keyed by (destination, origin).
+                               
+    This function is designed to be used through the gen_mig_table function and is able to deal with large
+    requests which are likely to reach the api call limit. Only the cells of mig_table that are still
+    empty (NaN) are fetched, and the destinations and origins returned are the ones with at least one
+    cell that could not be filled. mig_table can be a DataFrame or a ResultBuffer, in which case the
+    results are written directly in its array and the same buffer is returned.
+    '''
+
+    engine = get_engine(user_id, engine, delay=delay, backend=backend, access_token=access_token)
+    calls_before = engine.call_counter
+    
+    if isinstance(mig_table, ResultBuffer):
+        buffer = mig_table
+    elif 'Total Population' in mig_table.columns:
+        buffer = ResultBuffer.from_frame(mig_table)
+    else:
+        buffer = ResultBuffer.from_frame(mig_table.reindex(columns=list(mig_table.columns) + ['Total Population']))
+    
+    sweep = get_mig_sweep(destinations, origins, dest_dict, origin_dict, age_min, age_max)
+    
+    callback = None
+    
+    if journal is not None:
+        callback = lambda key, spec, users: journal.record(key[0], key[1], spec, users)
+    
+    buffer, sweep_errors = sweep.run(engine, buffer, desc='mig_table', callback=callback)
+    
+    for error in set(map(str, sweep_errors.values())):
+        print(error)
+    
+    if errors is not None:
+        errors.update(sweep_errors)
+    
+    keys = list(sweep.keys())
+    missing = [key for key, is_missing in zip(keys, buffer.is_missing(keys)) if is_missing]
+    missing_destinations = {key[0] for key in missing}
+    missing_origins = {key[1] for key in missing}
+    
+    remaining_destinations = [destination for destination in destinations if destination in missing_destinations]
+    remaining_origins = [origin for origin in origins if origin in missing_origins]
+    
+    call_counter += engine.call_counter - calls_before
+    
+    if not isinstance(mig_table, ResultBuffer):
+        mig_table = buffer.to_frame()
+    
+    return mig_table, remaining_origins, remaining_destinations, call_counter
+    
+def get_mig_table(access_token, user_id, destinations = 'all', origins = 'all', age_min = 18, age_max = 65,
+                  engine = None, max_workers = 4, backend = None):
+    
+    '''
+    This function call the Facebook Ads Api and returns a table whose index is a list of receiving
+    countries passed through the destinations variable and whose columns are the sending countries
+    passed through the origins list. Notice that the number returned refer to the stock of 
+    migrants from a given sending country to a given receving country (as estimated by Facebook) and
+    are updated to the moment when the function is called. In order for the function to work the
+    Facebook Ads Api needs to be set.
+    
+    Arguments:
+        
+        - destinations and origins: this are lists of countries like [Country 1, Country 2, etc.] where 
+                                     all elements of the lists are strings and represent country names;
+        - access_token: your facebook user access token, find out more at 
+                         https://developers.facebook.com/docs/marketing-api/access;
+        - user_id: your facebook user id;
+        - age_min and age_max: the minimum and maximum age users should have to be included in your
+                               estimates;
+        - engine: the ReachEngine used to run the requests, by default one with max_workers threads;
+        - backend: the estimate backend used when no engine is passed.
+                   
+    '''
+
+    engine = get_engine(user_id, engine, max_workers=max_workers, backend=backend, access_token=access_token)
+    
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+    
+    if destinations == 'all':
+        destinations = list(dest_dict.keys())
+
+    if origins == 'all':
+        origins = list(origin_dict.keys())
+
+    check_countries(destinations,dest_dict)
+    check_countries(origins,origin_dict)
+    
+    sweep = get_mig_sweep(destinations, origins, dest_dict, origin_dict, age_min, age_max)
+    buffer, errors = sweep.run(engine, desc='mig_table')
+    
+    if errors:
+        raise next(iter(errors.values()))
+        
+    return buffer.to_frame()
+
+def resume(job_id, access_token, user_id, journal_dir = 'journals', engine = None, max_workers = 4, backend = None):
+    
+    '''
+    Completes a sweep started by gen_mig_table with the same job_id. The table is rebuilt from the
+    cells recorded in the journal of the job and only the cells that are still missing are fetched.
+    The output is the same as the one of gen_mig_table: if the job was an incremental sweep the
+    cells it carried forward are in the journal too, and the table has their staleness in
+    table.attrs['staleness'].
+    '''
+    
+    import pandas as pd
+    
+    job, cells = JobJournal(job_id, journal_dir).read()
+    
+    mig_table = ResultBuffer({'destination': job['destinations'], 'origin': job['origins'] + ['Total Population']})
+    mig_table.fill({(cell['destination'], cell['origin']): cell['users'] for cell in cells})
+    
+    staleness = None
+    
+    if any('staleness' in cell for cell in cells):
+        
+        staleness = pd.DataFrame(0, index=job['destinations'], columns=job['origins'] + ['Total Population'])
+        
+        # a cell fetched after being carried forward by an earlier attempt is fresh again
+        for cell in cells:
+            staleness.loc[cell['destination'], cell['origin']] = cell.get('staleness', 0)
+    
+    output = gen_mig_table(access_token, 
+                         user_id, 
+                         job['destinations'], 
+                         job['origins'], 
+                         job['age_min'], 
+                         job['age_max'],
+                         engine = engine,
+                         max_workers = max_workers,
+                         backend = backend,
+                         job_id = job_id,
+                         journal_dir = journal_dir,
+                         mig_table = mig_table)
+    
+    if staleness is not None:
+        output[0].attrs['staleness'] = staleness
+    
+    return output
+
+def get_destinations(access_token):
+    
+    '''
+    Gets an updated dictionaty of available destinations names and corresponding codes.
+    The dictionary comes from the local CountryCatalog and is downloaded from facebook api
+    only when the catalog is missing or too old.
+    '''
+    
+    return dict(get_catalog(access_token).destinations)
+
+def get_origins(access_token):
+    
+    '''
+    Gets an updated dictionaty of available origins names and corresponding codes.
+    The dictionary comes from the local CountryCatalog and is downloaded from facebook api
+    only when the catalog is missing or too old.
+    '''
+    
+    return dict(get_catalog(access_token).origins)
+
+def check_countries(countries, countries_dict):
+    
+    '''
+    Check that the destinations and origins passed belong to the respective dictionaries
+    and report an error if they don't.
+    '''
+    
+    error_message =  ('The country you specified ({}) is not available, \n' +
+                      'maybe you mispelled it. You can check the full list \n' +
+                      'of destinations available by calling the get_destinations() \n' + 
+                      'or the get_origins functions. use the syntax: \n\n' +
+                      '    for elem in sorted(get_destinations().items()): \n' +
+                      '		print(elem[0]) \n\n' +
+                      'to have an ordered list of countries.') 
+    
+    for country in countries:
+        
+        assert (country in countries_dict), error_message.format(country)
+    
\ No newline at end of file
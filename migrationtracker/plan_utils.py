@@ -0,0 +1,141 @@
+from .catalog_utils import get_catalog
+from .migration_utils import check_countries
+from .query_utils import QueryGraph, get_table_specs, get_age_grids
+from .rate_utils import TokenBucket
+
+class SweepPlan:
+
+    '''
+    The result of plan_sweep. The main attributes are:
+
+        - specs: a dictionary whose keys are (table, key) tuples, where key is the one used by the
+                 corresponding function (e.g. (destination, origin) for the mig_table), and whose
+                 values are the targeting specs;
+        - unique_specs: the deduplicated specs, keyed by their spec_key, that the sweep needs once
+                        the cells that can be summed from others are derived (see QueryGraph);
+        - derived: the cells that are derived instead of fetched;
+        - cached: the spec_keys that are already in the cache;
+        - to_fetch: the deduplicated specs that still need a call, keyed by their spec_key;
+        - refetch: the specs of the derived cells, keyed by their spec_key, that are fetched directly
+                   after the sweep if one of their parts turns out to be at the 1000 floor (see
+                   QueryGraph.refetch). They are not in the shards, and n_calls does not count them
+                   while max_calls does;
+        - rate: the number of calls per second assumed for the estimate of the duration;
+        - shards: a list of dictionaries splitting to_fetch in groups of at most shard_calls specs.
+    '''
+
+    def __init__(self, specs, unique_specs, cached, rate, shard_calls=None, derived=(), refetch=None):
+
+        self.specs = specs
+        self.unique_specs = unique_specs
+        self.derived = set(derived)
+        self.cached = cached
+        self.to_fetch = {key: spec for key, spec in unique_specs.items() if key not in cached}
+        self.refetch = {} if refetch is None else refetch
+        self.rate = rate
+
+        items = list(self.to_fetch.items())
+        shard_calls = len(items) if not shard_calls else shard_calls
+        self.shards = [dict(items[i:i + shard_calls]) for i in range(0, len(items), max(shard_calls, 1))]
+
+    @property
+    def n_calls(self):
+
+        return len(self.to_fetch)
+
+    @property
+    def max_calls(self):
+
+        '''
+        The number of calls of the sweep if every derived cell has to be fetched again.
+        '''
+
+        return self.n_calls + len(self.refetch)
+
+    @property
+    def seconds(self):
+
+        '''
+        The expected duration of the sweep at the current rate limit.
+        '''
+
+        return self.n_calls / self.rate
+
+    def summary(self):
+
+        '''
+        Returns a dictionary with the main figures of the plan.
+        '''
+
+        return {'cells': len(self.specs),
+                'unique_specs': len(self.unique_specs),
+                'derived': len(self.derived),
+                'cached': len(self.cached),
+                'calls': self.n_calls,
+                'max_calls': self.max_calls,
+                'rate': self.rate,
+                'hours': self.seconds / 3600,
+                'max_hours': self.max_calls / self.rate / 3600,
+                'shards': len(self.shards)}
+
+    def __repr__(self):
+
+        return ('SweepPlan({cells} cells, {unique_specs} unique specs, {derived} derived, {cached} cached, {calls} calls '
+                '(up to {max_calls} with the refetches), {hours:.1f} hours at {rate:.3g} calls per second, '
+                '{shards} shards)'.format(**self.summary()))
+
+def plan_sweep(access_token=None, user_id=None, destinations='all', origins='all', age_min=None, age_max=None,
+               tables=('mig_table',), engine=None, backend=None, cache=None, rate=None, shard_calls=None,
+               age_groups=None, derive=True):
+
+    '''
+    Lists the calls a sweep would make before running it. The arguments are the same of gen_mig_table
+    and of the age structure functions, plus:
+
+        - tables: the tables to be built, among 'mig_table', 'age_structure_mig' and
+                  'age_structure_countries' (e.g. all three for get_all_age_structure_tables plus
+                  gen_mig_table);
+        - age_min and age_max: if None, the default of each function is used;
+        - engine: the ReachEngine that will run the sweep, its cache and rate limit are used if they
+                  are not passed explicitly;
+        - cache: a ReachCache, the specs already in it do not count as calls;
+        - rate: the number of calls per second allowed, by default the maximum rate of the engine
+                (or of a default TokenBucket);
+        - shard_calls: the maximum number of calls per shard, e.g. the hourly quota of an account,
+                       so that the shards can be scheduled across several accounts and tokens;
+        - age_groups and derive: as in get_tables, the plan counts the calls of a sweep run by it.
+
+    No reach estimate call is made, only the catalog of countries may be downloaded. The output is
+    a SweepPlan.
+    '''
+
+    if backend is None and engine is not None:
+        backend = engine.backend
+
+    if cache is None and engine is not None:
+        cache = engine.cache
+
+    if rate is None:
+        rate = engine.max_rate if engine is not None else TokenBucket().max_rate
+
+    catalog = get_catalog(access_token, backend=backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+
+    if destinations == 'all':
+        destinations = list(dest_dict.keys())
+
+    if origins == 'all':
+        origins = list(origin_dict.keys())
+
+    check_countries(destinations,dest_dict)
+    check_countries(origins,origin_dict)
+
+    specs = get_table_specs(tables, destinations, origins, dest_dict, origin_dict, age_min, age_max, age_groups)
+
+    graph = QueryGraph(specs, get_age_grids(tables, age_min, age_max, age_groups), cache, derive)
+    unique_specs = graph.requests
+
+    cached = cache.cached_keys(unique_specs) if cache is not None else set()
+
+    return SweepPlan(specs, unique_specs, cached, rate, shard_calls, graph.derived, graph.possible_refetch())
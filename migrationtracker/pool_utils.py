@@ -0,0 +1,273 @@
+import itertools
+import queue
+import threading
+import time
+
+from .backend_utils import FacebookBackend
+from .cache_utils import dedupe_requests, expand_callback, expand_results
+from .engine_utils import ReachEngine
+from .instrument_utils import Instrumentation
+
+class EnginePool:
+
+    '''
+    Runs a sweep with several credentials at the same time. Every credential (an access token and
+    an ad account) has its own ReachEngine, i.e. its own api session, token bucket and throttle
+    controller, and its own worker threads. All the workers take the requests from a single shared
+    queue, and a worker only takes a request once its own bucket hands it a token, so the work
+    flows towards the credentials that are not throttled. A request that hits the rate limit of an
+    account is put back in the queue for any account to take, and a credential whose token is
+    revoked or expired is dropped and its request handed to the others. The results of all the
+    credentials end up in the same table, so the throughput grows roughly linearly with the number
+    of accounts.
+
+    An EnginePool can be passed as engine to gen_mig_table and to the other sweep functions.
+
+    Arguments:
+
+        - engines: the ReachEngines of the credentials (their batch_size and cache are ignored);
+        - cache: an optional ReachCache shared by all the credentials;
+        - max_retries: how many times a request that hit a rate limit is put back in the queue before
+                       being given up;
+        - instrumentation: the Instrumentation that records the calls of all the credentials and
+                           shows the progress of the sweeps (the ones of the engines are not used).
+    '''
+
+    def __init__(self, engines, cache=None, max_retries=5, instrumentation=None):
+
+        self.engines = list(engines)
+        self.cache = cache
+        self.max_retries = max_retries
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+
+        self.revoked = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_credentials(cls, credentials, cache=None, max_retries=5, instrumentation=None, **engine_kwargs):
+
+        '''
+        Builds a pool from a list of (access_token, user_id) pairs, every other keyword argument is
+        passed to the ReachEngine of each credential (e.g. limiter or max_workers). Since the engines
+        cannot share a TokenBucket, pass limiter_factory=lambda: TokenBucket(...) to give each one a
+        new bucket.
+        '''
+
+        limiter_factory = engine_kwargs.pop('limiter_factory', None)
+        engines = []
+
+        for access_token, user_id in credentials:
+
+            if limiter_factory is not None:
+                engine_kwargs['limiter'] = limiter_factory()
+
+            engines.append(ReachEngine(user_id, backend=FacebookBackend(user_id, access_token), **engine_kwargs))
+
+        return cls(engines, cache, max_retries, instrumentation)
+
+    @property
+    def active_engines(self):
+
+        return [engine for engine in self.engines if id(engine) not in self.revoked]
+
+    @property
+    def backend(self):
+
+        '''
+        The backend of the first credential that is still active, used e.g. to load the catalog.
+        '''
+
+        return self.active_engines[0].backend if self.active_engines else self.engines[0].backend
+
+    @property
+    def call_counter(self):
+
+        return sum(engine.call_counter for engine in self.engines)
+
+    @property
+    def max_rate(self):
+
+        return sum(engine.max_rate for engine in self.active_engines)
+
+    def paused_for(self):
+
+        '''
+        Returns the number of seconds before at least one credential can call the api again.
+        '''
+
+        return min([engine.paused_for() for engine in self.active_engines] or [0.0])
+
+    def stop(self):
+
+        '''
+        Stops the sweep that is running, e.g. from another thread (see ReachEngine.stop).
+        '''
+
+        self._stop.set()
+
+    def _work(self, engine, work, done, stop):
+
+        while not stop.is_set():
+
+            start = time.monotonic()
+            acquired = engine.limiter.acquire(stop)
+            self.instrumentation.record_wait(time.monotonic() - start)
+
+            if not acquired:
+                return
+
+            # the token is kept until there is a request to spend it on
+            while True:
+
+                if stop.is_set():
+                    return
+
+                try:
+                    key, spec, attempt = work.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    continue
+
+            with engine._lock:
+                engine.call_counter += 1
+
+            start = time.monotonic()
+
+            try:
+                users, headers = engine.fetch(spec)
+
+            except Exception as error:
+
+                rate_limited = engine.backend.is_rate_limit_error(error)
+                self.instrumentation.record_call(time.monotonic() - start, 'rate_limit' if rate_limited else 'error')
+
+                if engine.backend.is_auth_error(error):
+
+                    with self._lock:
+                        self.revoked.add(id(engine))
+
+                    print('A credential was dropped from the pool: {}'.format(error))
+
+                    work.put((key, spec, attempt))
+
+                    return
+
+                if rate_limited:
+
+                    engine._on_rate_limit(error)
+
+                    if attempt < self.max_retries:
+                        self.instrumentation.record_retry()
+                        work.put((key, spec, attempt + 1))
+                        continue
+
+                done.put((key, None, error))
+                continue
+
+            self.instrumentation.record_call(time.monotonic() - start)
+            engine._on_success(spec, users, headers)
+            done.put((key, users, None))
+
+    def run(self, requests, desc='requests', callback=None, max_in_flight=None):
+
+        '''
+        Runs every request with all the active credentials. The arguments and the output are the same
+        of ReachEngine.run (max_in_flight defaults to twice the number of workers of all the
+        credentials), and requests sharing the same targeting spec are sent only once.
+        '''
+
+        unique, groups = dedupe_requests(requests)
+
+        if len(unique) < len(requests):
+
+            # every distinct targeting spec is sent only once and its answer shared by all its keys
+            results, errors = self.run(unique, desc, expand_callback(callback, requests, groups), max_in_flight)
+
+            return expand_results(results, groups), expand_results(errors, groups)
+
+        results = {}
+        errors = {}
+
+        if not self.active_engines:
+            raise RuntimeError('All the credentials of the pool have been revoked')
+
+        work = queue.Queue()
+        done = queue.Queue()
+        stop = self._stop
+        stop.clear()
+
+        to_send = []
+
+        for key, spec in requests.items():
+
+            users = self.cache.get(spec) if self.cache is not None else None
+
+            if users is None:
+                to_send.append((key, spec, 0))
+                continue
+
+            results[key] = users
+
+            if callback is not None:
+                callback(key, spec, users)
+
+        pending = len(to_send)
+        self.instrumentation.record_cache_hits(len(results))
+        self.instrumentation.start_sweep(desc, pending)
+
+        threads = [threading.Thread(target=self._work, args=(engine, work, done, stop), daemon=True)
+                   for engine in self.active_engines for _ in range(engine.max_workers)]
+
+        # the requests are queued only as the answers are consumed, see ReachEngine.run
+        max_in_flight = max(len(threads), 2 * len(threads) if max_in_flight is None else max_in_flight)
+        to_send = iter(to_send)
+
+        for item in itertools.islice(to_send, max_in_flight):
+            work.put(item)
+
+        for thread in threads:
+            thread.start()
+
+        try:
+
+            while pending > 0:
+
+                try:
+                    key, users, error = done.get(timeout=0.5)
+                except queue.Empty:
+                    if stop.is_set():
+                        break
+                    if not any(thread.is_alive() for thread in threads):
+                        print('All the credentials of the pool have been revoked')
+                        break
+                    continue
+
+                pending -= 1
+                self.instrumentation.advance(1)
+
+                for item in itertools.islice(to_send, 1):
+                    work.put(item)
+
+                if error is not None:
+                    errors[key] = error
+                    continue
+
+                results[key] = users
+
+                if self.cache is not None:
+                    self.cache.set(requests[key], users)
+
+                if callback is not None:
+                    callback(key, requests[key], users)
+
+        finally:
+
+            stop.set()
+
+            for thread in threads:
+                thread.join()
+
+            self.instrumentation.end_sweep()
+
+        return results, errors
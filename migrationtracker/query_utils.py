@@ -0,0 +1,405 @@
+import re
+
+from .age_str_utils import get_age_str_specs, build_age_str_dict, GENDERS
+from .cache_utils import spec_key
+from .catalog_utils import get_catalog
+from .dem_utils import get_age_groups
+from .engine_utils import get_engine
+from .migration_utils import get_mig_specs, check_countries
+from .table_utils import ResultBuffer
+
+# The tables a sweep can build and the default age limits of the corresponding functions
+TABLES = {'mig_table': (18, 65),
+          'age_structure_mig': (13, 65),
+          'age_structure_countries': (13, 65)}
+
+# Facebook treats 65 as '65 and older', so an age group without upper limit ends at 65
+MAX_AGE = 65
+
+def get_table_specs(tables, destinations, origins, dest_dict, origin_dict, age_min=None, age_max=None,
+                    age_groups=None):
+
+    '''
+    Returns the targeting specs of all the cells of the requested tables, keyed by (table, key) where
+    key is the one used by the function building the table. If age_min or age_max are None the
+    default of each table is used, and age_groups can replace the age groups of the age structure
+    tables (see get_age_str_specs).
+    '''
+
+    specs = {}
+
+    for table in tables:
+
+        table_min, table_max = TABLES[table]
+        table_min = table_min if age_min is None else age_min
+        table_max = table_max if age_max is None else age_max
+
+        if table == 'mig_table':
+            table_specs = get_mig_specs(destinations, origins, dest_dict, origin_dict, table_min, table_max)
+        elif table == 'age_structure_mig':
+            table_specs = get_age_str_specs(destinations, origins, dest_dict, origin_dict, table_min, table_max,
+                                            age_groups)
+        else:
+            table_specs = get_age_str_specs(destinations, None, dest_dict, None, table_min, table_max, age_groups)
+
+        specs.update({(table, key): spec for key, spec in table_specs.items()})
+
+    return specs
+
+def get_table_age_groups(table, age_min=None, age_max=None, age_groups=None):
+
+    '''
+    Returns the age groups of the age structure table, age_groups if it is not None.
+    '''
+
+    if age_groups is not None:
+        return age_groups
+
+    table_min, table_max = TABLES[table]
+    table_min = table_min if age_min is None else age_min
+    table_max = table_max if age_max is None else age_max
+
+    return get_age_groups(table_min, table_max)
+
+def get_age_grids(tables, age_min=None, age_max=None, age_groups=None):
+
+    '''
+    Returns the age groups into which the cells of a sweep can be split: the totals into the age
+    groups of the age structure tables that are requested, and any group into the five-year ones.
+    '''
+
+    age_grids = [get_table_age_groups(table, age_min, age_max, age_groups) for table in tables if table != 'mig_table']
+    age_grids.append(get_age_groups(13, MAX_AGE))
+
+    return age_grids
+
+def split_spec(targeting_spec, age_groups):
+
+    '''
+    Returns the list of targeting specs, one for each gender and age group of age_groups, whose
+    populations add up to the one of targeting_spec, or None if the age range of targeting_spec is
+    not made of whole age groups or if targeting_spec is already a single gender and age group.
+    '''
+
+    age_min = targeting_spec.get('age_min', 13)
+    age_max = targeting_spec.get('age_max', MAX_AGE)
+
+    parts = []
+    expected_min = age_min
+
+    for age_group in sorted(age_groups):
+
+        group_min = age_group[0]
+        group_max = age_group[1] if len(age_group) > 1 else MAX_AGE
+
+        if group_min < age_min or group_max > age_max:
+            continue
+
+        if group_min != expected_min:
+            return None
+
+        parts.append(age_group)
+        expected_min = group_max + 1
+
+    if not parts or expected_min != age_max + 1:
+        return None
+
+    genders = targeting_spec.get('genders') or list(GENDERS)
+
+    if len(parts) == 1 and len(genders) == 1:
+        return None
+
+    part_specs = []
+
+    for gender in genders:
+        for age_group in parts:
+
+            part = {key: value for key, value in targeting_spec.items() if key not in ('age_min', 'age_max', 'genders')}
+            part['genders'] = [gender]
+            part['age_min'] = age_group[0]
+
+            if len(age_group) > 1:
+                part['age_max'] = age_group[1]
+
+            part_specs.append(part)
+
+    return part_specs
+
+class QueryGraph:
+
+    '''
+    The dependency graph of the targeting specs of all the cells requested in a sweep. Every cell is
+    either fetched directly or derived as the sum of finer cells (the same population split by
+    gender and by the age groups of get_age_groups). A cell is derived only when all its parts are
+    already needed by other cells or are in the cache, so its parts never add calls; e.g. the
+    'Total Population' of a destination is the sum of its age-sex structure table when both are
+    requested with matching ages, and coarse age groups are sums of the five-year ones. A derived
+    cell can still cost a call after the sweep, see below. Every distinct spec is fetched only once
+    whatever the number of cells sharing it.
+
+    Only the cells of whole populations are derived, never the ones of migrants (the specs with
+    behaviors): most of their gender and age group parts are at Facebook's 1000 floor, and every
+    floor part would add 1000 users to the sum. A population cell with a part at the floor is left
+    out by resolve and has to be fetched directly after the sweep, see refetch: in the worst case
+    every derived cell costs one call after all (see possible_refetch).
+
+    Arguments:
+
+        - cells: a dictionary of targeting specs keyed by cell;
+        - age_grids: a list of dictionaries of age groups (with the structure of the output of
+                     get_age_groups) into which a cell can be split, tried in order, by default
+                     only the five-year groups of get_age_groups(13, 65);
+        - cache: an optional ReachCache, the cells it holds are not derived and the parts it holds
+                 count as available;
+        - derive: if False no cell is derived, the graph only removes the duplicated specs.
+    '''
+
+    def __init__(self, cells, age_grids=None, cache=None, derive=True):
+
+        age_grids = [get_age_groups(13, MAX_AGE)] if age_grids is None else age_grids
+
+        self.cells = cells
+        self.direct = {}
+        self.derived = {}
+
+        specs = {}
+
+        for key, spec in cells.items():
+            self.direct[key] = spec_key(spec)
+            specs.setdefault(self.direct[key], spec)
+
+        requested = set(specs)
+        candidates = {}
+
+        if derive:
+
+            for key, spec in cells.items():
+
+                candidates[key] = []
+
+                # the parts of migrants are mostly at the floor, see above
+                if 'behaviors' in spec or 'flexible_spec' in spec:
+                    continue
+
+                for age_groups in age_grids:
+
+                    parts = split_spec(spec, age_groups)
+
+                    if parts is not None:
+                        candidates[key].append({spec_key(part): part for part in parts})
+
+        # a single query to the cache for all the cells and all their possible parts
+        cached = set()
+        if cache is not None:
+            cached = cache.cached_keys(requested.union(*[part_keys for options in candidates.values()
+                                                         for part_keys in options]))
+
+        available = requested | cached
+
+        for key, options in candidates.items():
+
+            if self.direct[key] in cached:
+                continue
+
+            for parts in options:
+
+                if available.issuperset(parts):
+                    self.derived[key] = parts
+                    del self.direct[key]
+                    break
+
+        needed = set(self.direct.values())
+        for parts in self.derived.values():
+            needed.update(parts)
+            specs.update(parts)
+
+        self.requests = {shared_key: specs[shared_key] for shared_key in needed}
+
+    def resolve(self, results, floor=1000):
+
+        '''
+        Returns the value of every cell given the results of the requests (keyed by spec_key).
+        Cells whose spec, or one of whose parts, has no result are left out, and so are the derived
+        cells with a part at or below floor, whose sum would overcount them.
+        '''
+
+        values = {}
+
+        for key, shared_key in self.direct.items():
+            if shared_key in results:
+                values[key] = results[shared_key]
+
+        for key, parts in self.derived.items():
+
+            part_values = [results.get(part_key) for part_key in parts]
+
+            if all(value is not None and float(value) > floor for value in part_values):
+                values[key] = sum(float(value) for value in part_values)
+
+        return values
+
+    def refetch(self, results, floor=1000):
+
+        '''
+        Returns the requests (keyed by spec_key) of the derived cells that resolve leaves out because
+        one of their parts is at or below floor, so that they can be fetched directly.
+        '''
+
+        requests = {}
+
+        for key, parts in self.derived.items():
+            if all(part_key in results for part_key in parts) and \
+               any(float(results[part_key]) <= floor for part_key in parts):
+                requests[spec_key(self.cells[key])] = self.cells[key]
+
+        return requests
+
+    def possible_refetch(self):
+
+        '''
+        Returns the requests (keyed by spec_key) that refetch can add after the sweep, i.e. the ones
+        of all the derived cells, since which of them have a part at the floor is only known from the
+        results.
+        '''
+
+        return {spec_key(self.cells[key]): self.cells[key] for key in self.derived}
+
+def get_tables(access_token, user_id, destinations, origins, tables=tuple(TABLES), age_min=None, age_max=None,
+               age_groups=None, engine=None, max_workers=4, backend=None, derive=True):
+
+    '''
+    Builds several tables with a single deduplicated sweep. The arguments are those of gen_mig_table
+    and of the age structure functions, plus:
+
+        - tables: the tables to be built, among 'mig_table', 'age_structure_mig' and
+                  'age_structure_countries';
+        - age_min and age_max: if None, the default of each function is used;
+        - age_groups: an optional dictionary of age groups (with the structure of the output of
+                      get_age_groups) for the age structure tables, e.g. coarser ones; groups of the
+                      whole population made of whole five-year groups are summed instead of
+                      fetched when the five-year groups are requested too or are in the cache;
+        - derive: if False no cell is derived from the others (duplicated specs are still fetched
+                  once). Only the cells of whole populations are derived, and a derived cell
+                  with a part at the 1000 floor is fetched directly after the sweep (see
+                  QueryGraph).
+
+    The output is a dictionary with the tables, in the format of the corresponding functions
+    (mig_table is the table of gen_mig_table, the other two the dictionaries of the age structure
+    functions), and the set of the derived cells under 'derived'.
+    '''
+
+    engine = get_engine(user_id, engine, max_workers=max_workers, backend=backend, access_token=access_token)
+
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+
+    if destinations == 'all':
+        destinations = list(dest_dict.keys())
+
+    if origins == 'all':
+        origins = list(origin_dict.keys())
+
+    check_countries(destinations,dest_dict)
+    check_countries(origins,origin_dict)
+
+    cells = get_table_specs(tables, destinations, origins, dest_dict, origin_dict, age_min, age_max, age_groups)
+
+    graph = QueryGraph(cells, get_age_grids(tables, age_min, age_max, age_groups), engine.cache, derive)
+
+    results, errors = engine.run(graph.requests, desc='tables')
+
+    refetch = graph.refetch(results)
+
+    if refetch:
+        direct_results, direct_errors = engine.run(refetch, desc='tables')
+        errors.update(direct_errors)
+    else:
+        direct_results = {}
+
+    for error in set(map(str, errors.values())):
+        print(error)
+
+    values = graph.resolve(results)
+    values.update((key, direct_results[spec_key(graph.cells[key])]) for key in graph.derived
+                  if key not in values and spec_key(graph.cells[key]) in direct_results)
+    output = {'derived': {key for key in graph.derived if spec_key(graph.cells[key]) not in refetch}}
+
+    for table in tables:
+
+        table_groups = get_table_age_groups(table, age_min, age_max, age_groups)
+        table_values = {key: value for (cell_table, key), value in values.items() if cell_table == table}
+
+        if table == 'mig_table':
+            buffer = ResultBuffer({'destination': destinations, 'origin': origins + ['Total Population']})
+            buffer.fill(table_values)
+            output[table] = buffer.to_frame()
+        elif table == 'age_structure_mig':
+            output[table] = build_age_str_dict(table_values, destinations, origins, table_groups)
+        else:
+            output[table] = build_age_str_dict(table_values, destinations, None, table_groups)
+
+    return output
+
+def parse_age_group(name):
+
+    '''
+    Returns the age group tuple of a row name of an age structure table ('20-24' or '65+').
+    '''
+
+    bounds = [int(bound) for bound in re.findall(r'\d+', name)]
+
+    return tuple(bounds)
+
+def aggregate_age_groups(age_str_dict, age_groups):
+
+    '''
+    Sums the rows of already fetched age structure tables into coarser age groups, without any api
+    call. age_str_dict is the output of one of the age structure functions and age_groups a
+    dictionary with the structure of the output of get_age_groups whose groups are made of whole
+    groups of the tables. Returns a dictionary with the same structure as age_str_dict.
+
+    Every row at Facebook's 1000 floor adds 1000 users to its group, so the groups of the migrant
+    tables, whose rows are mostly at the floor, are much larger than the true values.
+    '''
+
+    import pandas as pd
+
+    def aggregate(table):
+
+        fine_groups = {parse_age_group(name): name for name in table.index}
+        rows = []
+
+        for age_group in age_groups:
+
+            group_spec = {'age_min': age_group[0]}
+            if len(age_group) > 1:
+                group_spec['age_max'] = age_group[1]
+
+            parts = split_spec(dict(group_spec, genders=[1]), fine_groups)
+
+            if parts is None:
+                if age_group not in fine_groups:
+                    raise ValueError('The age group {} is not made of whole age groups of the table'
+                                     .format(age_groups[age_group]['name']))
+                names = [fine_groups[age_group]]
+            else:
+                names = [fine_groups[(part['age_min'], part['age_max']) if 'age_max' in part else (part['age_min'],)]
+                         for part in parts]
+
+            rows.append(table.loc[names].sum())
+
+        return pd.DataFrame(rows, index=[age_groups[age_group]['name'] for age_group in age_groups])
+
+    aggregated = {}
+
+    for destination, features in age_str_dict.items():
+
+        if 'age_structure_table' in features:
+            aggregated[destination] = {'age_structure_table': aggregate(features['age_structure_table'])}
+            continue
+
+        aggregated[destination] = {origin: {'age_structure_table': aggregate(value['age_structure_table'])}
+                                   for origin, value in features.items()}
+
+    return aggregated
@@ -0,0 +1,277 @@
+import json
+import threading
+import time
+
+# the hourly number of calls the default TokenBucket is sized for. Facebook does not publish a fixed
+# quota for the reach estimates (it depends on the access tier of the app and on the ad account), so
+# this is a conservative guess: the ThrottleController lowers the rate as soon as the usage headers
+# show that the actual quota is getting close, and every rate limit error halves it
+DEFAULT_CALLS_PER_HOUR = 18000
+
+class TokenBucket:
+
+    '''
+    A thread-safe token bucket shared by all the workers of a sweep. Every call to the Facebook
+    Marketing Api must first take a token with acquire(); tokens are refilled at a rate of rate
+    tokens per second up to burst tokens. The rate is adaptive: it is halved every time the api
+    reports that we hit the call limit (backoff) and slowly increased back towards max_rate after
+    every successful call (reward), so that the total throughput stays just under the quota.
+
+    Arguments:
+
+        - rate: the initial number of calls per second allowed across all the workers, by default
+                90% of DEFAULT_CALLS_PER_HOUR;
+        - burst: the maximum number of calls that can be made back to back;
+        - max_rate: the rate the bucket never exceeds, by default the initial rate;
+        - min_rate: the rate the bucket never goes below when backing off;
+        - increase: the number of calls per second added to the rate after every successful call.
+    '''
+
+    def __init__(self, rate=None, burst=1, max_rate=None, min_rate=0.001, increase=None):
+
+        if rate is None:
+            rate = DEFAULT_CALLS_PER_HOUR * 0.9 / 3600
+
+        self.max_rate = rate if max_rate is None else max_rate
+        self.min_rate = min_rate
+        self.rate = min(rate, self.max_rate)
+        self.burst = burst
+        self.increase = self.max_rate / 100 if increase is None else increase
+
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_quota(cls, calls_per_hour, headroom=0.9, burst=1):
+
+        '''
+        Builds a bucket whose maximum throughput is a fraction (headroom) of an hourly quota.
+        '''
+
+        rate = calls_per_hour * headroom / 3600
+
+        return cls(rate=rate, burst=burst, max_rate=rate)
+
+    def _refill(self, now):
+
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, stop_event=None):
+
+        '''
+        Blocks until a token is available and takes it. If stop_event is set while waiting
+        the function returns False without taking a token.
+        '''
+
+        while True:
+
+            with self._lock:
+
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                else:
+                    wait = (1 - self._tokens) / self.rate
+
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                return False
+
+    def set_rate(self, rate):
+
+        '''
+        Sets the current rate, clipped between min_rate and max_rate.
+        '''
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, min(self.max_rate, rate))
+
+    def backoff(self, factor=0.5):
+
+        '''
+        Multiplies the current rate by factor and empties the bucket.
+        '''
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate * factor)
+            self._tokens = 0.0
+
+    def reward(self, ceiling=None):
+
+        '''
+        Increases the current rate by the additive step after a successful call, without going
+        above ceiling (by default max_rate).
+        '''
+
+        ceiling = self.max_rate if ceiling is None else min(self.max_rate, ceiling)
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate, min(ceiling, self.rate + self.increase))
+
+    def paused_for(self):
+
+        '''
+        Returns the number of seconds before the bucket hands out tokens again after a pause.
+        '''
+
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    def pause(self, seconds):
+
+        '''
+        Prevents any token from being handed out for the next seconds.
+        '''
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+def parse_usage_headers(headers):
+
+    '''
+    Reads the usage headers returned by the Facebook Marketing Api with every response
+    (x-app-usage, x-business-use-case-usage and x-ad-account-usage) and returns a tuple whose
+    first element is the highest percentage of any quota already used and whose second element
+    is the number of seconds Facebook says we have to wait before we can call it again. Headers
+    that are missing or cannot be read are ignored, so that the result is (None, 0) when the
+    response does not contain any usage information.
+    '''
+
+    if isinstance(headers, list):
+        # the items of a batch request carry their headers as a list of name-value pairs
+        headers = {header['name']: header['value'] for header in headers}
+
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+
+    usages = []
+    regain_seconds = 0
+
+    def load(name):
+        try:
+            return json.loads(headers[name]) if isinstance(headers[name], str) else headers[name]
+        except (KeyError, ValueError):
+            return None
+
+    app_usage = load('x-app-usage')
+    if isinstance(app_usage, dict):
+        usages += [app_usage.get(key, 0) for key in ('call_count', 'total_cputime', 'total_time')]
+
+    business_usage = load('x-business-use-case-usage')
+    if isinstance(business_usage, dict):
+        for use_cases in business_usage.values():
+            for use_case in use_cases:
+                usages += [use_case.get(key, 0) for key in ('call_count', 'total_cputime', 'total_time')]
+                regain_seconds = max(regain_seconds, 60 * use_case.get('estimated_time_to_regain_access', 0))
+
+    account_usage = load('x-ad-account-usage')
+    if isinstance(account_usage, dict):
+        usages.append(account_usage.get('acc_id_util_pct', 0))
+        regain_seconds = max(regain_seconds, account_usage.get('reset_time_duration', 0))
+
+    usage = max(usages) if usages else None
+
+    return usage, regain_seconds
+
+class ThrottleController:
+
+    '''
+    Adapts the rate of a TokenBucket to the usage headers returned by the Facebook Marketing Api.
+    The usage sets a ceiling on the rate: while the highest usage reported is below low_usage the
+    ceiling is the maximum rate of the bucket, above that it decreases linearly and reaches min_share
+    of the maximum rate when the usage gets to high_usage. A rate above the ceiling is lowered at once,
+    a rate below it is only raised by the additive step of the bucket (reward), so that a back-off
+    after a rate limit error is not undone by the next response with a low usage. When Facebook blocks
+    the calls and advertises an estimated time to regain access the bucket is paused for exactly that
+    time, instead of a fixed back-off.
+
+    Arguments:
+
+        - limiter: the TokenBucket whose rate is controlled;
+        - low_usage and high_usage: the percentages of the quota between which the rate is reduced;
+        - min_share: the fraction of the maximum rate kept when the usage is above high_usage.
+    '''
+
+    def __init__(self, limiter, low_usage=50, high_usage=95, min_share=0.05):
+
+        self.limiter = limiter
+        self.low_usage = low_usage
+        self.high_usage = high_usage
+        self.min_share = min_share
+
+        self.usage = None
+
+    def ceiling(self, usage):
+
+        '''
+        Returns the highest rate allowed when the highest usage reported is usage.
+        '''
+
+        if usage is None or usage <= self.low_usage:
+            share = 1.0
+        elif usage >= self.high_usage:
+            share = self.min_share
+        else:
+            share = (self.high_usage - usage) / (self.high_usage - self.low_usage)
+            share = max(self.min_share, share)
+
+        return self.limiter.max_rate * share
+
+    def update(self, headers):
+
+        '''
+        Reads the usage headers of a successful response and updates the rate of the bucket
+        accordingly. Returns the number of seconds the bucket was paused for, 0 if Facebook did not
+        ask to wait.
+        '''
+
+        usage, regain_seconds = parse_usage_headers(headers)
+
+        if usage is not None:
+            self.usage = usage
+
+        if regain_seconds > 0:
+            # the usage is reset once access is regained, so only the pause matters here
+            self.limiter.pause(regain_seconds)
+            return regain_seconds
+
+        ceiling = self.ceiling(usage)
+
+        if self.limiter.rate > ceiling:
+            self.limiter.set_rate(ceiling)
+        else:
+            self.limiter.reward(ceiling)
+
+        return 0
+
+    def penalize(self, headers):
+
+        '''
+        Reads the usage headers of a response that hit the rate limit: the bucket is paused for the
+        time Facebook advertises or, if it does not advertise any, its rate is halved. Returns the
+        number of seconds the bucket was paused for.
+        '''
+
+        usage, regain_seconds = parse_usage_headers(headers)
+
+        if usage is not None:
+            self.usage = usage
+
+        if regain_seconds > 0:
+            self.limiter.pause(regain_seconds)
+        else:
+            self.limiter.backoff()
+
+        return regain_seconds
@@ -0,0 +1,111 @@
+import datetime
+import zlib
+
+
+class RefreshPolicy:
+
+    '''
+    Decides which cells of a migration table an incremental sweep re-queries, given the previous
+    snapshot. A cell is refreshed every run when it is large (at least large users), when it is a
+    'Total Population' cell, when it has no previous value, or when it changed by more than change
+    (relative) between any two consecutive snapshots of the history. Every other cell, i.e. the ones
+    at Facebook's 1000 floor and the small stable ones, is refreshed once every rotation runs: a cell
+    is refreshed when it would otherwise be carried forward for rotation runs in a row, and the
+    first incremental run staggers the cells into rotation groups by a hash of their destination and
+    origin, so that about one group in rotation is refreshed in every run and the whole table is
+    renewed over rotation runs. The cells that are not refreshed are carried forward from the
+    previous snapshot.
+
+    Arguments:
+
+        - large: the number of users from which a cell is refreshed every run;
+        - change: the relative change between two snapshots above which a cell is refreshed every run;
+        - rotation: the number of runs over which the floor and stable cells are all refreshed once.
+    '''
+
+    def __init__(self, large=10000, change=0.1, rotation=6):
+
+        self.large = large
+        self.change = change
+        self.rotation = rotation
+
+    def _rotation_group(self, destination, origin):
+
+        # crc32 is stable across processes, unlike hash()
+        return zlib.crc32('{}|{}'.format(destination, origin).encode('utf-8')) % self.rotation
+
+    def select(self, previous, staleness=None, history=(), period=None):
+
+        '''
+        Returns a boolean DataFrame shaped like previous telling which cells to refresh.
+
+            - previous: the previous snapshot, a table returned by gen_mig_table;
+            - staleness: an optional table with the number of runs every cell of previous has been
+                         carried forward for (0 for the cells fetched in that run);
+            - history: an optional list of older snapshots, oldest first, used to find the cells
+                       that change a lot;
+            - period: the index of the current run, used to pick the rotation group refreshed when
+                      staleness is not known, by default the number of the current month
+                      (year * 12 + month).
+        '''
+
+        import numpy as np
+        import pandas as pd
+
+        values = previous.to_numpy(dtype=float, na_value=np.nan)
+
+        refresh = np.isnan(values) | (values >= self.large)
+
+        if 'Total Population' in previous.columns:
+            refresh[:, previous.columns.get_loc('Total Population')] = True
+
+        snapshots = [table.reindex(index=previous.index, columns=previous.columns).to_numpy(dtype=float, na_value=np.nan)
+                     for table in history] + [values]
+
+        for older, newer in zip(snapshots[:-1], snapshots[1:]):
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                changed = np.abs(newer - older) > self.change * older
+
+            refresh |= changed
+
+        refresh |= self._staleness(previous, staleness, period) >= self.rotation - 1
+
+        return pd.DataFrame(refresh, index=previous.index, columns=previous.columns)
+
+    def _staleness(self, previous, staleness=None, period=None):
+
+        import numpy as np
+
+        if staleness is not None:
+            return staleness.reindex(index=previous.index, columns=previous.columns).fillna(0).to_numpy(dtype=float)
+
+        if period is None:
+            today = datetime.date.today()
+            period = today.year * 12 + today.month
+
+        # without the staleness of the previous run the cells are staggered by their rotation group,
+        # so that exactly one group is due in every period
+        groups = np.array([[self._rotation_group(destination, origin) for origin in previous.columns]
+                           for destination in previous.index], dtype=float).reshape(previous.shape)
+
+        return (period - 1 - groups) % self.rotation
+
+    def carry_forward(self, previous, staleness=None, history=(), period=None):
+
+        '''
+        Returns the table to be completed by an incremental sweep, i.e. previous with the cells to be
+        refreshed emptied (NaN), and the staleness of its cells: 0 for the cells to be fetched and the
+        previous staleness plus one for the ones carried forward. The arguments are the ones of
+        select.
+        '''
+
+        import pandas as pd
+
+        refresh = self.select(previous, staleness, history, period)
+
+        table = previous.where(~refresh)
+        staleness = pd.DataFrame(self._staleness(previous, staleness, period) + 1,
+                                 index=previous.index, columns=previous.columns)
+
+        return table, staleness.where(~refresh, 0).astype(int)
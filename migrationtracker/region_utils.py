@@ -0,0 +1,138 @@
+from .backend_utils import reach_bounds
+from .catalog_utils import get_catalog
+from .engine_utils import get_engine
+from .migration_utils import check_countries, get_mig_sweep
+from .sweep_utils import Sweep, origin_axis, subdivision_axis
+from .table_utils import ResultBuffer
+
+def gen_region_table(access_token, user_id, destinations, origins='all', location_type='region', age_min=18,
+                     age_max=65, floor=1000, reconcile=False, engine=None, max_workers=4, backend=None):
+
+    '''
+    Returns the stock of migrants from origins living in every region (or, with location_type='city',
+    every city) of the destinations. The sweep is hierarchical: the migration table of the countries
+    is fetched first, and the sub-national cells of a destination-origin pair are fetched only if
+    the reach of the pair is above floor, since the parts of a pair at Facebook's 1000 floor would
+    all be at the floor too. The Total Population of every region is always fetched.
+
+    Arguments:
+
+        - destinations and origins: lists of country names, as in gen_mig_table (origins can be 'all');
+        - location_type: 'region' or 'city'. Facebook only lists the cities matching a search, so
+                         the cities to be swept are first added to the catalog, e.g. with
+                         get_catalog(access_token).search_subdivisions('Italy', 'Milan');
+        - floor: the reach at or below which a pair is not split;
+        - reconcile: if True the parts are made consistent with their country, see reconcile_regions;
+        - engine, max_workers and backend: as in gen_mig_table.
+
+    The output is a tuple with the table of the sub-national units, whose index is a (destination,
+    location_type) MultiIndex and whose columns are the origins and 'Total Population', with NaN in
+    the cells of the pairs that were not split, and the migration table of the destinations.
+    '''
+
+    import pandas as pd
+
+    engine = get_engine(user_id, engine, max_workers=max_workers, backend=backend, access_token=access_token)
+
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+
+    if origins == 'all':
+        origins = list(origin_dict.keys())
+
+    check_countries(destinations,dest_dict)
+    check_countries(origins,origin_dict)
+
+    sweep = get_mig_sweep(destinations, origins, dest_dict, origin_dict, age_min, age_max)
+    buffer, errors = sweep.run(engine, desc='mig_table')
+    mig_table = buffer.to_frame()
+
+    # the pairs whose country reach is unknown are not split either
+    split = (mig_table[origins] > floor).to_numpy()
+
+    rows = []
+    requests = {}
+    skipped = 0
+
+    for i, destination in enumerate(destinations):
+
+        subdivisions = catalog.subdivisions(destination, location_type)
+        split_origins = [origin for origin, is_split in zip(origins, split[i]) if is_split]
+
+        sweep = Sweep([subdivision_axis(subdivisions, location_type),
+                       origin_axis(split_origins, origin_dict, total=True)],
+                      base={'age_min': age_min, 'age_max': age_max})
+
+        rows += [(destination, subdivision) for subdivision in subdivisions]
+        requests.update((((destination, key[0]), key[1]), spec) for key, spec in sweep.specs())
+        skipped += (len(origins) - len(split_origins)) * len(subdivisions)
+
+    print('{} of {} destination-origin pairs are not split, {} {} calls are skipped'.format(int((~split).sum()),
+                                                                                           split.size,
+                                                                                           skipped,
+                                                                                           location_type))
+
+    results, region_errors = engine.run(requests, desc='{}_table'.format(location_type))
+    errors.update(region_errors)
+
+    for error in set(map(str, errors.values())):
+        print(error)
+
+    region_buffer = ResultBuffer({'row': rows, 'origin': origins + ['Total Population']})
+    region_buffer.fill(results)
+
+    region_table = pd.DataFrame(region_buffer.values,
+                                index=pd.MultiIndex.from_tuples(rows, names=['destination', location_type]),
+                                columns=origins + ['Total Population'])
+
+    if reconcile:
+        region_table = reconcile_regions(region_table, mig_table)
+
+    return region_table, mig_table
+
+def reconcile_regions(region_table, mig_table):
+
+    '''
+    Makes the sub-national estimates of a destination-origin pair consistent with the estimate of the
+    whole destination. Every estimate is rounded by Facebook, and the parts at the 1000 floor can be
+    much larger than the true values, so the sum of the parts often exceeds the total. When it is
+    larger than the highest value the total could have been rounded from, the parts are moved
+    towards the lowest values they could have been rounded from (see reach_bounds), all by the same
+    fraction of their rounding interval, until they add up to the total; the floor cells, whose
+    interval is the widest, absorb most of the correction. Parts adding up to less than the total
+    are kept, since some users cannot be placed in a region.
+
+    The output is a copy of region_table, with a DataFrame in attrs['residual'] holding, for every
+    destination and origin, the total minus the sum of the reconciled parts (the users that are not
+    placed in any unit, or a negative excess when the parts could not be reduced enough).
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    destinations = region_table.index.get_level_values(0)
+
+    parts = region_table.to_numpy(dtype=float)
+    lower = reach_bounds(parts)[0]
+
+    total = mig_table.reindex(index=destinations, columns=region_table.columns).to_numpy(dtype=float)
+    total_upper = reach_bounds(total)[1]
+
+    # the sums are aligned with the rows, so that every part gets the values of its destination
+    parts_sum = pd.DataFrame(parts).groupby(np.asarray(destinations)).transform('sum').to_numpy()
+    lower_sum = pd.DataFrame(lower).groupby(np.asarray(destinations)).transform('sum').to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.clip((total - lower_sum) / (parts_sum - lower_sum), 0, 1)
+
+    fraction = np.where(parts_sum > total_upper, fraction, 1)
+    reconciled = np.where(np.isnan(parts), np.nan, lower + (parts - lower) * fraction)
+
+    output = pd.DataFrame(reconciled, index=region_table.index, columns=region_table.columns)
+
+    split = output.notna().groupby(level=0, sort=False).any()
+    total = mig_table.reindex(index=split.index, columns=region_table.columns)
+    output.attrs['residual'] = (total - output.groupby(level=0, sort=False).sum()).where(split)
+
+    return output
@@ -0,0 +1,333 @@
+import datetime
+import os
+
+from .backend_utils import reach_bounds
+
+# The columns of the snapshots, in the order they are stored
+COLUMNS = ['snapshot', 'table', 'destination', 'origin', 'age_group', 'gender', 'reach', 'lower_bound']
+
+# The columns that identify a cell within the table of a snapshot
+CELL_COLUMNS = ['destination', 'origin', 'age_group', 'gender']
+
+def age_label(age_min, age_max):
+
+    '''
+    Returns the name of an age range in the format of get_age_groups ('18-64', or '18+' when age_max
+    is 65, since Facebook treats 65 as 65 and older).
+    '''
+
+    if age_max >= 65:
+        return '{}+'.format(age_min)
+
+    return '{}-{}'.format(age_min, age_max)
+
+def to_snapshot_date(snapshot):
+
+    '''
+    Returns the date of a snapshot given as a date, a datetime or a string ('2019-07-01' or the
+    '07_2019' of the old csv file names).
+    '''
+
+    if isinstance(snapshot, datetime.datetime):
+        return snapshot.date()
+
+    if isinstance(snapshot, datetime.date):
+        return snapshot
+
+    if '_' in snapshot:
+        month, year = snapshot.split('_')
+        return datetime.date(int(year), int(month), 1)
+
+    return datetime.date.fromisoformat(snapshot)
+
+def mig_table_to_long(mig_table, age_min=18, age_max=65):
+
+    '''
+    Turns a table returned by gen_mig_table (destinations on the rows, origins and 'Total Population'
+    on the columns) into a long DataFrame with one row per cell and the columns of the store, except
+    the snapshot. Missing cells are dropped.
+    '''
+
+    long = mig_table.rename_axis(index='destination', columns='origin').stack().rename('reach').reset_index()
+
+    long['age_group'] = age_label(age_min, age_max)
+    long['gender'] = 'all'
+
+    return long
+
+def age_str_dict_to_long(age_str_dict):
+
+    '''
+    Turns the output of one of the age structure functions into a long DataFrame with one row per
+    cell and the columns of the store, except the snapshot. The tables of whole countries (the
+    output of get_age_structure_table_countries) get 'Total Population' as origin.
+    '''
+
+    pairs = []
+    tables = []
+
+    for destination, features in age_str_dict.items():
+
+        if 'age_structure_table' in features:
+            features = {'Total Population': features}
+
+        for origin, value in features.items():
+            pairs.append((destination, origin))
+            tables.append(value['age_structure_table'])
+
+    return tables_to_long(pairs, tables)
+
+def tables_to_long(pairs, tables):
+
+    '''
+    Turns a list of age-sex structure tables and the list of their (destination, origin) pairs into a
+    long DataFrame with the columns destination, origin, age_group, gender and reach. Consecutive
+    tables with the same age groups and genders (usually all of them) are converted with a single
+    array operation instead of one stack per table. Missing cells are dropped.
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    frames = []
+    start = 0
+
+    while start < len(tables):
+
+        index = tables[start].index
+        columns = tables[start].columns
+
+        end = start + 1
+        while end < len(tables) and tables[end].index.equals(index) and tables[end].columns.equals(columns):
+            end += 1
+
+        values = np.stack([table.to_numpy(dtype=float) for table in tables[start:end]])
+        cells = len(index) * len(columns)
+
+        long = pd.DataFrame({'destination': np.repeat([pair[0] for pair in pairs[start:end]], cells),
+                             'origin': np.repeat([pair[1] for pair in pairs[start:end]], cells),
+                             'age_group': np.tile(np.repeat(index.astype(str), len(columns)), end - start),
+                             'gender': np.tile(columns.astype(str), len(index) * (end - start)),
+                             'reach': values.ravel()})
+
+        frames.append(long[~np.isnan(long['reach'].values)])
+        start = end
+
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS[2:7])
+
+    return pd.concat(frames, ignore_index=True)
+
+class SnapshotStore:
+
+    '''
+    A columnar store of the monthly sweeps, kept as a Parquet dataset partitioned by snapshot date
+    and by table (one directory snapshot=YYYY-MM-DD/table=name per sweep, where name is mig_table,
+    age_structure_mig or age_structure_countries), so that writing a table never touches the other
+    tables of the same snapshot. Every row is a cell with the columns snapshot, table, destination,
+    origin, age_group, gender ('male', 'female' or 'all'), reach and lower_bound (the smallest true
+    number of users that Facebook could have rounded to reach). The rows of every
+    snapshot are sorted by destination and origin, so that the statistics of the Parquet row groups
+    allow to skip most of a file when a single pair is read. pyarrow is only imported when the store
+    is used.
+
+    Arguments:
+
+        - path: the directory of the dataset, created if it does not exist;
+        - row_group_size: the number of rows of every Parquet row group.
+    '''
+
+    def __init__(self, path='mig_store', row_group_size=50000):
+
+        self.path = path
+        self.row_group_size = row_group_size
+
+    def _schema(self):
+
+        import pyarrow as pa
+
+        return pa.schema([('snapshot', pa.date32()),
+                          ('table', pa.string()),
+                          ('destination', pa.string()),
+                          ('origin', pa.string()),
+                          ('age_group', pa.string()),
+                          ('gender', pa.string()),
+                          ('reach', pa.float64()),
+                          ('lower_bound', pa.float64())])
+
+    def _partitioning(self):
+
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        return ds.partitioning(pa.schema([('snapshot', pa.date32()), ('table', pa.string())]), flavor='hive')
+
+    def append(self, long, snapshot, overwrite=True, table='mig_table'):
+
+        '''
+        Writes the cells of a long DataFrame (e.g. the output of mig_table_to_long) as the given
+        table of the snapshot of the given date. The other tables of the snapshot are never touched.
+        If overwrite is True the cells already stored for that table are replaced, otherwise they
+        are kept and merged with the new ones, a new cell replacing a stored one with the same
+        destination, origin, age group and gender.
+        '''
+
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        if len(long) == 0:
+            return
+
+        if not overwrite:
+
+            stored = self.read(tables=table, start=snapshot, end=snapshot, columns=CELL_COLUMNS + ['reach'])
+
+            if len(stored):
+                long = pd.concat([stored, long[CELL_COLUMNS + ['reach']]], ignore_index=True)
+                long = long.drop_duplicates(CELL_COLUMNS, keep='last')
+
+        long = long.copy()
+        long['snapshot'] = to_snapshot_date(snapshot)
+        long['table'] = table
+        long['reach'] = long['reach'].astype(float)
+        long['gender'] = long['gender'].astype(str)
+        long['lower_bound'] = reach_bounds(long['reach'].values)[0]
+        long = long.sort_values(['destination', 'origin', 'age_group', 'gender'])[COLUMNS]
+
+        arrow_table = pa.Table.from_pandas(long, schema=self._schema(), preserve_index=False)
+
+        # only the files of this table of the snapshot match, and they are replaced
+        ds.write_dataset(arrow_table,
+                         self.path,
+                         format='parquet',
+                         partitioning=self._partitioning(),
+                         basename_template='part-{}-{{i}}.parquet'.format(os.urandom(4).hex()),
+                         existing_data_behavior='delete_matching',
+                         max_rows_per_group=self.row_group_size,
+                         min_rows_per_group=min(self.row_group_size, len(long)))
+
+    def append_mig_table(self, mig_table, snapshot, age_min=18, age_max=65, overwrite=True):
+
+        '''
+        Stores a table returned by gen_mig_table as the mig_table of the snapshot of the given date.
+        '''
+
+        self.append(mig_table_to_long(mig_table, age_min, age_max), snapshot, overwrite, 'mig_table')
+
+    def append_age_str_dict(self, age_str_dict, snapshot, overwrite=False):
+
+        '''
+        Stores the output of one of the age structure functions as the age_structure_mig (or, for the
+        output of get_age_structure_table_countries, the age_structure_countries) table of the
+        snapshot of the given date. By default the cells are merged with the ones already stored for
+        that table, e.g. when a sweep is stored in several parts.
+        '''
+
+        whole_countries = any('age_structure_table' in features for features in age_str_dict.values())
+        table = 'age_structure_countries' if whole_countries else 'age_structure_mig'
+
+        self.append(age_str_dict_to_long(age_str_dict), snapshot, overwrite, table)
+
+    def import_csv(self, path, snapshot=None, age_min=18, age_max=65):
+
+        '''
+        Imports a migration table saved as csv (e.g. mig_data/mig_table_07_2019.csv). If snapshot
+        is None the date is read from the file name.
+        '''
+
+        import pandas as pd
+
+        if snapshot is None:
+            snapshot = '_'.join(os.path.splitext(os.path.basename(path))[0].split('_')[-2:])
+
+        self.append_mig_table(pd.read_csv(path, index_col=0), snapshot, age_min, age_max)
+
+    def dataset(self):
+
+        '''
+        Returns the pyarrow dataset of the store, whose files are read through memory maps.
+        '''
+
+        import pyarrow.dataset as ds
+        import pyarrow.fs as fs
+
+        return ds.dataset(self.path,
+                          schema=self._schema(),
+                          format='parquet',
+                          partitioning=self._partitioning(),
+                          filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    def snapshots(self):
+
+        '''
+        Returns the sorted list of the dates of the stored snapshots.
+        '''
+
+        if not os.path.exists(self.path):
+            return []
+
+        return sorted(to_snapshot_date(name.split('=', 1)[1]) for name in os.listdir(self.path)
+                      if name.startswith('snapshot='))
+
+    def read(self, destinations=None, origins=None, age_groups=None, genders=None, start=None, end=None,
+             columns=None, tables=None):
+
+        '''
+        Returns a DataFrame with the stored cells matching all the given filters. Every filter is
+        optional and, except start and end, can be a single value or a list:
+
+            - destinations, origins, age_groups and genders: the values of the corresponding columns;
+            - tables: the tables to be read (mig_table, age_structure_mig or age_structure_countries);
+            - start and end: the first and last snapshot dates to be read (inclusive);
+            - columns: the columns to be read, all of them by default.
+
+        The filters are pushed down to the dataset: the snapshots outside [start, end] are never
+        opened and the row groups that cannot contain the requested pairs are skipped.
+        '''
+
+        import pandas as pd
+        import pyarrow.dataset as ds
+
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=COLUMNS if columns is None else columns)
+
+        expression = None
+
+        def combine(condition):
+            return condition if expression is None else expression & condition
+
+        for column, values in (('destination', destinations), ('origin', origins),
+                               ('age_group', age_groups), ('gender', genders), ('table', tables)):
+
+            if values is None:
+                continue
+
+            values = [values] if isinstance(values, str) else list(values)
+            expression = combine(ds.field(column).isin(values))
+
+        if start is not None:
+            expression = combine(ds.field('snapshot') >= to_snapshot_date(start))
+
+        if end is not None:
+            expression = combine(ds.field('snapshot') <= to_snapshot_date(end))
+
+        table = self.dataset().to_table(columns=columns, filter=expression)
+
+        return table.to_pandas(date_as_object=False)
+
+    def series(self, destination, origin, age_group=None, gender='all', start=None, end=None):
+
+        '''
+        Returns the reach of an origin in a destination over time, as a Series indexed by snapshot
+        date (e.g. store.series('Italy', 'Morocco')). If age_group is None the single age group stored
+        with the given gender is used (the one of the migration tables for gender 'all').
+        '''
+
+        frame = self.read(destination, origin, age_group, gender, start, end, columns=['snapshot', 'age_group', 'reach'])
+
+        if frame['age_group'].nunique() > 1:
+            raise ValueError('Several age groups are stored for {} in {}, pass one through age_group'
+                             .format(origin, destination))
+
+        return frame.set_index('snapshot')['reach'].sort_index()
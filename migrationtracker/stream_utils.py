@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+
+from .age_str_utils import get_age_str_specs
+from .catalog_utils import get_catalog
+from .engine_utils import get_engine
+from .migration_utils import get_mig_specs, check_countries
+
+# A single answered cell of a sweep, with the time (as returned by time.time()) it was answered
+ReachRecord = collections.namedtuple('ReachRecord', ['destination', 'origin', 'spec', 'reach', 'timestamp'])
+
+# Put in the queue of a stream when the sweep has ended
+_END = object()
+
+class _StreamClosed(Exception):
+
+    '''
+    Raised in the sweep thread when the consumer of the stream has gone away.
+    '''
+
+def stream_requests(engine, requests, desc='requests', max_pending=1000):
+
+    '''
+    Runs the requests with engine (a ReachEngine or an EnginePool) in a background thread and yields
+    a (key, targeting_spec, users, timestamp) tuple as soon as each request is answered (or found in
+    the cache). At most max_pending answers wait to be consumed, and the engine sends a new request
+    only when an answer is handed to the stream (see max_in_flight in ReachEngine.run): when the
+    consumer is slower than the api the sweep waits for it instead of piling up answers.
+    Closing the generator (or breaking out of the loop that consumes it) stops the sweep, and the
+    requests that failed are the return value of the generator (the value of StopIteration).
+    '''
+
+    records = queue.Queue(max_pending)
+    closed = threading.Event()
+    outcome = {}
+
+    def put(record):
+        while not closed.is_set():
+            try:
+                records.put(record, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise _StreamClosed()
+
+    def callback(key, spec, users):
+        put((key, spec, users, time.time()))
+
+    def sweep():
+        try:
+            outcome['errors'] = engine.run(requests, desc, callback, max_in_flight=max_pending)[1]
+        except _StreamClosed:
+            pass
+        except Exception as error:
+            outcome['exception'] = error
+        finally:
+            try:
+                put(_END)
+            except _StreamClosed:
+                pass
+
+    thread = threading.Thread(target=sweep, daemon=True)
+    thread.start()
+
+    try:
+
+        while True:
+
+            record = records.get()
+
+            if record is _END:
+                break
+
+            yield record
+
+    finally:
+
+        if thread.is_alive():
+            closed.set()
+            engine.stop()
+            thread.join()
+
+    if 'exception' in outcome:
+        raise outcome['exception']
+
+    return outcome.get('errors', {})
+
+def _map_stream(stream, make_record):
+
+    # like a generator expression, but closing it closes stream and the errors are returned
+    try:
+        while True:
+            try:
+                answer = next(stream)
+            except StopIteration as end:
+                return end.value
+            yield make_record(*answer)
+    finally:
+        stream.close()
+
+def stream_mig_table(access_token, user_id, destinations='all', origins='all', age_min=18, age_max=65, engine=None,
+                     max_workers=4, backend=None, max_pending=1000):
+
+    '''
+    The streaming version of gen_mig_table: instead of returning the table at the end of the sweep
+    it yields a ReachRecord(destination, origin, spec, reach, timestamp) as soon as each cell is
+    answered, with origin 'Total Population' for the whole population of a destination. The
+    arguments are the same of gen_mig_table, see stream_requests for max_pending. For example
+
+        for record in stream_mig_table(access_token, user_id, ['Italy'], 'all'):
+            writer.writerow(record[:2] + record[3:])
+
+    writes the cells to a csv while the sweep is running.
+    '''
+
+    engine = get_engine(user_id, engine, max_workers=max_workers, backend=backend, access_token=access_token)
+
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+
+    if destinations == 'all':
+        destinations = list(dest_dict.keys())
+
+    if origins == 'all':
+        origins = list(origin_dict.keys())
+
+    check_countries(destinations,dest_dict)
+    check_countries(origins,origin_dict)
+
+    specs = get_mig_specs(destinations, origins, dest_dict, origin_dict, age_min, age_max)
+
+    def record(key, spec, users, timestamp):
+        return ReachRecord(key[0], key[1], spec, users, timestamp)
+
+    return (yield from _map_stream(stream_requests(engine, specs, 'mig_table', max_pending), record))
+
+def stream_age_structure(access_token, user_id, destinations, origins=None, age_min=13, age_max=65, engine=None,
+                         max_workers=4, backend=None, max_pending=1000):
+
+    '''
+    The streaming version of the age structure functions: yields a ReachRecord for every gender and
+    age group of every destination-origin pair as soon as it is answered (the gender and the ages
+    are in the spec). If origins is None the whole population of the destinations is swept, with
+    origin 'Total Population', like get_age_structure_table_countries.
+    '''
+
+    engine = get_engine(user_id, engine, max_workers=max_workers, backend=backend, access_token=access_token)
+
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+
+    check_countries(destinations,dest_dict)
+
+    if origins is not None:
+        check_countries(origins,origin_dict)
+
+    specs = get_age_str_specs(destinations, origins, dest_dict, origin_dict, age_min, age_max)
+
+    def record(key, spec, users, timestamp):
+        origin = 'Total Population' if origins is None else key[1]
+        return ReachRecord(key[0], origin, spec, users, timestamp)
+
+    return (yield from _map_stream(stream_requests(engine, specs, 'age_structure', max_pending), record))
+
+async def astream(stream):
+
+    '''
+    Wraps one of the streams of this module into an asynchronous iterator, for asyncio code such as
+    a dashboard server:
+
+        async for record in astream(stream_mig_table(access_token, user_id, ['Italy'], 'all')):
+            await websocket.send(json.dumps(record._asdict()))
+
+    Every record is waited for in the default executor of the event loop, so the loop is never
+    blocked. If the consuming task is cancelled while a record is being waited for, the stream is
+    closed by the executor thread as soon as that record arrives, since a generator cannot be closed
+    while it is running.
+    '''
+
+    loop = asyncio.get_running_loop()
+    lock = threading.Lock()
+    state = {'running': False, 'closing': False}
+
+    def advance():
+        try:
+            return next(stream, _END)
+        finally:
+            with lock:
+                state['running'] = False
+                closing = state['closing']
+            if closing:
+                stream.close()
+
+    try:
+        while True:
+            with lock:
+                state['running'] = True
+            record = await loop.run_in_executor(None, advance)
+            if record is _END:
+                return
+            yield record
+    finally:
+        with lock:
+            state['closing'] = True
+            running = state['running']
+        if not running:
+            stream.close()
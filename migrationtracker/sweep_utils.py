@@ -0,0 +1,316 @@
+import itertools
+
+from .catalog_utils import get_catalog
+from .dem_utils import get_age_groups
+from .engine_utils import get_engine
+from .table_utils import ResultBuffer
+
+# The geo_locations field of every type of location
+GEO_FIELDS = {'country': 'countries', 'region': 'regions', 'city': 'cities'}
+
+class Axis:
+
+    '''
+    One dimension of a Sweep: a list of labels, each with the fields it adds to the targeting spec,
+    e.g. Axis('gender', {1: {'genders': [1]}, 2: {'genders': [2]}}, coords=['male', 'female']).
+    A label whose fields are empty does not restrict the audience (e.g. the 'Total Population' of
+    the origins). New segmentations only need a new axis, e.g.
+    Axis('os', {'iOS': {'user_os': ['iOS']}, 'Android': {'user_os': ['Android']}}).
+
+    Arguments:
+
+        - name: the name of the dimension;
+        - targeting: a dictionary whose keys are the labels, in order, and whose values are the
+                     dictionaries of targeting spec fields of every label;
+        - coords: the names shown for the labels in the results, by default the labels themselves.
+    '''
+
+    def __init__(self, name, targeting, coords=None):
+
+        self.name = name
+        self.targeting = dict(targeting)
+        self.labels = list(self.targeting)
+        self.coords = list(self.labels) if coords is None else list(coords)
+
+    def __len__(self):
+
+        return len(self.labels)
+
+    def __repr__(self):
+
+        return 'Axis({!r}, {} labels)'.format(self.name, len(self))
+
+def destination_axis(destinations, dest_dict, name='destination'):
+
+    '''
+    Returns the axis of the destinations, whose values are the ones of the CountryCatalog.
+    '''
+
+    return Axis(name, {destination: {'geo_locations': {'countries': [dest_dict[destination]['code']]}}
+                       for destination in destinations})
+
+def subdivision_axis(subdivisions, location_type='region', name=None):
+
+    '''
+    Returns the axis of some regions (or, with location_type='city', cities), given as a dictionary
+    like the ones of CountryCatalog.subdivisions. The axis is named after location_type by default.
+    '''
+
+    field = GEO_FIELDS[location_type]
+
+    return Axis(location_type if name is None else name,
+                {subdivision: {'geo_locations': {field: [{'key': value['key']}]}}
+                 for subdivision, value in subdivisions.items()})
+
+def origin_axis(origins, origin_dict, total=False, name='origin'):
+
+    '''
+    Returns the axis of the origins (ex-pats behaviors of the CountryCatalog). If total is True a
+    last 'Total Population' label targets everybody.
+    '''
+
+    targeting = {origin: {'behaviors': [{'id': origin_dict[origin]['id'], 'name': origin_dict[origin]['name']}]}
+                 for origin in origins}
+
+    if total:
+        targeting['Total Population'] = {}
+
+    return Axis(name, targeting)
+
+def gender_axis(genders=None, name='gender'):
+
+    '''
+    Returns the axis of the genders, by default the GENDERS of the age structure tables, labelled
+    by their Facebook code and named 'male' and 'female'.
+    '''
+
+    if genders is None:
+        # imported here since age_str_utils builds on this module
+        from .age_str_utils import GENDERS as genders
+
+    return Axis(name, {gender: {'genders': [gender]} for gender in genders},
+                [genders[gender]['name'] for gender in genders])
+
+def age_axis(age_min=13, age_max=65, age_groups=None, name='age_group'):
+
+    '''
+    Returns the axis of the age groups of get_age_groups(age_min, age_max), or of age_groups if a
+    dictionary with the same structure is passed, labelled by their (min, max) tuple and named
+    like '15-19'.
+    '''
+
+    if age_groups is None:
+        age_groups = get_age_groups(age_min, age_max)
+
+    targeting = {}
+
+    for age_group in age_groups:
+
+        targeting[age_group] = {'age_min': age_group[0]}
+
+        if len(age_group) > 1:
+            targeting[age_group]['age_max'] = age_group[1]
+
+    return Axis(name, targeting, [age_groups[age_group]['name'] for age_group in age_groups])
+
+class Sweep:
+
+    '''
+    The Cartesian product of some axes, e.g. destinations x origins x genders x age groups. Every
+    cell is a tuple with one label per axis, whose targeting spec is base updated with the fields of
+    its labels. The cells and their specs are generated lazily, chunk by chunk, so that the product
+    is never held in memory as a whole, and all the sweeps run through engine.run (deduplication,
+    cache, batches and rate limit included).
+
+    Arguments:
+
+        - axes: the list of Axis objects, in the order of the dimensions of the result;
+        - base: the targeting spec fields shared by all the cells (e.g. the age range of the
+                migration table), which the axes can override.
+
+    Two axes cannot set the same field of the spec, since merging it would change its meaning (two
+    lists of behaviors are joined with an or, not an and), so a ValueError is raised; such axes
+    can use flexible_spec instead, whose lists are concatenated.
+    '''
+
+    def __init__(self, axes, base=None):
+
+        self.axes = list(axes)
+        self.base = {} if base is None else dict(base)
+
+        names = [axis.name for axis in self.axes]
+        if len(set(names)) < len(names):
+            raise ValueError('The names of the axes of a sweep must be different: {}'.format(names))
+
+    @property
+    def shape(self):
+
+        return tuple(len(axis) for axis in self.axes)
+
+    def __len__(self):
+
+        size = 1
+        for axis in self.axes:
+            size *= len(axis)
+
+        return size
+
+    def __repr__(self):
+
+        return 'Sweep({})'.format(' x '.join('{} {}'.format(len(axis), axis.name) for axis in self.axes))
+
+    def keys(self):
+
+        '''
+        Returns an iterator over the cells, in the order of the result.
+        '''
+
+        return itertools.product(*(axis.labels for axis in self.axes))
+
+    def spec(self, key):
+
+        '''
+        Returns the targeting spec of a cell.
+        '''
+
+        fields = {}
+
+        for axis, label in zip(self.axes, key):
+            for field, value in axis.targeting[label].items():
+
+                if field == 'flexible_spec':
+                    fields[field] = fields.get(field, []) + list(value)
+                elif field in fields:
+                    raise ValueError('Two axes of the sweep set the {} field of the targeting spec'.format(field))
+                else:
+                    fields[field] = value
+
+        spec = dict(self.base)
+        spec.update(fields)
+
+        return spec
+
+    def specs(self):
+
+        '''
+        Returns an iterator over the (cell, targeting spec) pairs of the sweep.
+        '''
+
+        return ((key, self.spec(key)) for key in self.keys())
+
+    def buffer(self):
+
+        '''
+        Returns an empty ResultBuffer with the axes of the sweep.
+        '''
+
+        return ResultBuffer({axis.name: axis.labels for axis in self.axes},
+                            {axis.name: axis.coords for axis in self.axes})
+
+    def run(self, engine, buffer=None, desc='sweep', callback=None, chunk_size=100000):
+
+        '''
+        Fetches the cells of the sweep that are still missing in buffer (by default a new one, see
+        Sweep.buffer) through engine.run, chunk_size cells at a time, and writes the results in
+        buffer. callback is passed to engine.run. The output is a tuple with the buffer and a
+        dictionary with the errors of the cells that could not be fetched. A KeyboardInterrupt
+        stops the whole sweep: the cells answered so far are written in buffer and the interrupt
+        is raised again.
+        '''
+
+        buffer = self.buffer() if buffer is None else buffer
+        errors = {}
+
+        keys = self.keys()
+
+        while True:
+
+            chunk = list(itertools.islice(keys, chunk_size))
+
+            if not chunk:
+                break
+
+            requests = {key: self.spec(key) for key, is_missing in zip(chunk, buffer.is_missing(chunk)) if is_missing}
+
+            if not requests:
+                continue
+
+            answered = {}
+
+            def collect(key, spec, users):
+                answered[key] = users
+                if callback is not None:
+                    callback(key, spec, users)
+
+            try:
+                results, chunk_errors = engine.run(requests, desc=desc, callback=collect)
+            except KeyboardInterrupt:
+                buffer.fill(answered)
+                raise
+
+            buffer.fill(results)
+            errors.update(chunk_errors)
+
+        return buffer, errors
+
+def run_sweep(access_token, user_id, destinations='all', origins='all', axes=(), age_min=18, age_max=65,
+              total=True, engine=None, max_workers=4, backend=None):
+
+    '''
+    Runs a sweep over destinations, origins and any number of other axes, and returns its results
+    as an N-dimensional ResultBuffer, e.g.
+
+        result = run_sweep(access_token, user_id, ['Italy', 'Spain'], 'all', axes=[gender_axis(), age_axis(18, 65)])
+        result.sel(destination='Italy', gender='female').to_series()
+        result.to_xarray()  # if xarray is installed
+
+    Arguments:
+
+        - destinations and origins: lists of country names or 'all', as in gen_mig_table. origins
+                                    can be None for a sweep over the whole population of the
+                                    destinations;
+        - axes: the other Axis objects, e.g. gender_axis(), age_axis() or a custom one;
+        - age_min and age_max: the age range of the cells, ignored if an age axis is passed;
+        - total: if True, the origins have a last 'Total Population' label;
+        - engine, max_workers and backend: as in gen_mig_table.
+
+    The cells that could not be fetched are NaN and their errors are printed.
+    '''
+
+    engine = get_engine(user_id, engine, max_workers=max_workers, backend=backend, access_token=access_token)
+
+    catalog = get_catalog(access_token, backend=engine.backend)
+    dest_dict = catalog.destinations
+    origin_dict = catalog.origins
+
+    if destinations == 'all':
+        destinations = list(dest_dict.keys())
+
+    if origins == 'all':
+        origins = list(origin_dict.keys())
+
+    # imported here since migration_utils builds on this module
+    from .migration_utils import check_countries
+
+    check_countries(destinations, dest_dict)
+    sweep_axes = [destination_axis(destinations, dest_dict)]
+
+    if origins is not None:
+        check_countries(origins, origin_dict)
+        sweep_axes.append(origin_axis(origins, origin_dict, total))
+
+    sweep_axes += list(axes)
+
+    # an age axis sets the ages of every cell on its own
+    if any('age_min' in fields for axis in sweep_axes for fields in axis.targeting.values()):
+        base = {}
+    else:
+        base = {'age_min': age_min, 'age_max': age_max}
+
+    sweep = Sweep(sweep_axes, base)
+    buffer, errors = sweep.run(engine, desc='sweep')
+
+    for error in set(map(str, errors.values())):
+        print(error)
+
+    return buffer
@@ -0,0 +1,179 @@
+class ResultBuffer:
+
+    '''
+    A preallocated NumPy array holding the results of a sweep, with one axis per dimension of the
+    sweep (e.g. destination and origin, or destination, origin, gender and age group). Results are
+    written at integer positions looked up in a dictionary per axis, and the pandas objects are
+    built only once, at the end of the sweep or when they are requested, instead of paying the
+    indexing overhead of DataFrame.loc for every cell. Cells that have not been filled are NaN.
+
+    Arguments:
+
+        - axes: a dictionary whose keys are the names of the dimensions and whose values are the
+                lists of labels along each dimension, in order;
+        - coords: an optional dictionary with the names shown for the labels of some of the axes
+                  (e.g. 'male' for the gender 1 of the targeting specs), in the same order. The
+                  results are still filled by label, while sel, to_series and to_xarray use the
+                  names.
+    '''
+
+    def __init__(self, axes, coords=None):
+
+        import numpy as np
+
+        self.axes = {name: list(labels) for name, labels in axes.items()}
+        self.coords = {name: list(labels) for name, labels in self.axes.items()}
+        self.coords.update({name: list(names) for name, names in (coords or {}).items()})
+        self.positions = [{label: position for position, label in enumerate(labels)}
+                          for labels in self.axes.values()]
+        self.values = np.full([len(labels) for labels in self.axes.values()], np.nan)
+
+    @property
+    def dims(self):
+
+        return tuple(self.axes)
+
+    @property
+    def shape(self):
+
+        return self.values.shape
+
+    @classmethod
+    def from_frame(cls, frame, index_name='destination', columns_name='origin'):
+
+        '''
+        Builds a two dimensional buffer holding the values of a DataFrame.
+        '''
+
+        import numpy as np
+
+        buffer = cls({index_name: list(frame.index), columns_name: list(frame.columns)})
+        buffer.values[:] = frame.to_numpy(dtype=float, na_value=np.nan)
+
+        return buffer
+
+    def _index(self, keys):
+
+        import numpy as np
+
+        keys = list(keys)
+
+        return tuple(np.fromiter((positions[key[axis]] for key in keys), dtype=np.intp, count=len(keys))
+                     for axis, positions in enumerate(self.positions))
+
+    def fill(self, results):
+
+        '''
+        Writes all the results at once. results is a dictionary whose keys are tuples with one
+        label per axis and whose values are numbers.
+        '''
+
+        import numpy as np
+
+        if results:
+            self.values[self._index(results.keys())] = np.fromiter(results.values(), dtype=float,
+                                                                   count=len(results))
+
+    def is_missing(self, keys):
+
+        '''
+        Returns a boolean array telling which of the keys (tuples with one label per axis) have no
+        value yet. Keys with labels that are not on the axes are reported as missing.
+        '''
+
+        import numpy as np
+
+        keys = list(keys)
+        known = np.array([all(label in positions for label, positions in zip(key, self.positions))
+                          for key in keys], dtype=bool)
+        missing = np.ones(len(keys), dtype=bool)
+
+        if known.any():
+            known_keys = [key for key, is_known in zip(keys, known) if is_known]
+            missing[known] = np.isnan(self.values[self._index(known_keys)])
+
+        return missing
+
+    def to_frame(self):
+
+        '''
+        Returns a DataFrame of a two dimensional buffer, with the first axis as index and the second
+        one as columns.
+        '''
+
+        import pandas as pd
+
+        index, columns = self.axes.values()
+
+        return pd.DataFrame(self.values.copy(), index=index, columns=columns)
+
+    def sel(self, **coords):
+
+        '''
+        Selects the cells with the given names along some of the axes, e.g.
+        buffer.sel(destination='Italy', gender='female'), like the sel of xarray. A single name
+        drops its axis and a list of names keeps it. The output is a new ResultBuffer, or a number
+        when every axis is selected.
+        '''
+
+        index = []
+        axes = {}
+        names = {}
+
+        for name in self.axes:
+
+            if name not in coords:
+                index.append(slice(None))
+                axes[name] = self.axes[name]
+                names[name] = self.coords[name]
+                continue
+
+            selected = coords.pop(name)
+            single = not isinstance(selected, list)
+            positions = [self.coords[name].index(label) for label in ([selected] if single else selected)]
+
+            if single:
+                index.append(positions[0])
+            else:
+                index.append(positions)
+                axes[name] = [self.axes[name][position] for position in positions]
+                names[name] = [self.coords[name][position] for position in positions]
+
+        if coords:
+            raise KeyError('The buffer has no axis {}'.format(', '.join(coords)))
+
+        values = self.values
+        # one axis at a time, since NumPy would pair the lists of positions instead of crossing them
+        for axis in reversed(range(len(index))):
+            values = values[(slice(None),) * axis + (index[axis],)]
+
+        if not axes:
+            return float(values)
+
+        buffer = ResultBuffer(axes, names)
+        buffer.values[:] = values
+
+        return buffer
+
+    def to_series(self):
+
+        '''
+        Returns the buffer as a long Series with one level of the MultiIndex per axis.
+        '''
+
+        import pandas as pd
+
+        index = pd.MultiIndex.from_product(list(self.coords.values()), names=list(self.coords.keys()))
+
+        return pd.Series(self.values.ravel(), index=index)
+
+    def to_xarray(self):
+
+        '''
+        Returns the buffer as an xarray DataArray with one dimension per axis, indexed by the names
+        of the labels. Requires xarray.
+        '''
+
+        import xarray as xr
+
+        return xr.DataArray(self.values.copy(), coords=self.coords, dims=self.dims)
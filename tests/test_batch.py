@@ -0,0 +1,126 @@
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from migrationtracker.backend_utils import FacebookBackend
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.rate_utils import TokenBucket
+
+USAGE = [{'name': 'x-app-usage', 'value': json.dumps({'call_count': 10, 'total_cputime': 5, 'total_time': 5})}]
+
+def spec(age_min):
+
+    return {'geo_locations': {'countries': ['IT']}, 'age_min': age_min}
+
+class MockGraph(HTTPServer):
+
+    '''
+    A local stand-in for the Graph Api batch endpoint. The answer of every item depends on the
+    age_min of its targeting spec: the ages in rate_limited hit the rate limit the first time they
+    are sent, those in failing always get a non retryable error, those in unanswered get no answer
+    (null) the first time, and the other ones get 1000 * age_min users.
+    '''
+
+    def __init__(self, rate_limited=(), failing=(), unanswered=()):
+
+        super().__init__(('127.0.0.1', 0), MockGraphHandler)
+
+        self.rate_limited = set(rate_limited)
+        self.failing = set(failing)
+        self.unanswered = set(unanswered)
+        self.batches = []
+
+    def answer(self, item):
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(item['relative_url']).query)
+        age_min = json.loads(query['targeting_spec'][0])['age_min']
+        self.batches[-1].append(age_min)
+
+        if age_min in self.unanswered:
+            self.unanswered.discard(age_min)
+            return None
+
+        if age_min in self.rate_limited:
+            self.rate_limited.discard(age_min)
+            error = {'message': 'User request limit reached', 'code': 17, 'type': 'OAuthException'}
+            return {'code': 400, 'headers': USAGE, 'body': json.dumps({'error': error})}
+
+        if age_min in self.failing:
+            error = {'message': 'Invalid parameter', 'code': 100, 'type': 'OAuthException'}
+            return {'code': 400, 'headers': USAGE, 'body': json.dumps({'error': error})}
+
+        body = {'data': {'users': 1000 * age_min, 'estimate_ready': True}}
+
+        return {'code': 200, 'headers': USAGE, 'body': json.dumps(body)}
+
+class MockGraphHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+
+        length = int(self.headers['Content-Length'])
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8'))
+
+        self.server.batches.append([])
+        answers = [self.server.answer(item) for item in json.loads(form['batch'][0])]
+        body = json.dumps(answers).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+
+        pass
+
+@pytest.fixture
+def graph(monkeypatch):
+
+    servers = []
+
+    def start(**kwargs):
+        server = MockGraph(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        monkeypatch.setattr('facebook_business.session.FacebookSession.GRAPH',
+                            'http://127.0.0.1:{}'.format(server.server_port))
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_batch_unpacks_the_result_or_the_error_of_every_item(graph):
+
+    server = graph(failing=[31], unanswered=[32])
+    backend = FacebookBackend('act_1', 'token')
+
+    outcomes = backend.reach_estimate_batch([spec(30), spec(31), spec(32)])
+
+    assert outcomes[0][0] == 30000
+    assert backend.is_rate_limit_error(outcomes[1]) is False
+    assert outcomes[1].api_error_code() == 100
+    assert outcomes[2][0] == 32000
+    assert dict((header['name'], header['value']) for header in outcomes[2][1]) == {'x-app-usage': USAGE[0]['value']}
+
+    # the item with no answer is sent again on its own
+    assert server.batches == [[30, 31, 32], [32]]
+
+def test_engine_retries_only_the_items_that_hit_the_rate_limit(graph):
+
+    server = graph(rate_limited=[21, 23], failing=[24])
+    backend = FacebookBackend('act_1', 'token')
+    engine = ReachEngine(limiter=TokenBucket(rate=1000), backend=backend, batch_size=5, max_workers=1)
+
+    results, errors = engine.run({age: spec(age) for age in range(20, 25)})
+
+    assert results == {20: 20000, 21: 21000, 22: 22000, 23: 23000}
+    assert list(errors) == [24]
+    assert errors[24].api_error_code() == 100
+    assert server.batches == [[20, 21, 22, 23, 24], [21, 23]]
@@ -0,0 +1,70 @@
+import json
+import time
+
+import pytest
+
+from migrationtracker.backend_utils import FacebookBackend, SimulatorBackend
+from migrationtracker.engine_utils import ReachEngine, get_engine
+from migrationtracker.migration_utils import gen_mig_table
+from migrationtracker.rate_utils import TokenBucket
+
+def test_engine_built_by_hand_uses_its_access_token():
+
+    engine = ReachEngine('act_123', access_token='TOKEN')
+
+    assert engine.backend.access_token == 'TOKEN'
+    assert engine.backend.api._session.access_token == 'TOKEN'
+
+def test_get_engine_gives_the_access_token_to_an_engine_without_one():
+
+    engine = ReachEngine('act_123')
+
+    assert get_engine('act_123', engine, access_token='TOKEN') is engine
+    assert engine.backend.api._session.access_token == 'TOKEN'
+
+    # a token already set is kept
+    get_engine('act_123', engine, access_token='OTHER')
+    assert engine.backend.api._session.access_token == 'TOKEN'
+
+def test_get_engine_keeps_the_backend_of_a_passed_engine():
+
+    backend = SimulatorBackend(n_countries=2)
+    engine = ReachEngine(backend=backend)
+
+    assert get_engine(None, engine, access_token='TOKEN').backend is backend
+    assert not isinstance(engine.backend, FacebookBackend)
+
+def test_gen_mig_table_calls_the_api_with_its_access_token(tmp_path, monkeypatch):
+
+    simulator = SimulatorBackend(countries=['Italy', 'Spain'])
+    catalog = {'fetched_at': time.time(), 'destinations': simulator.destinations(), 'origins': simulator.origins()}
+    (tmp_path / FacebookBackend.catalog_path).write_text(json.dumps(catalog))
+    monkeypatch.chdir(tmp_path)
+
+    tokens = []
+
+    def reach_estimate(backend, targeting_spec):
+        tokens.append(backend.api._session.access_token)
+        return 1000, {}
+
+    monkeypatch.setattr(FacebookBackend, 'reach_estimate', reach_estimate)
+
+    engine = ReachEngine('act_123', limiter=TokenBucket(rate=1000))
+    table = gen_mig_table('TOKEN', 'act_123', ['Italy'], ['Spain'], engine=engine)[0]
+
+    assert tokens == ['TOKEN', 'TOKEN']
+    assert table.loc['Italy', 'Spain'] == 1000
+
+def test_an_interrupted_run_raises_once_the_workers_are_stopped():
+
+    backend = SimulatorBackend(n_countries=2)
+    engine = ReachEngine(limiter=TokenBucket(rate=1000), backend=backend)
+    requests = {i: {'geo_locations': {'countries': ['X001']}, 'age_min': 13, 'age_max': 13 + i} for i in range(50)}
+
+    def callback(key, spec, users):
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        engine.run(requests, callback=callback)
+
+    assert backend.call_counter < len(requests)
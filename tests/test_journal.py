@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+import pytest
+
+from migrationtracker.backend_utils import SimulatorBackend
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.journal_utils import JobJournal
+from migrationtracker.migration_utils import gen_mig_table, resume
+from migrationtracker.rate_utils import TokenBucket
+
+DESTINATIONS = ['Country 1', 'Country 2', 'Country 3']
+
+def engine(backend):
+
+    return ReachEngine(limiter=TokenBucket(rate=1000), backend=backend)
+
+def test_resume_does_not_refetch_the_cells_carried_forward(tmp_path):
+
+    backend = SimulatorBackend(n_countries=6)
+    previous = gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend))[0]
+
+    incremental = gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend), previous=previous,
+                                job_id='incremental', journal_dir=str(tmp_path))[0]
+    staleness = incremental.attrs['staleness']
+    carried = int((staleness.values > 0).sum())
+
+    assert 0 < carried < staleness.size
+
+    # a crash right after the carried cells were journaled loses every fetched cell
+    journal = JobJournal('incremental', str(tmp_path))
+    with open(journal.path) as log:
+        lines = [line for line in log if 'spec' not in json.loads(line)]
+    with open(journal.path, 'w') as log:
+        log.writelines(lines)
+
+    calls = backend.call_counter
+    resumed = resume('incremental', None, None, str(tmp_path), engine=engine(backend))[0]
+
+    assert backend.call_counter - calls == staleness.size - carried
+    np.testing.assert_array_equal(resumed.to_numpy(), incremental.to_numpy())
+    assert resumed.attrs['staleness'].equals(staleness)
+
+def test_a_job_id_cannot_be_reused_for_another_sweep(tmp_path):
+
+    backend = SimulatorBackend(n_countries=6)
+    gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend), job_id='job', journal_dir=str(tmp_path))
+
+    with pytest.raises(ValueError, match='destinations'):
+        gen_mig_table(None, None, DESTINATIONS[:2], 'all', engine=engine(backend), job_id='job',
+                      journal_dir=str(tmp_path))
+
+    # the same sweep can still be run again with its job_id
+    calls = backend.call_counter
+    table = resume('job', None, None, str(tmp_path), engine=engine(backend))[0]
+
+    assert backend.call_counter == calls
+    assert list(table.index) == DESTINATIONS
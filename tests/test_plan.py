@@ -0,0 +1,22 @@
+from migrationtracker.backend_utils import SimulatorBackend
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.plan_utils import plan_sweep
+from migrationtracker.query_utils import get_tables
+from migrationtracker.rate_utils import TokenBucket
+
+TABLES = ('mig_table', 'age_structure_countries')
+
+def test_plan_bounds_the_calls_of_get_tables():
+
+    backend = SimulatorBackend(n_countries=4)
+    engine = ReachEngine(limiter=TokenBucket(rate=1000), backend=backend)
+
+    plan = plan_sweep(None, None, ['Country 1', 'Country 2'], 'all', 18, 65, tables=TABLES, backend=backend)
+
+    assert plan.derived
+    assert len(plan.refetch) == len(plan.derived)
+    assert plan.summary()['max_calls'] == plan.n_calls + len(plan.derived)
+
+    get_tables(None, None, ['Country 1', 'Country 2'], 'all', TABLES, 18, 65, engine=engine)
+
+    assert plan.n_calls <= backend.call_counter <= plan.max_calls
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from migrationtracker.backend_utils import SimulatorBackend
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.journal_utils import JobJournal
+from migrationtracker.migration_utils import gen_mig_table
+from migrationtracker.rate_utils import TokenBucket
+from migrationtracker.refresh_utils import RefreshPolicy
+
+DESTINATIONS = ['Country 1', 'Country 2', 'Country 3', 'Country 4']
+
+def engine(backend):
+
+    return ReachEngine(limiter=TokenBucket(rate=1000), backend=backend)
+
+def test_select_refreshes_large_changing_stale_and_missing_cells():
+
+    previous = pd.DataFrame([[1000.0, 20000.0, 1000.0, np.nan, 5e6],
+                             [1000.0, 1000.0, 3000.0, 1000.0, 8e6]],
+                            index=['Italy', 'Spain'],
+                            columns=['Morocco', 'India', 'Peru', 'Chile', 'Total Population'])
+    history = [previous.replace(3000.0, 2000.0)]
+    staleness = pd.DataFrame(0, index=previous.index, columns=previous.columns)
+    staleness.loc['Spain', 'Chile'] = 5
+
+    refresh = RefreshPolicy(large=10000, change=0.1, rotation=6).select(previous, staleness, history)
+
+    expected = pd.DataFrame([[False, True, False, True, True],
+                             [False, False, True, True, True]],
+                            index=previous.index, columns=previous.columns)
+
+    assert refresh.equals(expected)
+
+def test_incremental_sweep_fetches_only_the_selected_cells():
+
+    backend = SimulatorBackend(n_countries=12)
+    previous = gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend))[0]
+
+    policy = RefreshPolicy()
+    refresh = policy.select(previous).to_numpy()
+
+    assert 0 < refresh.sum() < refresh.size
+
+    calls = backend.call_counter
+    table = gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend), previous=previous,
+                          refresh_policy=policy)[0]
+    staleness = table.attrs['staleness']
+
+    assert backend.call_counter - calls == refresh.sum()
+    np.testing.assert_array_equal(table.to_numpy(), previous.to_numpy())
+    np.testing.assert_array_equal(staleness.to_numpy() == 0, refresh)
+
+    # the next run refreshes the cells that would otherwise go stale for a whole rotation
+    calls = backend.call_counter
+    following = gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend), previous=table,
+                              refresh_policy=policy)[0]
+    expected = policy.select(table, staleness).to_numpy()
+
+    assert backend.call_counter - calls == expected.sum()
+    np.testing.assert_array_equal(following.attrs['staleness'].to_numpy() == 0, expected)
+    assert following.attrs['staleness'].to_numpy().max() < policy.rotation
+
+def test_incremental_sweep_journals_the_carried_cells(tmp_path):
+
+    backend = SimulatorBackend(n_countries=12)
+    previous = gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend))[0]
+
+    table = gen_mig_table(None, None, DESTINATIONS, 'all', engine=engine(backend), previous=previous,
+                          job_id='incremental', journal_dir=str(tmp_path))[0]
+    staleness = table.attrs['staleness']
+
+    _, cells = JobJournal('incremental', str(tmp_path)).read()
+    carried = {(cell['destination'], cell['origin']): cell for cell in cells if 'staleness' in cell}
+    fetched = {(cell['destination'], cell['origin']) for cell in cells if 'staleness' not in cell}
+
+    assert set(carried) == {(destination, origin) for destination in staleness.index
+                            for origin in staleness.columns if staleness.loc[destination, origin] > 0}
+    assert fetched.isdisjoint(carried)
+    assert len(carried) + len(fetched) == table.size
+
+    for (destination, origin), cell in carried.items():
+        assert cell['users'] == previous.loc[destination, origin]
+        assert cell['staleness'] == staleness.loc[destination, origin]
@@ -0,0 +1,50 @@
+import numpy as np
+
+from migrationtracker.backend_utils import SimulatorBackend, reach_bounds
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.rate_utils import TokenBucket
+from migrationtracker.region_utils import gen_region_table, reconcile_regions
+
+DESTINATIONS = ['Country 1', 'Country 2', 'Country 3']
+
+def test_reconciled_regions_add_up_to_the_country_table():
+
+    backend = SimulatorBackend(n_countries=10, n_regions=6)
+    engine = ReachEngine(limiter=TokenBucket(rate=1000), backend=backend)
+
+    regions, mig_table = gen_region_table(None, None, DESTINATIONS, 'all', engine=engine)
+    origins = list(regions.columns)
+
+    # only the pairs above the floor are split, the Total Population always is
+    split = (mig_table[origins] > 1000).to_numpy()
+    assert split[:, -1].all() and not split.all()
+    assert backend.call_counter == mig_table.size + 6 * split.sum()
+
+    reconciled = reconcile_regions(regions, mig_table)
+    residual = reconciled.attrs['residual']
+
+    for destination in DESTINATIONS:
+
+        parts = regions.loc[destination].to_numpy()
+        fixed = reconciled.loc[destination].to_numpy()
+        total = mig_table.loc[destination, origins].to_numpy(dtype=float)
+        is_split = split[DESTINATIONS.index(destination)]
+
+        assert np.isnan(fixed[:, ~is_split]).all()
+
+        parts, fixed, total = parts[:, is_split], fixed[:, is_split], total[is_split]
+        lower = reach_bounds(parts)[0]
+
+        # every part only moves within its rounding interval, and only downwards
+        assert (fixed <= parts + 1e-9).all() and (fixed >= lower - 1e-9).all()
+
+        # a sum too large for the total is brought down to it whenever the lower bounds allow it
+        too_large = parts.sum(axis=0) > reach_bounds(total)[1]
+        reducible = too_large & (lower.sum(axis=0) <= total)
+
+        assert too_large.any()
+        np.testing.assert_allclose(fixed.sum(axis=0)[reducible], total[reducible])
+        np.testing.assert_array_equal(fixed[:, ~too_large], parts[:, ~too_large])
+
+        np.testing.assert_allclose(residual.loc[destination, origins].to_numpy(dtype=float)[is_split],
+                                   total - fixed.sum(axis=0), atol=1e-6)
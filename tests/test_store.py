@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from migrationtracker.store_utils import SnapshotStore
+
+AGES = ['18-24', '25-64']
+
+def mig_table(scale=1):
+
+    return pd.DataFrame([[2000.0 * scale, 50000.0 * scale], [3000.0 * scale, 80000.0 * scale]],
+                        index=['Italy', 'Spain'], columns=['Morocco', 'Total Population'])
+
+def age_str_dict(destinations, scale=1):
+
+    table = pd.DataFrame(1000.0 * scale, index=AGES, columns=['male', 'female'])
+
+    return {destination: {'Morocco': {'age_structure_table': table}} for destination in destinations}
+
+def test_storing_the_mig_table_keeps_the_age_structure_of_the_snapshot(tmp_path):
+
+    store = SnapshotStore(str(tmp_path / 'store'))
+
+    store.append_mig_table(mig_table(), '2019-07-01')
+    store.append_age_str_dict(age_str_dict(['Italy']), '2019-07-01')
+    store.append_mig_table(mig_table(2), '2019-07-01')
+
+    stored = store.read()
+
+    assert set(stored['table']) == {'mig_table', 'age_structure_mig'}
+    assert len(stored[stored['table'] == 'age_structure_mig']) == 4
+    assert store.series('Italy', 'Morocco').tolist() == [4000.0]
+
+def test_a_repeated_append_replaces_the_stored_cells(tmp_path):
+
+    store = SnapshotStore(str(tmp_path / 'store'))
+
+    store.append_age_str_dict(age_str_dict(['Italy']), '2019-07-01')
+    store.append_age_str_dict(age_str_dict(['Italy', 'Spain'], scale=2), '2019-07-01')
+    store.append_mig_table(mig_table(), '2019-07-01')
+    store.append_mig_table(mig_table(), '2019-07-01')
+
+    stored = store.read()
+    ages = stored[stored['table'] == 'age_structure_mig']
+
+    assert len(ages) == 8
+    assert (ages['reach'] == 2000.0).all()
+    assert len(stored[stored['table'] == 'mig_table']) == 4
+
+def test_appending_a_part_of_a_table_keeps_the_other_parts(tmp_path):
+
+    store = SnapshotStore(str(tmp_path / 'store'))
+
+    store.append_age_str_dict(age_str_dict(['Italy']), '2019-07-01')
+    store.append_age_str_dict(age_str_dict(['Spain'], scale=3), '2019-07-01')
+
+    ages = store.read(tables='age_structure_mig').set_index(['destination', 'age_group', 'gender'])['reach']
+
+    assert len(ages) == 8
+    assert ages.loc['Italy'].eq(1000.0).all()
+    assert ages.loc['Spain'].eq(3000.0).all()
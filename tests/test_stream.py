@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from migrationtracker.backend_utils import SimulatorBackend
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.pool_utils import EnginePool
+from migrationtracker.rate_utils import TokenBucket
+from migrationtracker.stream_utils import astream, stream_requests
+
+def slow_stream(release, closed):
+
+    try:
+        yield 1
+        release.wait(5)
+        yield 2
+    finally:
+        closed.set()
+
+def test_astream_yields_the_records_of_a_sweep():
+
+    backend = SimulatorBackend(n_countries=5)
+    engine = ReachEngine(limiter=TokenBucket(rate=1000), backend=backend)
+    requests = {i: {'geo_locations': {'countries': ['X001']}, 'age_min': 18 + i} for i in range(5)}
+
+    async def consume():
+        return [record async for record in astream(stream_requests(engine, requests))]
+
+    records = asyncio.run(consume())
+
+    assert sorted(record[0] for record in records) == list(range(5))
+
+def test_cancelling_astream_closes_the_stream_once_the_pending_record_arrives():
+
+    release = threading.Event()
+    closed = threading.Event()
+
+    async def consume(received):
+        async for record in astream(slow_stream(release, closed)):
+            received.append(record)
+
+    async def main():
+        received = []
+        task = asyncio.ensure_future(consume(received))
+
+        while not received:
+            await asyncio.sleep(0.01)
+
+        # the second record is being waited for in the executor
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert not closed.is_set()
+        release.set()
+
+        return received
+
+    assert asyncio.run(main()) == [1]
+    assert closed.wait(5)
+
+def test_a_slow_consumer_holds_the_sweep_back():
+
+    backend = SimulatorBackend(n_countries=5)
+    engine = ReachEngine(limiter=TokenBucket(rate=1e6, burst=1000), backend=backend, max_workers=4)
+    requests = {i: {'geo_locations': {'countries': ['X001']}, 'age_min': 13, 'age_max': 13 + i}
+                for i in range(2000)}
+
+    stream = stream_requests(engine, requests, max_pending=10)
+    next(stream)
+    time.sleep(0.5)
+
+    # the answers waiting in the stream plus the requests in flight, far from the 2000 of the sweep
+    assert backend.call_counter <= 1 + 10 + 10 + engine.max_workers
+
+    stream.close()
+    assert backend.call_counter < 2000
+
+def test_a_slow_consumer_holds_an_engine_pool_back():
+
+    backends = [SimulatorBackend(n_countries=5) for _ in range(2)]
+    pool = EnginePool([ReachEngine(limiter=TokenBucket(rate=1e6, burst=1000), backend=backend, max_workers=2)
+                       for backend in backends])
+    requests = {i: {'geo_locations': {'countries': ['X001']}, 'age_min': 13, 'age_max': 13 + i}
+                for i in range(2000)}
+
+    stream = stream_requests(pool, requests, max_pending=10)
+    next(stream)
+    time.sleep(0.5)
+
+    assert sum(backend.call_counter for backend in backends) <= 1 + 10 + 10 + 4
+
+    stream.close()
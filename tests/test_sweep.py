@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from migrationtracker.backend_utils import SimulatorBackend
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.rate_utils import TokenBucket
+from migrationtracker.sweep_utils import Axis, Sweep
+
+def test_an_interrupt_stops_every_chunk_of_a_sweep():
+
+    backend = SimulatorBackend(n_countries=2)
+    engine = ReachEngine(limiter=TokenBucket(rate=1000), backend=backend, max_workers=1)
+    sweep = Sweep([Axis('age', {age: {'age_min': age, 'age_max': age} for age in range(13, 66)})],
+                  base={'geo_locations': {'countries': ['X001']}})
+
+    answered = []
+
+    def callback(key, spec, users):
+        answered.append(key)
+        if len(answered) == 3:
+            raise KeyboardInterrupt()
+
+    buffer = sweep.buffer()
+
+    with pytest.raises(KeyboardInterrupt):
+        sweep.run(engine, buffer, callback=callback, chunk_size=10)
+
+    # the next chunks are never run and the cells answered before the interrupt are kept
+    assert backend.call_counter < 10
+    assert int((~np.isnan(buffer.values)).sum()) == 3
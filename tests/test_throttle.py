@@ -0,0 +1,110 @@
+import json
+
+from migrationtracker.backend_utils import SimulatorBackend, SimulatedRateLimitError
+from migrationtracker.engine_utils import ReachEngine
+from migrationtracker.rate_utils import TokenBucket, ThrottleController, parse_usage_headers
+
+SPEC = {'geo_locations': {'countries': ['X001']}}
+
+def usage_headers(usage, regain_minutes=0):
+
+    return SimulatorBackend()._usage_headers(usage, regain_minutes)
+
+def account_headers(usage, reset_seconds):
+
+    return {'x-ad-account-usage': json.dumps({'acc_id_util_pct': usage, 'reset_time_duration': reset_seconds})}
+
+class ScriptedBackend(SimulatorBackend):
+
+    '''
+    A SimulatorBackend whose calls answer, in order, with the scripted outcomes: a number is the
+    usage reported by a successful call, a dictionary the headers of a rate limit error.
+    '''
+
+    def __init__(self, script, **kwargs):
+
+        super().__init__(n_countries=5, **kwargs)
+        self.script = list(script)
+
+    def reach_estimate(self, targeting_spec):
+
+        self.call_counter += 1
+        outcome = self.script.pop(0) if self.script else 0
+
+        if isinstance(outcome, dict):
+            raise SimulatedRateLimitError('Scripted call limit reached', outcome)
+
+        return self._users(targeting_spec), usage_headers(outcome)
+
+def test_parse_usage_headers():
+
+    assert parse_usage_headers({}) == (None, 0)
+    assert parse_usage_headers(usage_headers(42, 2)) == (42, 120)
+    assert parse_usage_headers(account_headers(30, 5)) == (30, 5)
+
+def test_high_usage_lowers_the_rate_at_once():
+
+    limiter = TokenBucket(rate=10)
+    throttle = ThrottleController(limiter, low_usage=50, high_usage=90)
+
+    assert throttle.update(usage_headers(70)) == 0
+    assert limiter.rate == 5
+    assert throttle.usage == 70
+
+    throttle.update(usage_headers(99))
+    assert limiter.rate == 10 * throttle.min_share
+
+def test_low_usage_does_not_undo_a_backoff():
+
+    limiter = TokenBucket(rate=10, increase=0.5)
+    throttle = ThrottleController(limiter)
+
+    throttle.penalize(usage_headers(100))
+    assert limiter.rate == 5
+
+    throttle.update(usage_headers(0))
+    assert limiter.rate == 5.5
+
+    for _ in range(20):
+        throttle.update(usage_headers(0))
+
+    assert limiter.rate == 10
+
+def test_regain_time_pauses_instead_of_backing_off():
+
+    limiter = TokenBucket(rate=10)
+    throttle = ThrottleController(limiter)
+
+    assert throttle.penalize(account_headers(100, 30)) == 30
+    assert limiter.rate == 10
+    assert 29 < limiter.paused_for() <= 30
+
+    assert throttle.update(usage_headers(80, regain_minutes=1)) == 60
+    assert 59 < limiter.paused_for() <= 60
+
+def test_engine_retries_the_cells_that_hit_the_rate_limit():
+
+    backend = ScriptedBackend([10, usage_headers(100), 10, 10])
+    engine = ReachEngine(limiter=TokenBucket(rate=1000, increase=1), backend=backend, max_workers=1)
+
+    requests = {i: dict(SPEC, age_min=18 + i) for i in range(3)}
+    results, errors = engine.run(requests)
+
+    assert errors == {}
+    assert results == {key: backend._users(spec) for key, spec in requests.items()}
+    assert backend.call_counter == 4
+    assert engine.instrumentation.snapshot()['retries'] == 1
+
+    # the back-off is only recovered one step at a time by the calls that followed
+    assert engine.limiter.rate == 500 + 2
+
+def test_engine_gives_up_after_max_retries():
+
+    backend = ScriptedBackend([usage_headers(100)] * 3)
+    engine = ReachEngine(limiter=TokenBucket(rate=1000), backend=backend, max_workers=1, max_retries=2)
+
+    results, errors = engine.run({'cell': SPEC})
+
+    assert results == {}
+    assert isinstance(errors['cell'], SimulatedRateLimitError)
+    assert backend.call_counter == 3